@@ -931,16 +931,24 @@ def __(economics):
 
 
 @app.cell
-def __(aes, economics, geom_path, geom_point, ggplot, pd, pw):
-    economics['year'] = pd.to_datetime(economics['date']).dt.year
+def __():
+    from pnbook.frames import derive
+    return (derive,)
+
+
+@app.cell
+def __(aes, derive, economics, geom_path, geom_point, ggplot, pd, pw):
+    _economics = derive(
+        economics, year=lambda df: pd.to_datetime(df["date"]).dt.year
+    )
     (
         pw.load_ggplot(
-            ggplot(economics, aes("unemploy / pop", "uempmed"))
+            ggplot(_economics, aes("unemploy / pop", "uempmed"))
             + geom_path()
             + geom_point()
         ) |
         pw.load_ggplot(
-            ggplot(economics, aes("unemploy / pop", "uempmed"))
+            ggplot(_economics, aes("unemploy / pop", "uempmed"))
             + geom_path(colour="grey")
             + geom_point(aes(colour = "year"))
         )
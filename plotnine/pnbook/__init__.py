@@ -0,0 +1,5 @@
+"""
+Tools to build the plotnine port of the book outside of marimo
+
+Run ``python -m pnbook --help`` from the ``plotnine`` directory.
+"""
@@ -0,0 +1,401 @@
+"""
+Command line interface
+
+    python -m pnbook render getting-started.py -o _figures -j 8
+    python -m pnbook rebuild getting-started.py -o _figures
+    python -m pnbook data -j 8
+    python -m pnbook bench-compose getting-started.py
+    python -m pnbook bench getting-started.py -o bench.json --baseline base.json
+    python -m pnbook trace getting-started.py cell-042
+    python -m pnbook startup getting-started.py
+    python -m pnbook snapshot getting-started.py -b _snapshots --update
+    python -m pnbook stats getting-started.py --expect cell-076=cell-075
+"""
+
+from __future__ import annotations
+
+import argparse
+import sys
+import time
+from contextlib import nullcontext
+from pathlib import Path
+
+from . import bench, parallel, snapshot, statcache
+from .build import rebuild
+from .compose import benchmark as benchmark_compose
+from .cache import (
+    DEFAULT_CACHE_DIR,
+    DEFAULT_MAX_BYTES,
+    DiskCache,
+    FigureCache,
+)
+from .data import DATASETS, measure_workers
+from .notebook import Notebook
+from .render import FORMATS, summary
+from .statcache import StatCache
+from .warm import measure_startup
+
+DEFAULT_NOTEBOOK = Path(__file__).parent.parent / "getting-started.py"
+
+
+def _render(args: argparse.Namespace) -> int:
+    cache = stat_cache = None
+    if not args.no_cache:
+        size = args.cache_size * 2**20
+        cache = FigureCache(args.cache_dir / "figures", size)
+        stat_cache = StatCache(DiskCache(args.cache_dir / "stats", size))
+
+    groups = nullcontext()
+    if args.stat_workers:
+        groups = parallel.install(parallel.GroupPool(args.stat_workers))
+
+    start = time.perf_counter()
+    with groups as pool:
+        plan, results = rebuild(
+            args.notebook,
+            args.output or args.notebook.parent / "_figures",
+            formats=args.format or ["png"],
+            jobs=args.jobs,
+            cache=cache,
+            stat_cache=stat_cache,
+            force=args.command == "render",
+        )
+        if pool is not None:
+            pool.close()
+    if args.command == "rebuild":
+        print(
+            f"{len(plan.stale)} cells changed, {len(plan.reuse)} unchanged,"
+            f" {len(plan.removed)} files removed"
+        )
+    print(summary(results, time.perf_counter() - start))
+    return int(any(r.error for r in results))
+
+
+def _data(args: argparse.Namespace) -> int:
+    names = args.dataset or DATASETS
+    stats = measure_workers(args.jobs, names, mmap=not args.no_mmap)
+    print(f"{'pid':>7} {'load':>8} {'private':>10} {'shared':>10}")
+    for s in stats:
+        print(
+            f"{s.pid:>7} {s.seconds:>7.3f}s {s.rss_private / 2**20:>7.1f} MB"
+            f" {s.rss_shared / 2**20:>7.1f} MB"
+        )
+    return 0
+
+
+def _bench_compose(args: argparse.Namespace) -> int:
+    import matplotlib
+
+    matplotlib.use("Agg")
+    rows = benchmark_compose(Notebook(args.notebook), args.repeats)
+    print(f"{'cell':<9} {'plots':>5} {'patchworklib':>13} {'compose':>9}")
+    for r in rows:
+        line = f"{r['cell']:<9} {r['plots']:>5}"
+        if r["patchworklib"] is None:
+            line += f" {'n/a':>13} {r['compose']:>8.3f}s"
+        else:
+            line += (
+                f" {r['patchworklib']:>12.3f}s {r['compose']:>8.3f}s"
+                f"  x{r['patchworklib'] / r['compose']:.1f}"
+            )
+        print(line)
+    return 0
+
+
+def _bench(args: argparse.Namespace) -> int:
+    import matplotlib
+
+    matplotlib.use("Agg")
+    sizes = bench.SIZES
+    if args.size is not None:
+        sizes = tuple(n for n in args.size if n > 0)
+    results = bench.benchmark(Notebook(args.notebook), sizes, args.repeats)
+    print(bench.table(results))
+    if args.output:
+        bench.save(results, args.output)
+    if not args.baseline:
+        return 0
+    regressions = bench.compare(
+        results, bench.load(args.baseline), args.threshold
+    )
+    for r in regressions:
+        rows = "" if r.rows is None else f" ({r.rows} rows)"
+        if r.stage == "error":
+            change = f"drew in {r.baseline:.3f}s, now {r.error}"
+        elif r.stage == "missing":
+            change = f"drew in {r.baseline:.3f}s, now not drawn"
+        else:
+            change = (
+                f"{r.baseline:.3f}s -> {r.current:.3f}s (x{r.ratio:.2f})"
+            )
+        print(f"REGRESSION {r.cell}-{r.figure}{rows} {r.stage}: {change}")
+    return int(bool(regressions))
+
+
+def _trace(args: argparse.Namespace) -> int:
+    import matplotlib
+
+    from .trace import trace_cell
+
+    matplotlib.use("Agg")
+    notebook = Notebook(args.notebook)
+    for name in args.cell:
+        traces = trace_cell(
+            notebook, name, draw=not args.no_draw, memory=not args.no_memory
+        )
+        for k, t in enumerate(traces):
+            print(f"{name}-{k}")
+            print(t.table())
+            print()
+    return 0
+
+
+def _startup(args: argparse.Namespace) -> int:
+    r = measure_startup(args.notebook)
+    if r.error:
+        print(f"cold start failed after {r.first:.3f}s: {r.error}")
+        return 1
+    for stage, seconds in r.stages.items():
+        print(f"{stage:<14} {seconds:>6.3f}s")
+    print(f"{'total':<14} {r.first:>6.3f}s to {r.cell}")
+    print(f"{'warm':<14} {r.warm:>6.3f}s to draw it again")
+    return 0
+
+
+def _snapshot(args: argparse.Namespace) -> int:
+    baseline = args.baseline or args.notebook.parent / "_snapshots"
+    start = time.perf_counter()
+    if args.update:
+        results = snapshot.update(args.notebook, baseline, args.jobs)
+        print(summary(results, time.perf_counter() - start))
+        return int(any(r.error for r in results))
+    diffs = snapshot.check(
+        args.notebook,
+        baseline,
+        args.jobs,
+        tolerance=args.tolerance,
+        max_changed=args.max_changed,
+        keep=args.keep,
+    )
+    print(snapshot.report(diffs))
+    print(f"{time.perf_counter() - start:.2f}s")
+    return int(not all(d.ok for d in diffs))
+
+
+def _stats(args: argparse.Namespace) -> int:
+    reused = statcache.shared(args.notebook)
+    for cell, origin in reused:
+        print(f"{cell:<9} reuses a stat of {origin}")
+    expected = args.expect or []
+    missing = [p for p in expected if tuple(p.split("=", 1)) not in reused]
+    for pair in missing:
+        print(f"expected {pair.replace('=', ' to reuse a stat of ')}")
+    return int(bool(missing))
+
+
+def _add_render_arguments(p: argparse.ArgumentParser):
+    p.add_argument(
+        "notebook", nargs="?", type=Path, default=DEFAULT_NOTEBOOK
+    )
+    p.add_argument(
+        "-o",
+        "--output",
+        type=Path,
+        help="Output directory (default: _figures next to the notebook)",
+    )
+    p.add_argument(
+        "-f",
+        "--format",
+        action="append",
+        choices=FORMATS,
+        help="File format, may be repeated (default: png)",
+    )
+    p.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=None,
+        help="Number of worker processes (default: number of CPUs)",
+    )
+    p.add_argument(
+        "--stat-workers",
+        type=int,
+        default=0,
+        help="Compute the groups of large layers on this many processes"
+        " (requires -j 1)",
+    )
+
+
+def _add_cache_arguments(p: argparse.ArgumentParser):
+    p.add_argument(
+        "--cache-dir",
+        type=Path,
+        default=DEFAULT_CACHE_DIR,
+        help="Cache directory (default: %(default)s)",
+    )
+    p.add_argument(
+        "--cache-size",
+        type=int,
+        default=DEFAULT_MAX_BYTES // 2**20,
+        help="Size limit of each cache in MB (default: %(default)s)",
+    )
+    p.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Draw every figure and compute every stat from scratch",
+    )
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(prog="pnbook")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    for command, help in [
+        ("render", "Draw every figure in the notebook to files"),
+        ("rebuild", "Draw the figures of the cells changed since the last build"),
+    ]:
+        p = commands.add_parser(command, help=help)
+        _add_render_arguments(p)
+        _add_cache_arguments(p)
+        p.set_defaults(func=_render)
+
+    p = commands.add_parser(
+        "data", help="Measure dataset load time and memory per worker"
+    )
+    p.add_argument(
+        "dataset", nargs="*", help=f"Datasets (default: {' '.join(DATASETS)})"
+    )
+    p.add_argument("-j", "--jobs", type=int, default=4)
+    p.add_argument(
+        "--no-mmap",
+        action="store_true",
+        help="Load from plotnine.data instead of the Arrow files",
+    )
+    p.set_defaults(func=_data)
+
+    p = commands.add_parser(
+        "bench-compose",
+        help="Time side by side plots with patchworklib and pnbook.compose",
+    )
+    p.add_argument(
+        "notebook", nargs="?", type=Path, default=DEFAULT_NOTEBOOK
+    )
+    p.add_argument("-r", "--repeats", type=int, default=3)
+    p.set_defaults(func=_bench_compose)
+
+    p = commands.add_parser(
+        "bench", help="Time the build, draw and encode of every figure"
+    )
+    p.add_argument(
+        "notebook", nargs="?", type=Path, default=DEFAULT_NOTEBOOK
+    )
+    p.add_argument(
+        "-s",
+        "--size",
+        type=int,
+        action="append",
+        help="Rows of synthetic data, may be repeated"
+        f" (default: {' '.join(map(str, bench.SIZES))}; 0 for none)",
+    )
+    p.add_argument("-r", "--repeats", type=int, default=1)
+    p.add_argument("-o", "--output", type=Path, help="Write results as JSON")
+    p.add_argument(
+        "--baseline", type=Path, help="JSON results to compare against"
+    )
+    p.add_argument(
+        "--threshold",
+        type=float,
+        default=0.25,
+        help="Slowdown flagged as a regression (default: %(default)s)",
+    )
+    p.set_defaults(func=_bench)
+
+    p = commands.add_parser(
+        "trace", help="Profile the build of the plots of some cells by stage"
+    )
+    p.add_argument("notebook", type=Path)
+    p.add_argument("cell", nargs="+", help="Cell names, e.g. cell-042")
+    p.add_argument(
+        "--no-draw", action="store_true", help="Only profile the build"
+    )
+    p.add_argument(
+        "--no-memory",
+        action="store_true",
+        help="Do not measure peak memory (it slows down the build)",
+    )
+    p.set_defaults(func=_trace)
+
+    p = commands.add_parser(
+        "startup",
+        help="Time the stages of a cold start to the first figure",
+    )
+    p.add_argument(
+        "notebook", nargs="?", type=Path, default=DEFAULT_NOTEBOOK
+    )
+    p.set_defaults(func=_startup)
+
+    p = commands.add_parser(
+        "snapshot",
+        help="Compare every figure with a baseline, or update the baseline",
+    )
+    p.add_argument(
+        "notebook", nargs="?", type=Path, default=DEFAULT_NOTEBOOK
+    )
+    p.add_argument(
+        "-b",
+        "--baseline",
+        type=Path,
+        help="Baseline directory (default: _snapshots next to the notebook)",
+    )
+    p.add_argument(
+        "--update", action="store_true", help="Render a new baseline"
+    )
+    p.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=None,
+        help="Number of worker processes (default: number of CPUs)",
+    )
+    p.add_argument(
+        "--tolerance",
+        type=float,
+        default=snapshot.TOLERANCE,
+        help="Change of luminance (0 to 1) of a changed pixel"
+        " (default: %(default)s)",
+    )
+    p.add_argument(
+        "--max-changed",
+        type=float,
+        default=snapshot.MAX_CHANGED,
+        help="Fraction of changed pixels of a changed figure"
+        " (default: %(default)s)",
+    )
+    p.add_argument(
+        "--keep", type=Path, help="Copy the changed figures to this directory"
+    )
+    p.set_defaults(func=_snapshot)
+
+    p = commands.add_parser(
+        "stats", help="List the stat results that cells reuse from others"
+    )
+    p.add_argument(
+        "notebook", nargs="?", type=Path, default=DEFAULT_NOTEBOOK
+    )
+    p.add_argument(
+        "--expect",
+        action="append",
+        metavar="CELL=ORIGIN",
+        help="Fail unless CELL reuses a stat of ORIGIN, may be repeated",
+    )
+    p.set_defaults(func=_stats)
+
+    args = parser.parse_args(argv)
+    # The pool of stat workers is installed in this process only
+    if getattr(args, "stat_workers", 0) and args.jobs != 1:
+        parser.error("--stat-workers can only be used with -j 1")
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
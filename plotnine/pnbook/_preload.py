@@ -0,0 +1,11 @@
+"""
+Imports shared by all the render workers
+
+The fork server of the render pools imports this module once, and every
+worker forked from it starts with these packages imported; see
+:mod:`pnbook.warm`.
+"""
+
+import matplotlib.pyplot  # noqa: F401
+import pandas  # noqa: F401
+import plotnine  # noqa: F401
@@ -0,0 +1,320 @@
+"""
+Rendering benchmarks of the notebook's own figures
+
+Every figure of every plotting cell is drawn to PNG and timed in three
+stages:
+
+build
+    plotnine's build: layer data, stats, positions, scales and facet
+    layout (``ggplot._build``).
+draw
+    creating the matplotlib artists and rendering them to the canvas.
+encode
+    compressing the rendered pixels to PNG.
+
+The cells that plot ``mpg`` are timed again with ``mpg`` replaced by
+synthetic data of 10k, 100k and 1M rows, resampled from ``mpg`` so that
+the categories and ranges stay the same. Results are saved as JSON, and
+can be compared with a saved baseline to flag regressions.
+"""
+
+from __future__ import annotations
+
+import io
+import json
+import platform
+import time
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Iterator, Sequence
+
+from .fingerprint import library_versions
+from .notebook import Runner
+
+if TYPE_CHECKING:
+    import pandas as pd
+    from matplotlib.figure import Figure
+    from plotnine import ggplot
+
+    from .notebook import Notebook
+    from .render import Composition
+
+SIZES = (10_000, 100_000, 1_000_000)
+STAGES = ("build", "draw", "encode")
+
+# Name of the dataset that is replaced by synthetic data
+DATASET = "mpg"
+
+
+@dataclass
+class Timing:
+    """
+    Time taken by one figure of a cell
+    """
+
+    cell: str
+    figure: int
+    rows: int | None
+    """Rows of synthetic data, None with the original data"""
+
+    build: float = 0.0
+    draw: float = 0.0
+    encode: float = 0.0
+    error: str | None = None
+
+    @property
+    def key(self) -> tuple[str, int, int | None]:
+        return (self.cell, self.figure, self.rows)
+
+    @property
+    def total(self) -> float:
+        return self.build + self.draw + self.encode
+
+
+@dataclass
+class Regression:
+    """
+    A stage that got slower than in the baseline
+
+    A figure that drew in the baseline and now fails has the stage
+    ``"error"``, and one that is no longer drawn the stage
+    ``"missing"``.
+    """
+
+    cell: str
+    figure: int
+    rows: int | None
+    stage: str
+    baseline: float
+    current: float
+    error: str | None = None
+
+    @property
+    def ratio(self) -> float:
+        return self.current / self.baseline if self.baseline else float("inf")
+
+
+def synthetic(data: pd.DataFrame, n: int, seed: int = 0) -> pd.DataFrame:
+    """
+    ``n`` rows resampled from ``data``
+
+    Rows are drawn with replacement, and float columns get a little
+    noise (5% of their standard deviation) so that the values are not
+    all repeats of the original ones. Every other column keeps the
+    values, and therefore the categories, of the original data.
+    """
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    out = data.iloc[rng.integers(len(data), size=n)].reset_index(drop=True)
+    for name in out.columns:
+        col = out[name]
+        if col.dtype.kind == "f":
+            noise = rng.normal(0, 0.05 * (col.std() or 1), n)
+            out[name] = col.to_numpy() + noise
+    return out
+
+
+@contextmanager
+def _timed_build() -> Iterator[list[float]]:
+    """
+    Record the time spent in every ggplot build
+    """
+    from plotnine import ggplot
+
+    times: list[float] = []
+    build = ggplot._build
+
+    def _build(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return build(self, *args, **kwargs)
+        finally:
+            times.append(time.perf_counter() - start)
+
+    ggplot._build = _build  # type: ignore[method-assign]
+    try:
+        yield times
+    finally:
+        ggplot._build = build  # type: ignore[method-assign]
+
+
+def _draw(fig: ggplot | Composition) -> Figure:
+    from plotnine import ggplot
+
+    from .compose import compose
+
+    if isinstance(fig, ggplot):
+        return fig.draw(show=False)
+    return compose(fig, fig.figsize)
+
+
+def time_figure(fig: ggplot | Composition) -> tuple[float, float, float]:
+    """
+    Build, draw and encode times of a ggplot or a composition
+    """
+    import matplotlib.pyplot as plt
+    import numpy as np
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.image import imsave
+
+    with _timed_build() as builds:
+        start = time.perf_counter()
+        figure = _draw(fig)
+        # Figures made without pyplot have a canvas that does not render
+        if not isinstance(figure.canvas, FigureCanvasAgg):
+            FigureCanvasAgg(figure)
+        figure.canvas.draw()
+        drawn = time.perf_counter() - start
+    build = sum(builds)
+
+    start = time.perf_counter()
+    pixels = np.asarray(figure.canvas.buffer_rgba())
+    imsave(io.BytesIO(), pixels, format="png", dpi=figure.dpi)
+    encode = time.perf_counter() - start
+    plt.close("all")
+    return build, drawn - build, encode
+
+
+def benchmark(
+    notebook: Notebook,
+    sizes: Sequence[int] = SIZES,
+    repeats: int = 1,
+    seed: int = 0,
+) -> list[Timing]:
+    """
+    Time every figure of the notebook
+
+    Parameters
+    ----------
+    notebook :
+        Notebook whose plotting cells to time.
+    sizes :
+        Numbers of rows of the synthetic datasets. The cells that use
+        the dataset are run once with the original data, then once per
+        size.
+    repeats :
+        Each figure is drawn this many times and the fastest kept.
+    seed :
+        Seed of the synthetic data.
+    """
+    from .render import collect
+
+    runner = Runner(notebook)
+    results = []
+    # Synthetic datasets by size, shared by all the cells
+    datasets: dict[int, pd.DataFrame] = {}
+    for cell in notebook.plot_cells():
+        variants: list[int | None] = [None]
+        if DATASET in cell.refs:
+            variants.extend(sizes)
+        for rows in variants:
+            overrides = None
+            if rows is not None:
+                # The run with the original data has defined it
+                if rows not in datasets:
+                    original = runner.namespace[DATASET]
+                    datasets[rows] = synthetic(original, rows, seed)
+                overrides = {DATASET: datasets[rows]}
+            try:
+                figures = collect(runner, cell, overrides)
+            except Exception as err:
+                error = f"{type(err).__name__}: {err}"
+                results.append(Timing(cell.name, 0, rows, error=error))
+                continue
+            for k, fig in enumerate(figures):
+                timing = Timing(cell.name, k, rows)
+                try:
+                    best = min(
+                        (time_figure(fig) for _ in range(repeats)),
+                        key=sum,
+                    )
+                except Exception as err:
+                    timing.error = f"{type(err).__name__}: {err}"
+                else:
+                    timing.build, timing.draw, timing.encode = best
+                results.append(timing)
+    return results
+
+
+def save(results: Sequence[Timing], path: str | Path):
+    """
+    Write results, and the environment they were measured in, as JSON
+    """
+    doc = {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "versions": dict(library_versions()),
+        "results": [asdict(r) for r in results],
+    }
+    Path(path).write_text(json.dumps(doc, indent=1))
+
+
+def load(path: str | Path) -> list[Timing]:
+    doc: dict[str, Any] = json.loads(Path(path).read_text())
+    return [Timing(**r) for r in doc["results"]]
+
+
+def compare(
+    results: Sequence[Timing],
+    baseline: Sequence[Timing],
+    threshold: float = 0.25,
+    min_seconds: float = 0.01,
+) -> list[Regression]:
+    """
+    Stages that are slower than in the baseline
+
+    A stage regresses when it takes more than ``threshold`` (a
+    fraction) longer than in the baseline, and at least ``min_seconds``
+    longer, so that noise in very short stages is not flagged. Figures
+    that drew in the baseline and now fail, or that are gone (from the
+    sizes that were run), are regressions too.
+    """
+    base = {r.key: r for r in baseline if r.error is None}
+    regressions = []
+    for r in results:
+        b = base.get(r.key)
+        if b is None:
+            continue
+        if r.error is not None:
+            regressions.append(
+                Regression(
+                    r.cell, r.figure, r.rows, "error", b.total, 0.0, r.error
+                )
+            )
+            continue
+        for stage in STAGES:
+            old, new = getattr(b, stage), getattr(r, stage)
+            if new > old * (1 + threshold) and new - old >= min_seconds:
+                regressions.append(
+                    Regression(r.cell, r.figure, r.rows, stage, old, new)
+                )
+    current = {r.key for r in results}
+    sizes = {r.rows for r in results}
+    for key, b in base.items():
+        if key not in current and b.rows in sizes:
+            regressions.append(
+                Regression(b.cell, b.figure, b.rows, "missing", b.total, 0.0)
+            )
+    return regressions
+
+
+def table(results: Sequence[Timing]) -> str:
+    """
+    Timings as a text table
+    """
+    lines = [
+        f"{'cell':<9} {'fig':>3} {'rows':>9} {'build':>8} {'draw':>8}"
+        f" {'encode':>8} {'total':>8}"
+    ]
+    for r in results:
+        rows = "-" if r.rows is None else str(r.rows)
+        line = (
+            f"{r.cell:<9} {r.figure:>3} {rows:>9} {r.build:>7.3f}s"
+            f" {r.draw:>7.3f}s {r.encode:>7.3f}s {r.total:>7.3f}s"
+        )
+        if r.error:
+            line += f"  {r.error}"
+        lines.append(line)
+    return "\n".join(lines)
@@ -0,0 +1,503 @@
+"""
+Rectangular and hexagonal 2D bins
+
+plotnine's ``stat_bin_2d`` cuts x and y with ``pandas.cut``, counts
+with a pivot table, and then loops over every cell of the grid in
+Python to make the rectangles; and it has no hexagonal bins. Here a
+grid turns points into flat cell indices with numpy (``searchsorted``
+on the breaks of rectangular bins, integer lattice arithmetic for
+hexagons), and :class:`Bins2D` adds them up with ``numpy.bincount``.
+
+A :class:`Bins2D` is a dense array of counts over a fixed grid, so
+partial counts, of the chunks of a file (see
+:func:`pnbook.stream.streamed`) or from different workers, are merged by
+adding the arrays.
+
+:class:`geom_bin_2d` draws rectangular bins as one ``QuadMesh`` (one
+``PolyCollection`` when the cells have outlines or are not on a grid),
+and :class:`geom_hex` draws hexagons as one ``PolyCollection``.
+"""
+
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import TYPE_CHECKING
+
+import numpy as np
+from plotnine import geom_rect
+from plotnine.geoms.geom import geom
+from plotnine.geoms.geom_polygon import geom_polygon
+from plotnine.mapping.evaluation import after_stat
+from plotnine.stats import stat_bin_2d
+from plotnine.stats.stat import stat
+
+if TYPE_CHECKING:
+    import pandas as pd
+    from matplotlib.axes import Axes
+
+# Distance between a point and a hexagon centre, in units of the width
+# and the row height, is du**2 + _HEX_ASPECT * dv**2. With it the cells
+# of the two lattices of centres are hexagons with vertices at
+# (0, +-2/3) and (+-1/2, +-1/3).
+_HEX_ASPECT = 0.75
+
+
+@dataclass(frozen=True)
+class RectGrid:
+    """
+    Rectangular bins, closed on the right like stat_bin_2d's
+
+    Parameters
+    ----------
+    xbreaks, ybreaks :
+        Edges of the bins along x and y.
+    """
+
+    xbreaks: tuple[float, ...]
+    ybreaks: tuple[float, ...]
+
+    @property
+    def shape(self) -> tuple[int, int]:
+        """
+        Rows (along y) and columns (along x)
+        """
+        return len(self.ybreaks) - 1, len(self.xbreaks) - 1
+
+    @property
+    def size(self) -> int:
+        nrow, ncol = self.shape
+        return nrow * ncol
+
+    def cells(self, x: np.ndarray, y: np.ndarray) -> np.ndarray:
+        """
+        Flat index (row-major) of the cell of each point, -1 if none
+        """
+        nrow, ncol = self.shape
+        col = np.searchsorted(self.xbreaks, x, side="left") - 1
+        row = np.searchsorted(self.ybreaks, y, side="left") - 1
+        inside = (col >= 0) & (col < ncol) & (row >= 0) & (row < nrow)
+        return np.where(inside, row * ncol + col, -1)
+
+    def frame(self, index: np.ndarray) -> pd.DataFrame:
+        """
+        ``xmin``, ``xmax``, ``ymin`` and ``ymax`` of some cells
+
+        As stat_bin_2d does, the first edges are moved so that the
+        first bins look as wide as the others, despite the fuzz of
+        the breaks.
+        """
+        import pandas as pd
+
+        xb, yb = _display_breaks(self.xbreaks), _display_breaks(self.ybreaks)
+        row, col = np.divmod(index, self.shape[1])
+        return pd.DataFrame(
+            {
+                "xmin": xb[col],
+                "xmax": xb[col + 1],
+                "ymin": yb[row],
+                "ymax": yb[row + 1],
+            }
+        )
+
+
+@dataclass(frozen=True)
+class HexGrid:
+    """
+    Hexagonal bins
+
+    Rows of hexagons are ``height`` apart, starting at ``y0``; in each
+    row, centres are ``width`` apart starting at ``x0``, shifted by half
+    a width in odd rows.
+    """
+
+    x0: float
+    y0: float
+    width: float
+    height: float
+    ncol: int
+    nrow: int
+
+    @classmethod
+    def covering(
+        cls,
+        xrange: tuple[float, float],
+        yrange: tuple[float, float],
+        binwidth: tuple[float, float],
+    ) -> HexGrid:
+        """
+        Grid whose hexagons hold every point in a box
+        """
+        width, height = binwidth
+        x0 = np.floor(xrange[0] / width) * width
+        y0 = np.floor(yrange[0] / height) * height
+        ncol = int(np.floor((xrange[1] - x0) / width)) + 2
+        nrow = int(np.floor((yrange[1] - y0) / height)) + 2
+        return cls(float(x0), float(y0), width, height, ncol, nrow)
+
+    @property
+    def shape(self) -> tuple[int, int]:
+        return self.nrow, self.ncol
+
+    @property
+    def size(self) -> int:
+        return self.nrow * self.ncol
+
+    def cells(self, x: np.ndarray, y: np.ndarray) -> np.ndarray:
+        """
+        Flat index (row-major) of the hexagon of each point, -1 if none
+        """
+        x = np.asarray(x, dtype=float)
+        y = np.asarray(y, dtype=float)
+        finite = np.isfinite(x) & np.isfinite(y)
+        u = np.where(finite, (x - self.x0) / self.width, -1)
+        v = np.where(finite, (y - self.y0) / self.height, -1)
+
+        # Nearest centre of the even rows, at (i, 2k)
+        col_a = np.floor(u + 0.5).astype(np.int64)
+        row_a = 2 * np.floor(v / 2 + 0.5).astype(np.int64)
+        # and of the odd rows, at (i + 1/2, 2k + 1)
+        col_b = np.floor(u).astype(np.int64)
+        row_b = 2 * np.floor(v / 2).astype(np.int64) + 1
+        da = (u - col_a) ** 2 + _HEX_ASPECT * (v - row_a) ** 2
+        db = (u - col_b - 0.5) ** 2 + _HEX_ASPECT * (v - row_b) ** 2
+        even = da <= db
+        col = np.where(even, col_a, col_b)
+        row = np.where(even, row_a, row_b)
+
+        inside = (
+            finite
+            & (col >= 0)
+            & (col < self.ncol)
+            & (row >= 0)
+            & (row < self.nrow)
+        )
+        return np.where(inside, row * self.ncol + col, -1)
+
+    def frame(self, index: np.ndarray) -> pd.DataFrame:
+        """
+        Centres ``x`` and ``y``, ``width`` and ``height`` of some cells
+        """
+        import pandas as pd
+
+        row, col = np.divmod(index, self.ncol)
+        return pd.DataFrame(
+            {
+                "x": self.x0 + (col + 0.5 * (row % 2)) * self.width,
+                "y": self.y0 + row * self.height,
+                "width": self.width,
+                "height": self.height,
+            }
+        )
+
+
+def hexagons(
+    x: np.ndarray, y: np.ndarray, width: float, height: float
+) -> np.ndarray:
+    """
+    Vertices of the hexagons of a :class:`HexGrid`, ``(n, 6, 2)``
+    """
+    dx = np.array([0, 0.5, 0.5, 0, -0.5, -0.5]) * width
+    dy = np.array([2, 1, -1, -2, -1, 1]) / 3 * height
+    verts = np.empty((len(x), 6, 2))
+    verts[..., 0] = np.asarray(x, dtype=float)[:, None] + dx
+    verts[..., 1] = np.asarray(y, dtype=float)[:, None] + dy
+    return verts
+
+
+class Bins2D:
+    """
+    Counts of points in the cells of a grid
+
+    Parameters
+    ----------
+    grid :
+        A :class:`RectGrid` or :class:`HexGrid`.
+    """
+
+    def __init__(self, grid: RectGrid | HexGrid):
+        self.grid = grid
+        self.count = np.zeros(grid.size)
+        self.n = np.zeros(grid.size, dtype=np.int64)
+
+    def add(
+        self,
+        x: np.ndarray,
+        y: np.ndarray,
+        weights: np.ndarray | None = None,
+    ) -> Bins2D:
+        """
+        Count more points
+        """
+        cells = self.grid.cells(x, y)
+        inside = cells >= 0
+        cells = cells[inside]
+        size = self.grid.size
+        self.n += np.bincount(cells, minlength=size)
+        if weights is None:
+            self.count += np.bincount(cells, minlength=size)
+        else:
+            w = np.asarray(weights, dtype=float)[inside]
+            self.count += np.bincount(cells, w, minlength=size)
+        return self
+
+    def merge(self, other: Bins2D) -> Bins2D:
+        """
+        Add the counts of another Bins2D over the same grid
+        """
+        if other.grid != self.grid:
+            raise ValueError("Cannot merge counts over different grids")
+        self.count += other.count
+        self.n += other.n
+        return self
+
+    def frame(self, drop: bool = True) -> pd.DataFrame:
+        """
+        The cells, with their ``count`` and ``density``
+
+        Parameters
+        ----------
+        drop :
+            Leave out the cells without points.
+        """
+        index = np.flatnonzero(self.n) if drop else np.arange(self.grid.size)
+        res = self.grid.frame(index)
+        res["count"] = self.count[index]
+        total = res["count"].sum()
+        res["density"] = res["count"] / (total if total else 1)
+        return res
+
+
+def rect_grid(xscale, yscale, bins, breaks, binwidth) -> RectGrid:
+    """
+    stat_bin_2d's bins over trained scales
+
+    ``bins``, ``breaks`` and ``binwidth`` have an ``x`` and a ``y``, as
+    after stat_bin_2d's setup_params.
+    """
+    from plotnine.stats.binning import fuzzybreaks
+
+    xbreaks = fuzzybreaks(
+        xscale, breaks=breaks.x, binwidth=binwidth.x, bins=bins.x
+    )
+    ybreaks = fuzzybreaks(
+        yscale, breaks=breaks.y, binwidth=binwidth.y, bins=bins.y
+    )
+    return RectGrid(tuple(map(float, xbreaks)), tuple(map(float, ybreaks)))
+
+
+def hex_grid(xscale, yscale, bins, binwidth) -> HexGrid:
+    """
+    stat_bin_hex's bins over trained scales
+    """
+    xrange, yrange = xscale.dimension(), yscale.dimension()
+    width = binwidth.x or (xrange[1] - xrange[0]) / bins.x or 1
+    height = binwidth.y or (yrange[1] - yrange[0]) / bins.y or 1
+    return HexGrid.covering(xrange, yrange, (width, height))
+
+
+def _display_breaks(breaks: tuple[float, ...]) -> np.ndarray:
+    b = np.array(breaks)
+    if len(b) > 2:
+        b[0] -= np.diff(np.diff(b))[0]
+    return b
+
+
+def _count(grid: RectGrid | HexGrid, data: pd.DataFrame) -> Bins2D:
+    weight = data.get("weight")
+    return Bins2D(grid).add(
+        data["x"].to_numpy(dtype=float),
+        data["y"].to_numpy(dtype=float),
+        None if weight is None else weight.to_numpy(dtype=float),
+    )
+
+
+class stat_bin_2d_fast(stat_bin_2d):
+    """
+    stat_bin_2d counted with numpy.bincount
+
+    Same parameters and results as ``stat_bin_2d``.
+    """
+
+    def compute_group(self, data: pd.DataFrame, scales) -> pd.DataFrame:
+        params = self.params
+        grid = rect_grid(
+            scales.x,
+            scales.y,
+            params["bins"],
+            params["breaks"],
+            params["binwidth"],
+        )
+        return _count(grid, data).frame(params["drop"])
+
+
+class stat_bin_hex(stat):
+    """
+    Counts of points in hexagonal bins
+
+    Parameters
+    ----------
+    bins : int | tuple[int, int], default=30
+        Number of bins along x and y, over the range of the scales.
+        Overridden by binwidth.
+    binwidth : float | tuple[float, float], default=None
+        Distance between the centres of the hexagons of a row, and
+        between rows.
+    drop : bool, default=True
+        If `True`, removes all cells with zero counts.
+    """
+
+    REQUIRED_AES = {"x", "y"}
+    DEFAULT_PARAMS = {
+        "geom": "hex",
+        "position": "identity",
+        "na_rm": False,
+        "bins": 30,
+        "binwidth": None,
+        "drop": True,
+    }
+    DEFAULT_AES = {"fill": after_stat("count"), "weight": None}
+    CREATES = {"width", "height", "count", "density"}
+
+    def setup_params(self, data):
+        from plotnine.stats.stat_bin_2d import dual_param
+
+        params = self.params
+        params["bins"] = dual_param(params["bins"])
+        params["binwidth"] = dual_param(params["binwidth"])
+
+    def compute_group(self, data: pd.DataFrame, scales) -> pd.DataFrame:
+        params = self.params
+        grid = hex_grid(scales.x, scales.y, params["bins"], params["binwidth"])
+        return _count(grid, data).frame(params["drop"])
+
+
+class geom_bin_2d(geom_rect):
+    """
+    Rectangles of 2D bins drawn as one artist
+
+    Accepts the same aesthetics and parameters as ``geom_rect``, and
+    computes the bins with :class:`stat_bin_2d_fast`.
+    """
+
+    DEFAULT_AES = {**geom_rect.DEFAULT_AES}
+    DEFAULT_PARAMS = {**geom_rect.DEFAULT_PARAMS, "stat": stat_bin_2d_fast}
+
+    def draw_panel(self, data: pd.DataFrame, panel_params, coord, ax: Axes):
+        if not coord.is_linear:
+            return super().draw_panel(data, panel_params, coord, ax)
+
+        from matplotlib.collections import PolyCollection, QuadMesh
+        from matplotlib.colors import to_rgba_array
+        from plotnine._utils import SIZE_FACTOR, to_rgba
+
+        data = coord.transform(data, panel_params, munch=True)
+        fill = to_rgba_array(to_rgba(data["fill"], data["alpha"]))
+        xmin, xmax = data["xmin"].to_numpy(), data["xmax"].to_numpy()
+        ymin, ymax = data["ymin"].to_numpy(), data["ymax"].to_numpy()
+        xedges = np.unique(np.concatenate([xmin, xmax]))
+        yedges = np.unique(np.concatenate([ymin, ymax]))
+        col = np.searchsorted(xedges, xmin)
+        row = np.searchsorted(yedges, ymin)
+        on_grid = (
+            np.array_equal(xedges[col + 1], xmax)
+            and np.array_equal(yedges[row + 1], ymax)
+            and len(xedges) * len(yedges) <= 4 * len(data) + 64
+        )
+        if data["color"].isna().all() and on_grid:
+            # Cells without a rectangle stay transparent
+            colours = np.zeros((len(yedges) - 1, len(xedges) - 1, 4))
+            colours[row, col] = fill
+            xx, yy = np.meshgrid(xedges, yedges)
+            mesh = QuadMesh(
+                np.stack([xx, yy], axis=-1),
+                facecolors=colours.reshape(-1, 4),
+                edgecolors="none",
+                antialiased=False,
+                zorder=self.params["zorder"],
+                rasterized=self.params["raster"],
+            )
+            ax.add_collection(mesh)
+            return
+
+        verts = np.empty((len(data), 4, 2))
+        verts[:, :, 0] = np.column_stack([xmin, xmin, xmax, xmax])
+        verts[:, :, 1] = np.column_stack([ymin, ymax, ymax, ymin])
+        color = data["color"]
+        poly = PolyCollection(
+            verts,
+            facecolors=fill,
+            edgecolors="none" if color.isna().all() else color,
+            linestyles=data["linetype"],
+            linewidths=data["size"] * SIZE_FACTOR,
+            zorder=self.params["zorder"],
+            rasterized=self.params["raster"],
+        )
+        ax.add_collection(poly)
+
+
+class geom_hex(geom):
+    """
+    Hexagons, drawn as one PolyCollection
+
+    Draws the cells of :class:`stat_bin_hex`, from their centres ``x``
+    and ``y`` and their ``width`` and ``height``.
+    """
+
+    DEFAULT_AES = {
+        "alpha": 1,
+        "color": None,
+        "fill": "#595959",
+        "linetype": "solid",
+        "size": 0.5,
+    }
+    REQUIRED_AES = {"x", "y", "width", "height"}
+    DEFAULT_PARAMS = {
+        "stat": stat_bin_hex,
+        "position": "identity",
+        "na_rm": False,
+    }
+    draw_legend = staticmethod(geom_polygon.draw_legend)
+
+    def draw_panel(self, data: pd.DataFrame, panel_params, coord, ax: Axes):
+        from matplotlib.collections import PolyCollection
+        from plotnine._utils import SIZE_FACTOR, to_rgba
+
+        verts = hexagons(
+            data["x"].to_numpy(),
+            data["y"].to_numpy(),
+            float(data["width"].iloc[0]),
+            float(data["height"].iloc[0]),
+        )
+        if not coord.is_linear:
+            # Munch the edges, one polygon per hexagon
+            n = len(data)
+            poly = data.loc[data.index.repeat(7)].reset_index(drop=True)
+            closed = np.concatenate([verts, verts[:, :1]], axis=1)
+            poly["x"] = closed[..., 0].ravel()
+            poly["y"] = closed[..., 1].ravel()
+            poly["group"] = np.repeat(np.arange(n), 7)
+            return geom_polygon.draw_group(
+                poly, panel_params, coord, ax, self.params
+            )
+
+        x = coord.transform(
+            _points(verts.reshape(-1, 2)), panel_params, munch=False
+        )
+        verts = np.column_stack([x["x"], x["y"]]).reshape(-1, 6, 2)
+        color = data["color"]
+        poly = PolyCollection(
+            verts,
+            facecolors=to_rgba(data["fill"], data["alpha"]),
+            edgecolors="none" if color.isna().all() else color,
+            linestyles=data["linetype"],
+            linewidths=data["size"] * SIZE_FACTOR,
+            zorder=self.params["zorder"],
+            rasterized=self.params["raster"],
+        )
+        ax.add_collection(poly)
+
+
+def _points(xy: np.ndarray) -> pd.DataFrame:
+    import pandas as pd
+
+    return pd.DataFrame({"x": xy[:, 0], "y": xy[:, 1]})
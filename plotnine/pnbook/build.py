@@ -0,0 +1,188 @@
+"""
+Incremental builds
+
+After a build, a manifest in the output directory records the lineage
+(see :meth:`Notebook.identity`) of every rendered cell and the files it
+produced. A rebuild only renders the cells whose lineage is not in the
+manifest, that is the cells that were edited and everything downstream
+of them. The figures of the other cells are kept, and renamed if the
+cell has moved.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Sequence
+
+from .cache import FigureCache
+from .notebook import Notebook
+from .render import CellResult, render_notebook
+from .statcache import StatCache
+
+MANIFEST = "manifest.json"
+
+
+@dataclass
+class Plan:
+    """
+    What a rebuild has to do
+    """
+
+    stale: list[int]
+    """Cells to render"""
+
+    reuse: dict[int, list[str]]
+    """Cells to keep, with the files from the last build"""
+
+    removed: list[str]
+    """Files of cells that no longer exist"""
+
+
+def read_manifest(
+    outdir: str | Path, formats: Sequence[str]
+) -> dict[str, list[str]]:
+    """
+    Lineage -> files of the last build in ``outdir``
+
+    A build in other formats counts as no build.
+    """
+    try:
+        with open(Path(outdir) / MANIFEST) as f:
+            data = json.load(f)
+    except FileNotFoundError:
+        return {}
+    if data.get("formats") != list(formats):
+        return {}
+    return data["cells"]
+
+
+def write_manifest(
+    outdir: str | Path,
+    notebook: Notebook,
+    formats: Sequence[str],
+    files: dict[int, list[str]],
+):
+    entries = {
+        notebook.identity(notebook.cells[i]): f for i, f in files.items()
+    }
+    data = {
+        "notebook": str(notebook.path),
+        "formats": list(formats),
+        "cells": entries,
+    }
+    path = Path(outdir) / MANIFEST
+    tmp = path.with_suffix(".tmp")
+    tmp.write_text(json.dumps(data, indent=1, sort_keys=True))
+    os.replace(tmp, path)
+
+
+def plan(
+    notebook: Notebook, outdir: str | Path, formats: Sequence[str]
+) -> Plan:
+    """
+    Compare a notebook with the last build in ``outdir``
+    """
+    outdir = Path(outdir)
+    previous = read_manifest(outdir, formats)
+    stale: list[int] = []
+    reuse: dict[int, list[str]] = {}
+    for cell in notebook.plot_cells():
+        files = previous.get(notebook.identity(cell))
+        if files is not None and all((outdir / f).exists() for f in files):
+            reuse[cell.index] = files
+        else:
+            stale.append(cell.index)
+
+    kept = {f for files in reuse.values() for f in files}
+    removed = sorted(
+        {f for files in previous.values() for f in files} - kept
+    )
+    return Plan(stale, reuse, removed)
+
+
+def rebuild(
+    path: str | Path,
+    outdir: str | Path,
+    formats: Sequence[str] = ("png",),
+    jobs: int | None = None,
+    cache: FigureCache | None = None,
+    stat_cache: StatCache | None = None,
+    force: bool = False,
+) -> tuple[Plan, list[CellResult]]:
+    """
+    Render the cells that changed since the last build
+
+    Parameters
+    ----------
+    path :
+        Notebook file.
+    outdir :
+        Directory of the last build, and of this one.
+    formats :
+        File formats, each figure is written once per format.
+    jobs :
+        Number of worker processes.
+    cache :
+        Store of previously drawn figures.
+    stat_cache :
+        Store of stat results.
+    force :
+        Render every cell, ignoring the last build.
+
+    Returns
+    -------
+    plan : Plan
+        The cells that were rendered and reused.
+    results : list[CellResult]
+        The results of the cells that were rendered.
+    """
+    notebook = Notebook(path)
+    outdir = Path(outdir)
+    outdir.mkdir(parents=True, exist_ok=True)
+    if force:
+        (outdir / MANIFEST).unlink(missing_ok=True)
+    todo = plan(notebook, outdir, formats)
+
+    # Cells keep their figures, but the file names follow the position
+    # of the cell, which may have changed. Move them aside first so
+    # that two cells that swapped places do not overwrite each other.
+    moved: dict[int, list[str]] = {}
+    staged: list[tuple[Path, Path]] = []
+    for index, files in todo.reuse.items():
+        name = notebook.cells[index].name
+        new_files = []
+        for f in files:
+            new = f"{name}-{f.split('-', 2)[2]}"
+            if new != f:
+                tmp = outdir / f"{f}.moving"
+                os.replace(outdir / f, tmp)
+                staged.append((tmp, outdir / new))
+            new_files.append(new)
+        moved[index] = new_files
+    for tmp, dest in staged:
+        os.replace(tmp, dest)
+
+    kept = {f for files in moved.values() for f in files}
+    for f in todo.removed:
+        if f not in kept:
+            (outdir / f).unlink(missing_ok=True)
+
+    results = []
+    if todo.stale:
+        results = render_notebook(
+            notebook.path,
+            outdir,
+            formats=formats,
+            jobs=jobs,
+            cells=[notebook.cells[i] for i in todo.stale],
+            cache=cache,
+            stat_cache=stat_cache,
+        )
+
+    files = dict(moved)
+    files.update({r.cell: r.files for r in results if r.error is None})
+    write_manifest(outdir, notebook, formats, files)
+    return todo, results
@@ -0,0 +1,165 @@
+"""
+Persistent, content-addressed stores
+
+Entries are stored as ``<fingerprint>.<ext>`` files in one directory.
+The fingerprint (see :mod:`pnbook.fingerprint`) covers everything that
+affects the entry, e.g. for a figure everything that affects the image,
+so a stored file can be reused without building or drawing the plot.
+The modification time of a file records when it was last used, and the
+least recently used files are removed once the cache grows beyond its
+size limit.
+"""
+
+from __future__ import annotations
+
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator
+
+DEFAULT_CACHE_DIR = Path(
+    os.environ.get("PNBOOK_CACHE_DIR", Path.home() / ".cache" / "pnbook")
+)
+DEFAULT_MAX_BYTES = 512 * 2**20
+
+
+class DiskCache:
+    """
+    Directory of files keyed by fingerprint
+
+    Parameters
+    ----------
+    directory :
+        Where to store the files.
+    max_bytes :
+        Size above which :meth:`evict` removes the least recently used
+        files.
+    """
+
+    def __init__(
+        self, directory: str | Path, max_bytes: int = DEFAULT_MAX_BYTES
+    ):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def path(self, key: str, ext: str) -> Path:
+        return self.directory / f"{key}.{ext}"
+
+    def read(self, key: str, ext: str) -> bytes | None:
+        """
+        Contents of an entry, or None if it is not in the cache
+        """
+        path = self.path(key, ext)
+        try:
+            data = path.read_bytes()
+        except FileNotFoundError:
+            return None
+        self._touch(path)
+        return data
+
+    def write(self, key: str, ext: str, data: bytes):
+        """
+        Add an entry to the cache
+        """
+        with self._atomic(key, ext) as tmp:
+            Path(tmp).write_bytes(data)
+
+    def size(self) -> int:
+        return sum(st.st_size for _, st in self._entries())
+
+    def evict(self) -> int:
+        """
+        Remove least recently used entries until the cache fits
+
+        Returns
+        -------
+        int
+            Number of entries removed.
+        """
+        entries = sorted(self._entries(), key=lambda e: e[1].st_mtime)
+        total = sum(st.st_size for _, st in entries)
+        removed = 0
+        for path, st in entries:
+            if total <= self.max_bytes:
+                break
+            path.unlink(missing_ok=True)
+            total -= st.st_size
+            removed += 1
+        return removed
+
+    def clear(self):
+        for path, _ in self._entries():
+            path.unlink(missing_ok=True)
+
+    @contextmanager
+    def _atomic(self, key: str, ext: str) -> Iterator[str]:
+        """
+        Temporary file that becomes the entry when the context exits
+
+        Concurrent readers never see a partial file.
+        """
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        os.close(fd)
+        try:
+            yield tmp
+            os.replace(tmp, self.path(key, ext))
+        except BaseException:
+            Path(tmp).unlink(missing_ok=True)
+            raise
+
+    @staticmethod
+    def _touch(path: Path):
+        # Mark as recently used
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+
+    def _entries(self):
+        for path in self.directory.iterdir():
+            if path.suffix == ".tmp":
+                continue
+            try:
+                yield path, path.stat()
+            except FileNotFoundError:
+                pass
+
+
+class FigureCache(DiskCache):
+    """
+    Directory of figures keyed by plot fingerprint
+    """
+
+    def __init__(
+        self,
+        directory: str | Path = DEFAULT_CACHE_DIR / "figures",
+        max_bytes: int = DEFAULT_MAX_BYTES,
+    ):
+        super().__init__(directory, max_bytes)
+
+    def fetch(self, key: str, fmt: str, dest: str | Path) -> bool:
+        """
+        Copy a stored figure to ``dest``
+
+        Returns
+        -------
+        bool
+            Whether the figure was in the cache.
+        """
+        src = self.path(key, fmt)
+        try:
+            shutil.copyfile(src, dest)
+        except FileNotFoundError:
+            return False
+        self._touch(src)
+        return True
+
+    def store(self, key: str, fmt: str, src: str | Path):
+        """
+        Add a figure file to the cache
+        """
+        with self._atomic(key, fmt) as tmp:
+            shutil.copyfile(src, tmp)
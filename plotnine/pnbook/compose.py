@@ -0,0 +1,240 @@
+"""
+Side by side plots drawn directly onto one figure
+
+``pw.load_ggplot`` draws each ggplot to a figure of its own, then moves
+the artists onto the axes of a patchworklib figure and lays everything
+out again. Here each ggplot of a :class:`~pnbook.render.Composition` is
+drawn once, straight onto a subfigure of a single shared figure, and
+plotnine's own layout engine positions its artists within the
+subfigure.
+
+plotnine creates its figure with ``plt.figure()``, sizes it from the
+theme and sets a layout engine on it. While a plot is drawn,
+``plt.figure()`` returns a :class:`_Region` instead: a stand-in that
+passes everything to the subfigure, measures figure coordinates in the
+subfigure, ignores the calls that only make sense for a whole figure
+(including ``plt.close``), and keeps the layout engine so that it can
+be run once all the plots are drawn. A single plot composed this way
+gives the same file as ``ggplot.save``.
+"""
+
+from __future__ import annotations
+
+import time
+from contextlib import contextmanager
+from copy import deepcopy
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Iterator
+
+if TYPE_CHECKING:
+    from matplotlib.figure import Figure, SubFigure
+    from matplotlib.gridspec import SubplotSpec
+
+    from .notebook import Notebook
+    from .render import Composition
+
+
+class _Region:
+    """
+    A subfigure posing as the figure of a single ggplot
+    """
+
+    def __init__(self, subfigure: SubFigure):
+        self.__dict__["_subfigure"] = subfigure
+        self.__dict__["_engine"] = None
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._subfigure, name)
+
+    def __setattr__(self, name: str, value: Any):
+        setattr(self._subfigure, name, value)
+
+    @property
+    def transFigure(self):
+        # plotnine lays a plot out in fractions of its figure
+        return self._subfigure.transSubfigure
+
+    def get_size_inches(self):
+        import numpy as np
+
+        bbox = self._subfigure.bbox
+        return np.array([bbox.width, bbox.height]) / self._subfigure.dpi
+
+    def set_size_inches(self, *args, **kwargs):
+        # The size comes from the shared figure
+        pass
+
+    def set_dpi(self, dpi: float):
+        pass
+
+    def set_layout_engine(self, layout=None, **kwargs):
+        self.__dict__["_engine"] = layout
+
+    def get_layout_engine(self):
+        return self._engine
+
+    def execute_layout(self):
+        if self._engine is not None:
+            self._engine.execute(self)
+
+
+def _ncols(comp: Composition) -> int:
+    if comp.op == "leaf":
+        return 1
+    left, right = (_ncols(p) for p in comp.parts)
+    return left + right if comp.op == "|" else max(left, right)
+
+
+def _nrows(comp: Composition) -> int:
+    if comp.op == "leaf":
+        return 1
+    top, bottom = (_nrows(p) for p in comp.parts)
+    return top + bottom if comp.op == "/" else max(top, bottom)
+
+
+def _place(comp: Composition, spec: SubplotSpec, slots: list):
+    """
+    Assign a cell of the gridspec to every plot in the composition
+    """
+    if comp.op == "leaf":
+        slots.append((comp.parts[0], spec))
+        return
+    first, second = comp.parts
+    if comp.op == "|":
+        gs = spec.subgridspec(
+            1, 2, width_ratios=[_ncols(first), _ncols(second)], wspace=0
+        )
+        _place(first, gs[0, 0], slots)
+        _place(second, gs[0, 1], slots)
+    else:
+        gs = spec.subgridspec(
+            2, 1, height_ratios=[_nrows(first), _nrows(second)], hspace=0
+        )
+        _place(first, gs[0, 0], slots)
+        _place(second, gs[1, 0], slots)
+
+
+@contextmanager
+def _figure_is(region: _Region) -> Iterator[None]:
+    """
+    Make ``plt.figure()`` return ``region``, and ``plt.close`` leave it
+
+    plotnine closes the figure of a plot once it is drawn, so that
+    pyplot does not keep it; the shared figure was never registered
+    with pyplot.
+    """
+    import matplotlib.pyplot as plt
+
+    figure, close = plt.figure, plt.close
+
+    def _close(fig=None):
+        if fig is not region:
+            close(fig)
+
+    plt.figure = lambda *args, **kwargs: region  # type: ignore[assignment]
+    plt.close = _close  # type: ignore[assignment]
+    try:
+        yield
+    finally:
+        plt.figure = figure  # type: ignore[assignment]
+        plt.close = close  # type: ignore[assignment]
+
+
+def compose(comp: Composition, figsize=None) -> Figure:
+    """
+    Draw a composition of ggplots onto one figure
+
+    Parameters
+    ----------
+    comp :
+        Composition of ggplots.
+    figsize :
+        Size of the figure in inches. The default gives each plot
+        plotnine's default figure size.
+    """
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+    from plotnine.options import get_option
+
+    if figsize is None:
+        width, height = get_option("figure_size")
+        figsize = (width * _ncols(comp), height * _nrows(comp))
+    figure = Figure(figsize=figsize)
+    FigureCanvasAgg(figure)
+    spec = figure.add_gridspec(1, 1, left=0, right=1, bottom=0, top=1)[0, 0]
+
+    slots: list = []
+    _place(comp, spec, slots)
+    regions = []
+    for plot, slot in slots:
+        region = _Region(figure.add_subfigure(slot))
+        # As ggplot.save does, so that the plot itself keeps no figure
+        plot = deepcopy(plot)
+        with _figure_is(region):
+            plot.draw(show=False)
+        regions.append(region)
+    for region in regions:
+        region.execute_layout()
+    return figure
+
+
+def save(comp: Composition, filename: str | Path):
+    """
+    Draw a composition to a file
+    """
+    compose(comp, comp.figsize).savefig(filename)
+
+
+def _best(fn, repeats: int) -> float:
+    import matplotlib.pyplot as plt
+
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+        plt.close("all")
+    return best
+
+
+def benchmark(notebook: Notebook, repeats: int = 3) -> list[dict]:
+    """
+    Time patchworklib against :func:`compose` for every composition
+
+    Each composition in the notebook (e.g. the freqpoly, drugs and
+    economics cells) is saved to PNG in memory ``repeats`` times with
+    each method, and the best time is kept. The time of patchworklib is
+    None if it is not installed or cannot draw with this plotnine.
+    """
+    import io
+
+    from .notebook import Runner
+    from .render import Composition, collect
+
+    runner = Runner(notebook)
+    rows = []
+    for cell in notebook.plot_cells():
+        for comp in collect(runner, cell):
+            if not isinstance(comp, Composition):
+                continue
+
+            def _patchwork():
+                comp.to_patchwork().savefig(io.BytesIO())
+
+            def _compose():
+                figure = compose(comp, comp.figsize)
+                figure.savefig(io.BytesIO(), format="png")
+
+            row: dict[str, Any] = {
+                "cell": cell.name,
+                "plots": len(comp.plots()),
+                "compose": _best(_compose, repeats),
+            }
+            try:
+                row["patchworklib"] = _best(_patchwork, repeats)
+            except (ImportError, TypeError):
+                # patchworklib draws with ggplot.draw(return_ggplot=True),
+                # which plotnine 0.15 does not have
+                row["patchworklib"] = None
+            rows.append(row)
+    return rows
@@ -0,0 +1,267 @@
+"""
+Datasets shared between processes through memory-mapped Arrow files
+
+``plotnine.data`` parses its CSV files in every process that imports
+it, and each render worker ends up with a private copy of every
+dataset. Instead, each dataset is converted once to an uncompressed
+Arrow IPC file (categoricals become dictionary-encoded columns) and the
+workers memory-map that file. The numeric and dictionary index columns
+are wrapped without copying, so all workers share the same pages of the
+OS page cache.
+
+Arrow IPC is used rather than Parquet because Parquet pages have to be
+decoded into private memory, while IPC buffers can be used in place.
+"""
+
+from __future__ import annotations
+
+import importlib.machinery
+import importlib.util
+import os
+import sys
+import tempfile
+import time
+import types
+from dataclasses import dataclass
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+from .cache import DEFAULT_CACHE_DIR
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+# Datasets used by the chapters, converted ahead of rendering
+DATASETS = ("mpg", "diamonds", "economics")
+
+DATA_DIR = DEFAULT_CACHE_DIR / "data"
+
+_loaded: dict[str, pd.DataFrame] = {}
+
+
+def have_pyarrow() -> bool:
+    return importlib.util.find_spec("pyarrow") is not None
+
+
+def _real_plotnine_data() -> types.ModuleType:
+    """
+    The ``plotnine.data`` module, even if :func:`install` replaced it
+    """
+    module = sys.modules.get("plotnine.data")
+    if isinstance(module, _DataModule):
+        return module._real()
+
+    import plotnine.data
+
+    return plotnine.data
+
+
+def dataset_path(name: str) -> Path:
+    from importlib.metadata import version
+
+    return DATA_DIR / f"{name}-plotnine-{version('plotnine')}.arrow"
+
+
+def convert(name: str) -> Path:
+    """
+    Write a ``plotnine.data`` dataset to an Arrow file, if not done yet
+    """
+    import pyarrow as pa
+
+    path = dataset_path(name)
+    if path.exists():
+        return path
+
+    df = getattr(_real_plotnine_data(), name)
+    table = pa.Table.from_pandas(df)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f, pa.ipc.new_file(f, table.schema) as w:
+            w.write_table(table)
+        os.replace(tmp, path)
+    except BaseException:
+        Path(tmp).unlink(missing_ok=True)
+        raise
+    return path
+
+
+def prepare(names=DATASETS):
+    """
+    Convert the datasets before starting workers that will share them
+    """
+    if have_pyarrow():
+        for name in names:
+            convert(name)
+
+
+def load(name: str) -> pd.DataFrame:
+    """
+    Memory-map a dataset
+
+    The frame is loaded once per process. Columns backed by the file
+    are read-only; assigning new columns works as usual. Without
+    pyarrow, it is the frame of ``plotnine.data``.
+    """
+    if not have_pyarrow():
+        return getattr(_real_plotnine_data(), name)
+    if name not in _loaded:
+        import pyarrow as pa
+
+        source = pa.memory_map(str(convert(name)), "r")
+        table = pa.ipc.open_file(source).read_all()
+        _loaded[name] = table.to_pandas(split_blocks=True)
+    return _loaded[name]
+
+
+class _DataModule(types.ModuleType):
+    """
+    Stand-in for ``plotnine.data`` that serves memory-mapped datasets
+
+    Any name that is not a dataset is looked up in the real module,
+    which is only imported if that happens.
+    """
+
+    def __init__(self, names):
+        super().__init__("plotnine.data")
+        self.__dict__["_names"] = frozenset(names)
+        self.__dict__["_module"] = None
+
+    def _real(self) -> types.ModuleType:
+        if self._module is None:
+            import plotnine
+
+            spec = importlib.machinery.PathFinder.find_spec(
+                "plotnine.data", plotnine.__path__
+            )
+            assert spec is not None and spec.loader is not None
+            module = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(module)
+            self.__dict__["_module"] = module
+        return self._module
+
+    def __getattr__(self, name: str):
+        if name in self._names:
+            return load(name)
+        return getattr(self._real(), name)
+
+
+def install(names=DATASETS) -> bool:
+    """
+    Make ``from plotnine.data import mpg`` return memory-mapped frames
+
+    Returns
+    -------
+    bool
+        False if pyarrow is not available, in which case nothing
+        changes.
+    """
+    if not have_pyarrow():
+        return False
+    module = sys.modules.get("plotnine.data")
+    if module is None:
+        import plotnine
+
+        module = _DataModule(names)
+        sys.modules["plotnine.data"] = module
+        plotnine.data = module  # type: ignore[attr-defined]
+    elif not isinstance(module, _DataModule):
+        for name in names:
+            setattr(module, name, load(name))
+    return True
+
+
+@dataclass
+class LoadStats:
+    """
+    Cost of loading datasets in one process
+    """
+
+    pid: int
+    seconds: float
+    rss_private: int
+    """Growth of anonymous (private) resident memory in bytes"""
+
+    rss_shared: int
+    """Growth of file-backed (shareable) resident memory in bytes"""
+
+
+def _rss() -> tuple[int, int]:
+    """
+    Anonymous and file-backed resident memory of this process in bytes
+
+    Only available on Linux; elsewhere both are 0.
+    """
+    anon = file = 0
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("RssAnon:"):
+                    anon = int(line.split()[1]) * 1024
+                elif line.startswith("RssFile:"):
+                    file = int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return anon, file
+
+
+def measure_load(names=DATASETS, mmap: bool = True) -> LoadStats:
+    """
+    Load the datasets and report the time and memory it took
+
+    Parameters
+    ----------
+    names :
+        Datasets to load.
+    mmap :
+        Whether to memory-map the Arrow files, or to load from
+        ``plotnine.data`` as the notebook does.
+    """
+    anon0, file0 = _rss()
+    start = time.perf_counter()
+    if mmap:
+        frames = [load(name) for name in names]
+    else:
+        module = _real_plotnine_data()
+        frames = [getattr(module, name) for name in names]
+    # Read every value so that lazily mapped pages count
+    import pandas as pd
+
+    for df in frames:
+        pd.util.hash_pandas_object(df)
+    seconds = time.perf_counter() - start
+    anon1, file1 = _rss()
+    return LoadStats(os.getpid(), seconds, anon1 - anon0, file1 - file0)
+
+
+def measure_workers(
+    jobs: int, names=DATASETS, mmap: bool = True
+) -> list[LoadStats]:
+    """
+    Run :func:`measure_load` in ``jobs`` fresh worker processes
+
+    File-backed memory is reported by every worker, but it is a single
+    copy in the page cache; only the private memory adds up. Without
+    pyarrow, the workers load from ``plotnine.data``.
+    """
+    import multiprocessing as mp
+    from concurrent.futures import ProcessPoolExecutor
+    from warnings import warn
+
+    if mmap and not have_pyarrow():
+        warn(
+            "pyarrow is not installed, the datasets are loaded from "
+            "plotnine.data instead of memory-mapped.",
+            stacklevel=2,
+        )
+        mmap = False
+    if mmap:
+        prepare(names)
+    ctx = mp.get_context("spawn")
+    with ProcessPoolExecutor(
+        max_workers=jobs, mp_context=ctx, max_tasks_per_child=1
+    ) as pool:
+        futures = [
+            pool.submit(measure_load, tuple(names), mmap) for _ in range(jobs)
+        ]
+        return [f.result() for f in futures]
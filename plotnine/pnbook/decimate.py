@@ -0,0 +1,233 @@
+"""
+Line and path layers reduced to what the panel can show
+
+A line with millions of points is drawn as millions of segments,
+although a panel is a few hundred pixels wide: drawing takes as long as
+the series is, and so does the size of an SVG or PDF. Decimation keeps,
+of each run of consecutive points of a group that fall in the same
+column (a quarter of a pixel wide), the first and the last point and
+the points with the smallest and the largest ``y`` (M4 aggregation).
+The segments between them cover the same pixels as the segments between
+all the points of the run, so the drawn line looks the same, extrema
+included (where the full line crosses itself many times within a pixel,
+its antialiased edges come out a little darker), with at most 16 points
+per pixel column and group.
+
+Runs are found for all the groups of a panel at once, and their lowest
+and highest points with ``reduceat``, so the cost is that of a few numpy
+passes over the layer.
+
+:class:`geom_line_decimated` and :class:`geom_path_decimated` decimate
+their layer; :func:`install` decimates every ``geom_line`` and
+``geom_path`` layer drawn within the context. Layers with fewer than
+``decimate_threshold`` rows, whose colour, size or line type vary along a
+line, or that are not drawn with ``coord_cartesian``, are drawn as they
+are.
+"""
+
+from __future__ import annotations
+
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Iterator
+
+import numpy as np
+from plotnine import geom_line, geom_path
+from plotnine.coords import coord_cartesian, coord_flip
+
+from .points import _largest_shape
+
+if TYPE_CHECKING:
+    import pandas as pd
+    from matplotlib.axes import Axes
+
+# Layers with fewer rows are drawn as they are
+DECIMATE_THRESHOLD = 5_000
+
+# Columns per pixel. Columns of data do not line up with the pixels of
+# the image, and a narrower column keeps the extrema of a run within a
+# fraction of a pixel of where they were.
+COLUMNS_PER_PIXEL = 4
+
+
+def m4(
+    x: np.ndarray,
+    y: np.ndarray,
+    groups: np.ndarray,
+    xrange: tuple[float, float],
+    columns: int,
+) -> np.ndarray:
+    """
+    Mask of the points kept by M4 aggregation
+
+    Parameters
+    ----------
+    x, y :
+        Points, in drawing order within each group.
+    groups :
+        Group of each point. The points of a group are consecutive.
+    xrange :
+        Range of x of the panel.
+    columns :
+        Number of columns across the panel.
+
+    Returns
+    -------
+    numpy.ndarray
+        Boolean mask of the points to draw.
+    """
+    n = len(x)
+    keep = np.zeros(n, dtype=bool)
+    if n < 3:
+        keep[:] = True
+        return keep
+    lo, hi = xrange
+    col = np.floor((x - lo) / ((hi - lo) or 1) * columns)
+    # Points outside the panel, on either side, share a column
+    col = np.clip(np.nan_to_num(col, nan=-1), -1, columns)
+    new = np.empty(n, dtype=bool)
+    new[0] = True
+    new[1:] = (col[1:] != col[:-1]) | (groups[1:] != groups[:-1])
+    starts = np.flatnonzero(new)
+    stops = np.append(starts[1:], n)
+
+    keep[starts] = True
+    keep[stops - 1] = True
+    # The lowest and highest points of each run (all of them, if tied)
+    lengths = stops - starts
+    keep |= y == np.repeat(np.minimum.reduceat(y, starts), lengths)
+    keep |= y == np.repeat(np.maximum.reduceat(y, starts), lengths)
+    return keep
+
+
+def _columns(ax: Axes, dpi: float | None) -> int:
+    """
+    Number of columns across the panel
+
+    The panel is not laid out yet, so this is for the widest it can be;
+    a panel that ends up narrower gets more columns per pixel.
+    """
+    _, width = _largest_shape(ax, dpi)
+    return width * COLUMNS_PER_PIXEL
+
+
+def decimate(
+    data: pd.DataFrame, panel_params, coord, ax: Axes, params: dict
+) -> pd.DataFrame:
+    """
+    The rows of a line or path layer that make the same drawing
+    """
+    if (
+        len(data) < params.get("decimate_threshold", DECIMATE_THRESHOLD)
+        or not isinstance(coord, coord_cartesian)
+        or isinstance(coord, coord_flip)
+    ):
+        return data
+
+    # geom_path draws the groups in order, keeping the order of rows
+    groups = data["group"].to_numpy()
+    order = np.argsort(groups, kind="stable")
+    groups = groups[order]
+
+    # Within a group, the segments take the colour, size and line type
+    # of their first point, which may be dropped
+    between = groups[1:] != groups[:-1]
+    for c in ("color", "size", "linetype", "alpha"):
+        if c in data:
+            v = data[c].to_numpy()[order]
+            if not (between | (v[1:] == v[:-1])).all():
+                return data
+
+    keep = m4(
+        data["x"].to_numpy(dtype=float)[order],
+        data["y"].to_numpy(dtype=float)[order],
+        groups,
+        panel_params.x.range,
+        _columns(ax, params.get("dpi")),
+    )
+    return data.iloc[np.sort(order[keep])]
+
+
+class geom_path_decimated(geom_path):
+    """
+    geom_path drawn with the points the panel can show
+
+    Accepts the same aesthetics and parameters as ``geom_path``.
+
+    Parameters
+    ----------
+    decimate_threshold : int, default=5000
+        Layers with fewer rows are drawn with all their points.
+    dpi : float, default=None
+        Resolution the points are picked for. Default is that of the
+        figure.
+    """
+
+    DEFAULT_PARAMS = {
+        **geom_path.DEFAULT_PARAMS,
+        "decimate_threshold": DECIMATE_THRESHOLD,
+        "dpi": None,
+    }
+
+    def handle_na(self, data: pd.DataFrame) -> pd.DataFrame:
+        """
+        geom_path's handle_na, without a Python call per row
+        """
+        from warnings import warn
+
+        from plotnine.exceptions import PlotnineWarning
+
+        # Rows before the first and after the last non-missing value of
+        # any of these columns are dropped
+        cols = ["x", "y", "size", "color", "linetype"]
+        present = ~data[cols].isna().to_numpy()
+        n = len(data)
+        found = present.any(axis=0)
+        first = np.where(found, present.argmax(axis=0), 1)
+        last = np.where(found, n - present[::-1].argmax(axis=0), n - 1)
+        rows = np.arange(n)[:, None]
+        keep = ((rows >= first) & (rows < last)).all(axis=1)
+        if keep.all():
+            return data.reset_index(drop=True)
+
+        data = data.loc[keep].reset_index(drop=True)
+        if not self.params["na_rm"]:
+            msg = "geom_path: Removed {} rows containing missing values."
+            warn(msg.format(n - len(data)), PlotnineWarning)
+        return data
+
+    def draw_panel(self, data: pd.DataFrame, panel_params, coord, ax: Axes):
+        data = decimate(data, panel_params, coord, ax, self.params)
+        return super().draw_panel(data, panel_params, coord, ax)
+
+
+class geom_line_decimated(geom_path_decimated):
+    """
+    geom_line drawn with the points the panel can show
+
+    Accepts the same aesthetics and parameters as
+    :class:`geom_path_decimated`.
+    """
+
+    setup_data = geom_line.setup_data
+
+
+@contextmanager
+def install(threshold: int = DECIMATE_THRESHOLD) -> Iterator[None]:
+    """
+    Decimate the geom_line and geom_path layers drawn in the context
+    """
+    draw_panel = geom_path.draw_panel
+
+    def decimated_draw_panel(self, data, panel_params, coord, ax):
+        # Not the geoms that draw something else between the points,
+        # like geom_step
+        if type(self) in (geom_path, geom_line):
+            params = {"decimate_threshold": threshold, **self.params}
+            data = decimate(data, panel_params, coord, ax, params)
+        return draw_panel(self, data, panel_params, coord, ax)
+
+    geom_path.draw_panel = decimated_draw_panel
+    try:
+        yield
+    finally:
+        geom_path.draw_panel = draw_panel
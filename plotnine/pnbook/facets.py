@@ -0,0 +1,459 @@
+"""
+facet_wrap for many panels
+
+plotnine draws every panel on its own matplotlib Axes, with its own
+background, grid, ticks, strip and one artist per layer; so drawing
+``facet_wrap("~hwy")`` costs dozens of times a single panel, and the
+cost grows with every panel. When all panels share their scales, they
+can be drawn as tiles of a single Axes instead:
+
+- the plot is built once by plotnine (stats, positions, scales, panel
+  layout), and since the scales are fixed, one set of panel parameters
+  (limits and breaks) serves every panel;
+- every row of a layer is moved into its tile with one vectorized
+  offset by panel, and each layer is drawn as one artist for all the
+  panels;
+- backgrounds and strips are one ``PatchCollection`` each, grid lines
+  and tick marks one ``LineCollection`` each;
+- tick labels are only created along the outer edges.
+
+The number of artists does not depend on the number of panels, except
+for the strip texts. Only the drawing is batched: the build is
+plotnine's.
+
+:class:`facet_wrap_batched` marks a plot for this drawing when pnbook
+renders it. Colours, line widths and font sizes are read from the
+plot's theme, but the layout is that of plotnine's default theme with
+no legend, so only plots that would look the same are batched (see
+:func:`can_batch`): the default theme, point and line layers that map
+nothing but ``x`` and ``y`` (and ``group``), round unfilled points,
+solid lines, and fixed continuous scales that are not dates. Other
+plots are drawn by plotnine, as is everything shown in marimo.
+"""
+
+from __future__ import annotations
+
+from copy import deepcopy
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+import numpy as np
+from plotnine import facet_wrap
+
+if TYPE_CHECKING:
+    import pandas as pd
+    from matplotlib.axes import Axes
+    from matplotlib.figure import Figure
+    from plotnine import ggplot
+
+POINT_GEOMS = ("geom_point", "geom_jitter")
+LINE_GEOMS = ("geom_line", "geom_path")
+
+# Tile geometry, in units of the panel size
+GAP = 0.06
+STRIP = 0.14
+
+# Points per mm
+PT = 72.27 / 25.4
+
+
+class facet_wrap_batched(facet_wrap):
+    """
+    facet_wrap with all panels drawn on one Axes
+
+    Accepts the same parameters as ``facet_wrap``. Only fixed scales
+    can be batched.
+    """
+
+
+# Aesthetics that can be mapped without a legend
+BATCH_AES = frozenset({"x", "y", "group"})
+
+# Values of the geoms' constant aesthetics that are drawn as plotnine
+# draws them
+BATCH_PARAMS = {
+    "shape": ("o",),
+    "fill": (None,),
+    "linetype": ("solid", "-"),
+}
+
+
+def can_batch(plot: ggplot) -> bool:
+    """
+    Whether a plot is drawn with all its panels on one Axes
+
+    Scales are only known once the plot is built, and :func:`save` draws
+    the plots with date or discrete positions with plotnine.
+    """
+    from plotnine import coord_cartesian, theme_gray
+
+    facet = plot.facet
+    free = getattr(facet, "free", {"x": True, "y": True})
+    if not (
+        isinstance(facet, facet_wrap_batched)
+        and not (free["x"] or free["y"])
+        and type(plot.coordinates) is coord_cartesian
+        and len(plot.layers) > 0
+        and plot.theme == theme_gray()
+    ):
+        return False
+
+    for layer in plot.layers:
+        geom = layer.geom
+        if type(geom).__name__ not in POINT_GEOMS + LINE_GEOMS:
+            return False
+        mapped = set(layer.mapping)
+        if layer.inherit_aes:
+            mapped |= set(plot.mapping)
+        if not mapped <= BATCH_AES:
+            return False
+        constants = {**geom.DEFAULT_AES, **geom.aes_params}
+        for name, allowed in BATCH_PARAMS.items():
+            if name in constants and constants[name] not in allowed:
+                return False
+    return True
+
+
+def _continuous(plot: ggplot) -> bool:
+    """
+    Whether a built plot has continuous, non-date position scales
+    """
+    from plotnine.scales.scale_continuous import scale_continuous
+    from plotnine.scales.scale_datetime import scale_datetime
+    from plotnine.scales.scale_xy import scale_x_timedelta, scale_y_timedelta
+
+    dates = (scale_datetime, scale_x_timedelta, scale_y_timedelta)
+    for sc in (plot.scales.get_scales("x"), plot.scales.get_scales("y")):
+        if not isinstance(sc, scale_continuous) or isinstance(sc, dates):
+            return False
+    return True
+
+
+class _Tiles:
+    """
+    Position of every panel in the shared Axes
+    """
+
+    def __init__(self, layout: pd.DataFrame, panel_params):
+        self.nrow = int(layout["ROW"].max())
+        self.ncol = int(layout["COL"].max())
+        self.panels = layout["PANEL"].to_numpy()
+        row = layout["ROW"].to_numpy()
+        col = layout["COL"].to_numpy()
+        # Offsets indexed by PANEL number
+        size = int(self.panels.max()) + 1
+        self.ox = np.zeros(size)
+        self.oy = np.zeros(size)
+        self.ox[self.panels] = (col - 1) * (1 + GAP)
+        self.oy[self.panels] = (self.nrow - row) * (1 + GAP + STRIP)
+        self.xrange = panel_params.x.range
+        self.yrange = panel_params.y.range
+
+        axis_x = layout.get("AXIS_X", row == self.nrow)
+        axis_y = layout.get("AXIS_Y", col == 1)
+        self.axis_x = self.panels[np.asarray(axis_x, dtype=bool)]
+        self.axis_y = self.panels[np.asarray(axis_y, dtype=bool)]
+
+    @property
+    def width(self) -> float:
+        return self.ncol * (1 + GAP) - GAP
+
+    @property
+    def height(self) -> float:
+        return self.nrow * (1 + GAP + STRIP) - GAP
+
+    def nx(self, x) -> np.ndarray:
+        x0, x1 = self.xrange
+        return (np.asarray(x, dtype=float) - x0) / ((x1 - x0) or 1)
+
+    def ny(self, y) -> np.ndarray:
+        y0, y1 = self.yrange
+        return (np.asarray(y, dtype=float) - y0) / ((y1 - y0) or 1)
+
+    def place(self, data: pd.DataFrame) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Positions of the rows of a layer in the shared Axes
+        """
+        panel = data["PANEL"].astype(int).to_numpy()
+        return (
+            self.ox[panel] + self.nx(data["x"]),
+            self.oy[panel] + self.ny(data["y"]),
+        )
+
+
+class _Style:
+    """
+    The colours, line widths and font sizes of a plot's theme
+    """
+
+    def __init__(self, theme):
+        get = theme.getp
+        self.panel_fill = get(("panel_background", "facecolor"))
+        self.strip_fill = get(("strip_background_x", "facecolor"))
+        # Colour and width of the grid lines, by axis and kind
+        self.grid = {
+            (axis, which): (
+                get((f"panel_grid_{which}_{axis}", "color")),
+                get((f"panel_grid_{which}_{axis}", "linewidth")),
+            )
+            for axis in ("x", "y")
+            for which in ("minor", "major")
+        }
+        self.strip_text = (
+            get(("strip_text_x", "color")),
+            get(("strip_text_x", "size")),
+        )
+        self.axis_text = (
+            get(("axis_text_x", "color")),
+            get(("axis_text_x", "size")),
+        )
+        self.ticks = (
+            get(("axis_ticks_major_x", "color")),
+            get(("axis_ticks_major_x", "linewidth")),
+        )
+        # Points
+        self.tick_length = get("axis_ticks_length_major_x")
+        self.axis_title = get(("axis_title_x", "size"))
+        self.title = get(("plot_title", "size"))
+
+
+def _draw_panels(ax: Axes, tiles: _Tiles, panel_params, style: _Style):
+    from matplotlib.collections import LineCollection, PatchCollection
+    from matplotlib.patches import Rectangle
+
+    ox, oy = tiles.ox[tiles.panels], tiles.oy[tiles.panels]
+    ax.add_collection(
+        PatchCollection(
+            [Rectangle((x, y), 1, 1) for x, y in zip(ox, oy)],
+            facecolor=style.panel_fill,
+            edgecolor="none",
+            zorder=0,
+        )
+    )
+    ax.add_collection(
+        PatchCollection(
+            [Rectangle((x, y + 1), 1, STRIP) for x, y in zip(ox, oy)],
+            facecolor=style.strip_fill,
+            edgecolor="none",
+            zorder=0,
+        )
+    )
+
+    # Grid lines of all panels: (panels, breaks) segments at once
+    grid = style.grid
+    for breaks, (colour, width) in [
+        (panel_params.x.minor_breaks, grid["x", "minor"]),
+        (panel_params.x.breaks, grid["x", "major"]),
+    ]:
+        b = tiles.nx(_finite(breaks))
+        x = np.add.outer(ox, b).ravel()
+        y0 = np.repeat(oy, len(b))
+        segs = np.stack([np.c_[x, y0], np.c_[x, y0 + 1]], axis=1)
+        ax.add_collection(
+            LineCollection(segs, colors=colour, linewidths=width, zorder=1)
+        )
+    for breaks, (colour, width) in [
+        (panel_params.y.minor_breaks, grid["y", "minor"]),
+        (panel_params.y.breaks, grid["y", "major"]),
+    ]:
+        b = tiles.ny(_finite(breaks))
+        y = np.add.outer(oy, b).ravel()
+        x0 = np.repeat(ox, len(b))
+        segs = np.stack([np.c_[x0, y], np.c_[x0 + 1, y]], axis=1)
+        ax.add_collection(
+            LineCollection(segs, colors=colour, linewidths=width, zorder=1)
+        )
+
+
+def _draw_strips(
+    ax: Axes, tiles: _Tiles, layout: pd.DataFrame, facet, style: _Style
+):
+    names = [v for v in getattr(facet, "vars", []) if v in layout]
+    for _, row in layout.iterrows():
+        label = ", ".join(str(row[v]) for v in names)
+        p = int(row["PANEL"])
+        ax.text(
+            tiles.ox[p] + 0.5,
+            tiles.oy[p] + 1 + STRIP / 2,
+            label,
+            ha="center",
+            va="center",
+            fontsize=style.strip_text[1],
+            color=style.strip_text[0],
+            clip_on=False,
+        )
+
+
+def _draw_axes(ax: Axes, tiles: _Tiles, panel_params, style: _Style):
+    from matplotlib.collections import LineCollection
+
+    # Tick length in units of the panel height
+    panel_height = ax.get_position().height * ax.figure.get_figheight()
+    tick = style.tick_length / 72 / (panel_height / tiles.height)
+    colour, size = style.axis_text
+    x_breaks = _finite(panel_params.x.breaks)
+    y_breaks = _finite(panel_params.y.breaks)
+    x_labels = _labels(panel_params.x, x_breaks)
+    y_labels = _labels(panel_params.y, y_breaks)
+    bx, by = tiles.nx(x_breaks), tiles.ny(y_breaks)
+
+    segs = []
+    for p in tiles.axis_x:
+        for x, label in zip(tiles.ox[p] + bx, x_labels):
+            segs.append([(x, tiles.oy[p]), (x, tiles.oy[p] - tick)])
+            ax.text(
+                x, tiles.oy[p] - 2 * tick, label, ha="center", va="top",
+                fontsize=size, color=colour, clip_on=False,
+            )
+    for p in tiles.axis_y:
+        for y, label in zip(tiles.oy[p] + by, y_labels):
+            segs.append([(tiles.ox[p], y), (tiles.ox[p] - tick, y)])
+            ax.text(
+                tiles.ox[p] - 2 * tick, y, label, ha="right", va="center",
+                fontsize=size, color=colour, clip_on=False,
+            )
+    if segs:
+        ax.add_collection(
+            LineCollection(
+                segs,
+                colors=style.ticks[0],
+                linewidths=style.ticks[1],
+                zorder=1,
+            )
+        )
+
+
+def _finite(values) -> np.ndarray:
+    values = np.asarray(values, dtype=float)
+    return values[np.isfinite(values)]
+
+
+def _labels(view, breaks: np.ndarray) -> list[str]:
+    all_breaks = np.asarray(view.breaks, dtype=float)
+    labels = list(view.labels)
+    keep = np.isfinite(all_breaks)
+    return [str(lab) for lab, k in zip(labels, keep) if k][: len(breaks)]
+
+
+def _rgba(data: pd.DataFrame, colour: str = "color") -> np.ndarray:
+    import pandas as pd
+    from matplotlib.colors import to_rgba_array
+
+    codes, uniques = pd.factorize(data[colour])
+    rgba = to_rgba_array(list(uniques))[codes]
+    if "alpha" in data:
+        alpha = data["alpha"].to_numpy(dtype=float)
+        rgba[:, 3] = np.where(np.isnan(alpha), rgba[:, 3], alpha)
+    return rgba
+
+
+def _draw_points(ax: Axes, tiles: _Tiles, data: pd.DataFrame, zorder):
+    x, y = tiles.place(data)
+    stroke = data["stroke"] if "stroke" in data else 0.5
+    diameter = (data["size"] + stroke).to_numpy(dtype=float) * PT
+    ax.scatter(
+        x,
+        y,
+        s=diameter**2 / 2,
+        c=_rgba(data),
+        linewidths=0,
+        zorder=zorder,
+    )
+
+
+def _draw_lines(
+    ax: Axes, tiles: _Tiles, data: pd.DataFrame, sort: bool, zorder
+):
+    from matplotlib.collections import LineCollection
+
+    keys = ["PANEL", "group"]
+    if sort:
+        data = data.sort_values(keys + ["x"], kind="stable")
+    x, y = tiles.place(data)
+    starts = np.flatnonzero(
+        (data[keys].shift() != data[keys]).any(axis=1).to_numpy()
+    )
+    lines = np.split(np.c_[x, y], starts[1:])
+    colours = _rgba(data)[starts]
+    widths = data["size"].to_numpy(dtype=float)[starts] * PT
+    ax.add_collection(
+        LineCollection(
+            lines, colors=colours, linewidths=widths, zorder=zorder
+        )
+    )
+
+
+def _built(plot: ggplot) -> ggplot:
+    """
+    A copy of the plot, built, with its default labels
+    """
+    plot = deepcopy(plot)
+    plot.labels.add_defaults(plot.mapping.labels)
+    plot._build()
+    return plot
+
+
+def draw(plot: ggplot, figsize=None) -> Figure:
+    """
+    Draw a fixed-scale facet_wrap plot with all panels on one Axes
+    """
+    return _draw(_built(plot), figsize)
+
+
+def _draw(plot: ggplot, figsize=None) -> Figure:
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+    from plotnine.options import get_option
+
+    layout = plot.layout.layout
+    panel_params = plot.layout.panel_params[0]
+    tiles = _Tiles(layout, panel_params)
+
+    figure = Figure(figsize=figsize or get_option("figure_size"))
+    FigureCanvasAgg(figure)
+    # Room above the strips for the title
+    title = plot.labels.get("title", "")
+    ax = figure.add_axes((0.1, 0.1, 0.86, 0.81 if title else 0.86))
+    ax.set_axis_off()
+    ax.set_xlim(0, tiles.width)
+    ax.set_ylim(0, tiles.height)
+
+    style = _Style(plot.theme)
+    _draw_panels(ax, tiles, panel_params, style)
+    for zorder, layer in enumerate(plot.layers, start=2):
+        data = layer.data
+        name = type(layer.geom).__name__
+        if name in POINT_GEOMS:
+            _draw_points(ax, tiles, data, zorder)
+        else:
+            _draw_lines(ax, tiles, data, name == "geom_line", zorder)
+    _draw_strips(ax, tiles, layout, plot.facet, style)
+    _draw_axes(ax, tiles, panel_params, style)
+
+    # Axis titles as plotnine takes them, from the scales or the labels
+    labels = plot.coordinates.labels(plot.layout.set_xy_labels(plot.labels))
+    for text, kwargs in [
+        (labels.x, dict(x=0.53, y=0.02, ha="center", va="bottom")),
+        (labels.y, dict(x=0.01, y=0.53, ha="left", va="center", rotation=90)),
+        (
+            title,
+            dict(x=0.53, y=0.99, ha="center", va="top", fontsize=style.title),
+        ),
+    ]:
+        if text:
+            figure.text(s=text, **{"fontsize": style.axis_title, **kwargs})
+    return figure
+
+
+def save(plot: ggplot, filename: str | Path):
+    """
+    Draw a plot for which :func:`can_batch` holds to a file
+
+    Plots whose position scales turn out to be dates or discrete are
+    saved by plotnine.
+    """
+    built = _built(plot)
+    if _continuous(built):
+        _draw(built).savefig(filename)
+    else:
+        plot.save(filename, verbose=False)
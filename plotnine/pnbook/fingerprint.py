@@ -0,0 +1,184 @@
+"""
+Stable fingerprints of plots and data
+
+A fingerprint is a hex digest that changes whenever anything that
+affects the drawn figure changes: the data, the mapping, the layers and
+their parameters, facets, coordinates, scales, theme and labels, the
+versions of the libraries that do the drawing, and the source of pnbook,
+whose geoms and renderers draw too.
+"""
+
+from __future__ import annotations
+
+import hashlib
+from functools import lru_cache
+from importlib.metadata import PackageNotFoundError, version
+from typing import Any
+
+# Packages whose version can change how a figure looks
+RENDER_PACKAGES = ("plotnine", "matplotlib", "pandas", "numpy", "patchworklib")
+
+# Attributes that hold draw-time state or back references, and that are
+# not part of the specification of a plot
+_SKIP_ATTRS = frozenset(
+    {
+        "environment",
+        "figure",
+        "axs",
+        "plot",
+        "layout",
+        "_build_objs",
+        "_gridspec",
+        "_is_built",
+        "_targets",
+    }
+)
+
+
+@lru_cache(maxsize=1)
+def library_versions() -> tuple[tuple[str, str], ...]:
+    """
+    Versions of the packages that take part in drawing
+    """
+    result = []
+    for pkg in RENDER_PACKAGES:
+        try:
+            result.append((pkg, version(pkg)))
+        except PackageNotFoundError:
+            result.append((pkg, ""))
+    return tuple(result)
+
+
+@lru_cache(maxsize=1)
+def pnbook_version() -> str:
+    """
+    Digest of the source of pnbook
+
+    pnbook is not a versioned package, and its geoms, stats and
+    renderers draw figures too.
+    """
+    from pathlib import Path
+
+    h = hashlib.sha256()
+    for path in sorted(Path(__file__).parent.glob("*.py")):
+        h.update(path.name.encode())
+        h.update(path.read_bytes())
+    return h.hexdigest()[:16]
+
+
+def data_fingerprint(data: Any) -> str:
+    """
+    Fingerprint of a dataframe (or array)
+
+    The values, the index, the column names and the dtypes (including
+    the categories of categoricals) all take part.
+    """
+    import numpy as np
+    import pandas as pd
+
+    h = hashlib.sha256()
+    if isinstance(data, pd.DataFrame):
+        h.update(repr(list(data.columns)).encode())
+        h.update(repr([str(t) for t in data.dtypes]).encode())
+        for name in data.columns:
+            col = data[name]
+            if isinstance(col.dtype, pd.CategoricalDtype):
+                h.update(repr(list(col.cat.categories)).encode())
+        values = pd.util.hash_pandas_object(data, index=True).to_numpy()
+        h.update(values.tobytes())
+    elif isinstance(data, pd.Series):
+        h.update(repr((data.name, str(data.dtype))).encode())
+        values = pd.util.hash_pandas_object(data, index=True).to_numpy()
+        h.update(values.tobytes())
+    else:
+        arr = np.ascontiguousarray(data)
+        h.update(repr((arr.dtype.str, arr.shape)).encode())
+        h.update(arr.tobytes())
+    return h.hexdigest()
+
+
+def canonical(obj: Any, _seen: set[int] | None = None) -> Any:
+    """
+    Reduce an object to nested tuples of primitives
+
+    The result has a deterministic ``repr`` that only depends on the
+    contents of ``obj``, not on memory addresses or insertion order.
+    """
+    import numpy as np
+    import pandas as pd
+
+    if obj is None or isinstance(obj, (bool, int, float, complex, str, bytes)):
+        return obj
+    if isinstance(obj, (pd.DataFrame, pd.Series)):
+        return ("data", data_fingerprint(obj))
+    if isinstance(obj, np.ndarray):
+        return ("array", data_fingerprint(obj))
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if isinstance(obj, type):
+        return ("type", obj.__module__, obj.__qualname__)
+
+    if _seen is None:
+        _seen = set()
+    if id(obj) in _seen:
+        return ("cycle", type(obj).__qualname__)
+    _seen = _seen | {id(obj)}
+
+    if isinstance(obj, dict):
+        items = sorted(
+            ((repr(canonical(k, _seen)), canonical(v, _seen)) for k, v in obj.items()),
+            key=lambda kv: kv[0],
+        )
+        return (type(obj).__qualname__, tuple(items))
+    if isinstance(obj, (list, tuple)):
+        return (type(obj).__qualname__, tuple(canonical(v, _seen) for v in obj))
+    if isinstance(obj, (set, frozenset)):
+        return ("set", tuple(sorted(repr(canonical(v, _seen)) for v in obj)))
+    if callable(obj) and not hasattr(obj, "__dict__"):
+        return ("callable", getattr(obj, "__qualname__", repr(obj)))
+    if hasattr(obj, "__code__"):
+        # Functions, e.g. labellers and breaks functions
+        closure = tuple(
+            canonical(c.cell_contents, _seen) for c in obj.__closure__ or ()
+        )
+        return ("function", obj.__qualname__, _code_key(obj.__code__), closure)
+
+    attrs = getattr(obj, "__dict__", None)
+    if attrs is None:
+        return (type(obj).__qualname__, repr(obj))
+    state = {k: v for k, v in attrs.items() if k not in _SKIP_ATTRS}
+    return (
+        type(obj).__module__,
+        type(obj).__qualname__,
+        canonical(state, _seen),
+    )
+
+
+def _code_key(code) -> tuple:
+    consts = tuple(
+        _code_key(c) if hasattr(c, "co_code") else repr(c) for c in code.co_consts
+    )
+    return (code.co_code, consts, code.co_names)
+
+
+def plot_fingerprint(plot: Any) -> str:
+    """
+    Fingerprint of a ggplot or a composition of ggplots
+
+    Parameters
+    ----------
+    plot :
+        A ``ggplot`` or a :class:`~pnbook.render.Composition`.
+    """
+    from .render import Composition
+
+    h = hashlib.sha256()
+    h.update(repr(library_versions()).encode())
+    h.update(pnbook_version().encode())
+    if isinstance(plot, Composition):
+        h.update(repr((plot.op, plot.figsize)).encode())
+        for part in plot.parts:
+            h.update(plot_fingerprint(part).encode())
+    else:
+        h.update(repr(canonical(plot)).encode())
+    return h.hexdigest()
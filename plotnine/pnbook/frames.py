@@ -0,0 +1,71 @@
+"""
+Derived columns without mutating shared data
+
+Datasets such as ``economics`` are shared by every cell (and, with
+:mod:`pnbook.data`, memory-mapped into every worker), so a cell must not
+add columns to them in place. :func:`derive` returns a new frame with
+the extra columns instead. The existing columns are not copied, and
+each derived column is computed once per process for a given source
+frame: it is memoized by the fingerprint of the frame and the code of
+the function that computes it.
+"""
+
+from __future__ import annotations
+
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Any, Callable
+
+from .fingerprint import canonical, data_fingerprint
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+# Number of derived columns kept in memory
+MAX_COLUMNS = 256
+
+_memo: OrderedDict[tuple[str, str, str], pd.Series] = OrderedDict()
+
+
+def derive(
+    data: pd.DataFrame, **columns: Callable[[pd.DataFrame], Any]
+) -> pd.DataFrame:
+    """
+    Add computed columns to a frame, without modifying it
+
+    Parameters
+    ----------
+    data :
+        Source frame. It is left unchanged.
+    **columns :
+        ``name=function``, where the function takes the source frame
+        and returns the values of the new column.
+
+    Returns
+    -------
+    pandas.DataFrame
+        The columns of ``data`` followed by the derived columns.
+
+    Examples
+    --------
+    >>> derive(economics, year=lambda df: pd.to_datetime(df["date"]).dt.year)
+    """
+    import pandas as pd
+
+    clash = set(columns).intersection(data.columns)
+    if clash:
+        raise ValueError(f"Frame already has columns {sorted(clash)}")
+
+    fp = data_fingerprint(data)
+    new = {}
+    for name, fn in columns.items():
+        key = (fp, name, repr(canonical(fn)))
+        if key in _memo:
+            _memo.move_to_end(key)
+        else:
+            _memo[key] = pd.Series(fn(data), index=data.index, name=name)
+            if len(_memo) > MAX_COLUMNS:
+                _memo.popitem(last=False)
+        new[name] = _memo[key]
+
+    extra = pd.DataFrame(new, index=data.index)
+    return pd.concat([data, extra], axis=1)
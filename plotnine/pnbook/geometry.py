@@ -0,0 +1,480 @@
+"""
+Polygon layers simplified and culled for the size they are drawn at
+
+Map boundaries come with far more vertices than a figure can show: at
+the scale of a whole country, most of an LGA's vertices fall within a
+fraction of a pixel of each other. :class:`geom_polygon_simplified`
+draws a ``geom_polygon`` layer (a frame of vertices with ``x``, ``y``,
+``group`` and optionally ``subgroup`` for holes) the way the maps
+chapter uses ``rmapshaper::ms_simplify``, but with the tolerance set by
+the panel:
+
+- the polygons whose bounding box is outside the panel's limits are
+  dropped, found with an :class:`STRtree` of the bounding boxes, so
+  zoomed views only draw what is in view;
+- the rings are simplified with Douglas-Peucker to within
+  ``PIXEL_FRACTION`` of a pixel. All the rings are simplified together:
+  every pass splits all the segments whose farthest vertex is beyond
+  the tolerance, with numpy operations over all the segments at once;
+- the tolerance is rounded down to a power of two, and the vertices
+  kept for a geometry and tolerance are saved in the cache directory,
+  so each resolution is simplified once.
+
+:func:`simplify` does the same to a frame ahead of time.
+"""
+
+from __future__ import annotations
+
+import hashlib
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Sequence
+
+import numpy as np
+from plotnine import geom_polygon
+from plotnine.coords import coord_cartesian, coord_flip
+
+from .cache import DEFAULT_CACHE_DIR, DiskCache
+from .fingerprint import data_fingerprint
+from .points import _largest_shape
+
+if TYPE_CHECKING:
+    import pandas as pd
+    from matplotlib.axes import Axes
+    from matplotlib.path import Path
+
+# Where the vertices kept for each geometry and tolerance are stored
+SIMPLIFY_DIR = DEFAULT_CACHE_DIR / "geometry"
+
+# Distance a simplified boundary may be from the original, in pixels
+PIXEL_FRACTION = 0.5
+
+# Number of entries of a node of an STRtree
+LEAF_SIZE = 16
+
+# Number of prepared geometries and simplifications kept in memory
+MAX_ITEMS = 32
+
+_geometries: OrderedDict[str, _Geometry] = OrderedDict()
+_kept: OrderedDict[str, np.ndarray] = OrderedDict()
+_disk: DiskCache | None = None
+
+
+def _remember(store: OrderedDict, key: str, value):
+    store[key] = value
+    if len(store) > MAX_ITEMS:
+        store.popitem(last=False)
+
+
+def _ranges(starts: np.ndarray, stops: np.ndarray) -> np.ndarray:
+    """
+    Concatenation of ``arange(start, stop)`` for each pair
+    """
+    lengths = stops - starts
+    offsets = np.cumsum(lengths) - lengths
+    return np.arange(lengths.sum()) + np.repeat(starts - offsets, lengths)
+
+
+def _str_order(boxes: np.ndarray, leaf_size: int) -> np.ndarray:
+    """
+    Order of boxes that packs them into nodes the STR way
+
+    The boxes are sorted by the x of their centre into vertical slices,
+    and within each slice by the y of their centre.
+    """
+    n = len(boxes)
+    nodes = -(-n // leaf_size)
+    slices = int(np.ceil(np.sqrt(nodes)))
+    cx = boxes[:, 0] + boxes[:, 2]
+    cy = boxes[:, 1] + boxes[:, 3]
+    by_x = np.argsort(cx, kind="stable")
+    slab = np.empty(n, dtype=np.intp)
+    slab[by_x] = np.arange(n) // (slices * leaf_size)
+    return np.lexsort((cy, slab))
+
+
+def _intersects(boxes: np.ndarray, window: Sequence[float]) -> np.ndarray:
+    xmin, ymin, xmax, ymax = window
+    return (
+        (boxes[:, 0] <= xmax)
+        & (boxes[:, 2] >= xmin)
+        & (boxes[:, 1] <= ymax)
+        & (boxes[:, 3] >= ymin)
+    )
+
+
+class STRtree:
+    """
+    R-tree of boxes, packed with the Sort-Tile-Recursive method
+
+    Parameters
+    ----------
+    boxes :
+        ``(n, 4)`` array of ``xmin, ymin, xmax, ymax``.
+    leaf_size :
+        Number of entries of a node.
+    """
+
+    def __init__(self, boxes: np.ndarray, leaf_size: int = LEAF_SIZE):
+        boxes = np.asarray(boxes, dtype=float).reshape(-1, 4)
+        self.items = _str_order(boxes, leaf_size)
+        self.boxes = boxes[self.items]
+        # From the root down: boxes of the nodes and the range of their
+        # entries in the level below
+        self.levels: list[tuple[np.ndarray, np.ndarray, np.ndarray]] = []
+        entries = self.boxes
+        while len(entries) > leaf_size:
+            starts = np.arange(0, len(entries), leaf_size)
+            stops = np.minimum(starts + leaf_size, len(entries))
+            nodes = np.column_stack(
+                [
+                    np.minimum.reduceat(entries[:, 0], starts),
+                    np.minimum.reduceat(entries[:, 1], starts),
+                    np.maximum.reduceat(entries[:, 2], starts),
+                    np.maximum.reduceat(entries[:, 3], starts),
+                ]
+            )
+            order = _str_order(nodes, leaf_size)
+            entries = nodes[order]
+            self.levels.insert(0, (entries, starts[order], stops[order]))
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def query(self, window: Sequence[float]) -> np.ndarray:
+        """
+        Indices of the boxes that intersect ``(xmin, ymin, xmax, ymax)``
+        """
+        if not len(self.levels):
+            candidates = np.arange(len(self.items))
+        else:
+            candidates = np.arange(len(self.levels[0][0]))
+        for nodes, starts, stops in self.levels:
+            hit = candidates[_intersects(nodes[candidates], window)]
+            candidates = _ranges(starts[hit], stops[hit])
+        hit = candidates[_intersects(self.boxes[candidates], window)]
+        return np.sort(self.items[hit])
+
+
+def douglas_peucker(
+    x: np.ndarray,
+    y: np.ndarray,
+    starts: np.ndarray,
+    stops: np.ndarray,
+    tolerance: float,
+) -> np.ndarray:
+    """
+    Vertices kept when simplifying many rings with Douglas-Peucker
+
+    Parameters
+    ----------
+    x, y :
+        Vertices of all the rings, one ring after the other.
+    starts, stops :
+        Range of rows of each ring.
+    tolerance :
+        Largest distance of a dropped vertex from the simplified ring.
+
+    Returns
+    -------
+    numpy.ndarray
+        Boolean mask of the vertices kept. The first and last vertex of
+        each ring, and the vertex farthest from the first, always are.
+    """
+    n = len(x)
+    keep = np.zeros(n, dtype=bool)
+    if not n:
+        return keep
+    keep[starts] = keep[stops - 1] = True
+
+    # A closed ring starts as two paths, to and from the vertex
+    # farthest from its first
+    lengths = stops - starts
+    ring = np.repeat(np.arange(len(starts)), lengths)
+    d = np.hypot(x - x[starts][ring], y - y[starts][ring])
+    farthest = np.maximum.reduceat(d, starts)
+    candidate = np.where(d == farthest[ring], np.arange(n), n)
+    far = np.minimum.reduceat(candidate, starts)
+    keep[far] = True
+
+    a = np.concatenate([starts, far])
+    b = np.concatenate([far, stops - 1])
+    tol2 = tolerance**2
+    while True:
+        inner = b - a > 1
+        a, b = a[inner], b[inner]
+        if not len(a):
+            break
+        idx = _ranges(a + 1, b)
+        counts = b - a - 1
+        seg = np.repeat(np.arange(len(a)), counts)
+        ax, ay = x[a][seg], y[a][seg]
+        dx, dy = x[b][seg] - ax, y[b][seg] - ay
+        px, py = x[idx] - ax, y[idx] - ay
+        # Squared distance to the segment
+        length2 = dx * dx + dy * dy
+        t = np.clip(
+            (px * dx + py * dy) / np.where(length2 > 0, length2, 1), 0, 1
+        )
+        dist2 = (px - t * dx) ** 2 + (py - t * dy) ** 2
+        first = np.cumsum(counts) - counts
+        worst = np.maximum.reduceat(dist2, first)
+        split = worst > tol2
+        candidate = np.where(dist2 == worst[seg], idx, n)
+        m = np.minimum.reduceat(candidate, first)[split]
+        keep[m] = True
+        a, b = np.concatenate([a[split], m]), np.concatenate([m, b[split]])
+    return keep
+
+
+@dataclass
+class _Geometry:
+    """
+    The rings and polygons of a layer, ready to simplify and cull
+    """
+
+    key: str
+    order: np.ndarray
+    """Rows sorted so that the vertices of each ring are together"""
+
+    starts: np.ndarray
+    stops: np.ndarray
+    groups: np.ndarray
+    """Polygon of each sorted row"""
+
+    tree: STRtree
+    """Bounding boxes of the polygons"""
+
+    @classmethod
+    def prepare(cls, data: pd.DataFrame, rings: list[str]) -> _Geometry:
+        import pandas as pd
+
+        key = data_fingerprint(data[["x", "y", *rings]])
+        if key in _geometries:
+            _geometries.move_to_end(key)
+            return _geometries[key]
+
+        codes = [pd.factorize(data[c], sort=True)[0] for c in rings]
+        order = np.lexsort(codes[::-1])
+        keys = np.column_stack([c[order] for c in codes])
+        change = np.flatnonzero((np.diff(keys, axis=0) != 0).any(axis=1)) + 1
+        starts = np.concatenate([[0], change])
+        stops = np.concatenate([change, [len(data)]])
+
+        groups = keys[:, 0]
+        x = data["x"].to_numpy(dtype=float)[order]
+        y = data["y"].to_numpy(dtype=float)[order]
+        first = np.flatnonzero(np.diff(groups, prepend=-1))
+        boxes = np.column_stack(
+            [
+                np.minimum.reduceat(x, first),
+                np.minimum.reduceat(y, first),
+                np.maximum.reduceat(x, first),
+                np.maximum.reduceat(y, first),
+            ]
+        )
+        geometry = cls(key, order, starts, stops, groups, STRtree(boxes))
+        _remember(_geometries, key, geometry)
+        return geometry
+
+    def kept(self, data: pd.DataFrame, tolerance: float) -> np.ndarray:
+        """
+        Mask of the sorted rows kept by simplifying to ``tolerance``
+        """
+        global _disk
+
+        key = hashlib.sha256(f"{self.key} {tolerance!r}".encode()).hexdigest()
+        if key in _kept:
+            _kept.move_to_end(key)
+            return _kept[key]
+        if _disk is None:
+            _disk = DiskCache(SIMPLIFY_DIR)
+        n = len(self.order)
+        stored = _disk.read(key, "bits")
+        if stored is not None:
+            keep = np.unpackbits(np.frombuffer(stored, np.uint8), count=n)
+            keep = keep.astype(bool)
+        else:
+            keep = douglas_peucker(
+                data["x"].to_numpy(dtype=float)[self.order],
+                data["y"].to_numpy(dtype=float)[self.order],
+                self.starts,
+                self.stops,
+                tolerance,
+            )
+            _disk.write(key, "bits", np.packbits(keep).tobytes())
+        _remember(_kept, key, keep)
+        return keep
+
+    def visible(self, window: Sequence[float]) -> np.ndarray:
+        """
+        Mask of the sorted rows of the polygons that touch ``window``
+        """
+        return np.isin(self.groups, self.tree.query(window))
+
+
+def _compound_paths(
+    xy: np.ndarray, ring_starts: np.ndarray, group_starts: np.ndarray
+) -> list[Path]:
+    """
+    One path per group, of all its rings
+
+    The first ring of a group runs counterclockwise and the others
+    clockwise, so that matplotlib, which fills by the nonzero winding
+    rule, leaves holes where ggplot2's even-odd rule would.
+    """
+    from matplotlib.path import Path
+
+    x, y = xy[:, 0], xy[:, 1]
+    stops = np.append(ring_starts[1:], len(xy))
+    following = np.arange(1, len(xy) + 1)
+    following[stops - 1] = ring_starts
+    area = np.add.reduceat(x * y[following] - x[following] * y, ring_starts)
+    outer = np.isin(ring_starts, group_starts)
+    flip = (area > 0) != outer
+    rings = [
+        ring[::-1] if f else ring
+        for ring, f in zip(np.split(xy, ring_starts[1:]), flip)
+    ]
+    group_of_ring = np.cumsum(outer) - 1
+    paths: list[list[Path]] = [[] for _ in range(len(group_starts))]
+    for g, ring in zip(group_of_ring, rings):
+        closed = np.concatenate([ring, ring[:1]])
+        paths[g].append(Path(closed, closed=True))
+    return [Path.make_compound_path(*p) for p in paths]
+
+
+def _rings(data: pd.DataFrame) -> list[str]:
+    return ["group", "subgroup"] if "subgroup" in data else ["group"]
+
+
+def simplify(data: pd.DataFrame, tolerance: float) -> pd.DataFrame:
+    """
+    Simplify the polygons of a geom_polygon frame
+
+    Parameters
+    ----------
+    data :
+        Vertices, with columns ``x``, ``y``, ``group`` and optionally
+        ``subgroup``.
+    tolerance :
+        Largest distance of a dropped vertex from the simplified
+        boundary, in the units of ``x`` and ``y``.
+
+    Returns
+    -------
+    pandas.DataFrame
+        The rows kept, in their original order.
+    """
+    geometry = _Geometry.prepare(data, _rings(data))
+    kept = geometry.order[geometry.kept(data, tolerance)]
+    return data.iloc[np.sort(kept)]
+
+
+def pixel_tolerance(
+    xrange: tuple[float, float],
+    yrange: tuple[float, float],
+    shape: tuple[int, int],
+) -> float:
+    """
+    ``PIXEL_FRACTION`` of a pixel, rounded down to a power of 2
+    """
+    size = min(
+        abs(xrange[1] - xrange[0]) / max(shape[1], 1),
+        abs(yrange[1] - yrange[0]) / max(shape[0], 1),
+    )
+    if not size > 0:
+        return 0.0
+    return float(2.0 ** np.floor(np.log2(size * PIXEL_FRACTION)))
+
+
+class geom_polygon_simplified(geom_polygon):
+    """
+    geom_polygon simplified and culled for the panel it is drawn in
+
+    Accepts the same aesthetics and parameters as ``geom_polygon``.
+
+    Parameters
+    ----------
+    tolerance : float, default=None
+        Largest distance of a dropped vertex from the simplified
+        boundary, in data units. Default is ``PIXEL_FRACTION`` of a
+        pixel of the panel.
+    dpi : float, default=None
+        Resolution the default tolerance is for. Default is that of the
+        figure.
+    """
+
+    DEFAULT_PARAMS = {
+        **geom_polygon.DEFAULT_PARAMS,
+        "tolerance": None,
+        "dpi": None,
+    }
+
+    def draw_panel(self, data: pd.DataFrame, panel_params, coord, ax: Axes):
+        if (
+            not len(data)
+            or not isinstance(coord, coord_cartesian)
+            or isinstance(coord, coord_flip)
+        ):
+            return super().draw_panel(data, panel_params, coord, ax)
+
+        params = self.params
+        xrange, yrange = panel_params.x.range, panel_params.y.range
+        tolerance = params["tolerance"]
+        if tolerance is None:
+            # The panel is not laid out yet; half a pixel of the largest
+            # it can be is at most half a pixel of the final panel
+            shape = _largest_shape(ax, params["dpi"])
+            tolerance = pixel_tolerance(xrange, yrange, shape)
+
+        geometry = _Geometry.prepare(data, _rings(data))
+        rows = geometry.visible((xrange[0], yrange[0], xrange[1], yrange[1]))
+        if tolerance > 0:
+            rows &= geometry.kept(data, tolerance)
+        data = data.iloc[np.sort(geometry.order[rows])]
+        self._draw_polygons(data, panel_params, coord, ax, params)
+
+    @staticmethod
+    def _draw_polygons(
+        data: pd.DataFrame, panel_params, coord, ax: Axes, params: dict
+    ):
+        """
+        geom_polygon's draw_group, with the vertices split by numpy
+
+        With a ``subgroup``, each group is drawn as one compound path,
+        its first ring the outline and the others holes.
+        """
+        import pandas as pd
+        from matplotlib.collections import PathCollection, PolyCollection
+        from plotnine._utils import SIZE_FACTOR, to_rgba
+
+        data = coord.transform(data, panel_params, munch=True)
+        # Polygons in the order of their first row, as plotnine does
+        codes, _ = pd.factorize(data["group"])
+        if "subgroup" in data:
+            rings, _ = pd.factorize(data["subgroup"])
+            order = np.lexsort((rings, codes))
+        else:
+            order = np.argsort(codes, kind="stable")
+        starts = np.flatnonzero(np.diff(codes[order], prepend=-1))
+        xy = data[["x", "y"]].to_numpy(dtype=float)[order]
+        first = data.iloc[order[starts]]
+        kwargs = dict(
+            facecolors=to_rgba(first["fill"], first["alpha"]),
+            edgecolors=[c or "none" for c in first["color"]],
+            linestyles=list(first["linetype"]),
+            linewidths=list(first["size"] * SIZE_FACTOR),
+            zorder=params["zorder"],
+            rasterized=params["raster"],
+        )
+        if "subgroup" in data:
+            new = np.diff(codes[order], prepend=-1) | np.diff(
+                rings[order], prepend=-1
+            )
+            col = PathCollection(
+                _compound_paths(xy, np.flatnonzero(new), starts), **kwargs
+            )
+        else:
+            col = PolyCollection(np.split(xy, starts[1:]), **kwargs)
+        ax.add_collection(col)
@@ -0,0 +1,146 @@
+"""
+Jitter that is the same on every run
+
+plotnine jitters with numpy's global random state, so a plot with
+``geom_jitter()`` changes every time it is drawn, and so do the files,
+which defeats the figure cache and makes diffs of the rendered
+figures noisy. Here the noise of a layer comes from a
+``numpy.random.Generator`` seeded with a fingerprint of the layer's
+positions (``x``, ``y``, ``PANEL`` and ``group``) and a seed:
+
+- the same layer jitters the same way in every run and every process;
+- layers with different data get different noise;
+- the noise for all the rows is drawn in one call, and kept (keyed by
+  the fingerprint) so redrawing a plot does not draw it again.
+
+As in ggplot2, each row is moved by the same amount in all the x (and
+all the y) aesthetics.
+
+:func:`install` makes the jitter of every layer that was not given a
+``random_state`` reproducible; pnbook renders figures with it.
+"""
+
+from __future__ import annotations
+
+import hashlib
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Iterator
+
+import numpy as np
+from plotnine import position_jitter
+
+from .fingerprint import data_fingerprint
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+# Seed mixed into the fingerprint of every layer
+SEED = 0
+
+# Number of layers whose noise is kept
+MAX_ITEMS = 64
+
+# Columns that identify the rows of a layer
+_KEY_COLUMNS = ("x", "y", "PANEL", "group")
+
+_noise: OrderedDict[str, np.ndarray] = OrderedDict()
+
+
+def noise(data: pd.DataFrame, seed: int = SEED) -> np.ndarray:
+    """
+    Uniform noise in [-1, 1) for the x and y of each row of a layer
+
+    Returns
+    -------
+    numpy.ndarray
+        Array of shape ``(2, len(data))``. It is shared, do not modify
+        it.
+    """
+    columns = [c for c in _KEY_COLUMNS if c in data]
+    h = hashlib.sha256(data_fingerprint(data[columns]).encode())
+    h.update(str(seed).encode())
+    key = h.hexdigest()
+    if key in _noise:
+        _noise.move_to_end(key)
+        return _noise[key]
+    rng = np.random.default_rng(int.from_bytes(h.digest()[:8], "little"))
+    values = rng.uniform(-1, 1, size=(2, len(data)))
+    values.flags.writeable = False
+    _noise[key] = values
+    if len(_noise) > MAX_ITEMS:
+        _noise.popitem(last=False)
+    return values
+
+
+def jitter_layer(
+    data: pd.DataFrame, width: float, height: float, seed: int = SEED
+) -> pd.DataFrame:
+    """
+    Move each row by up to ``width`` along x and ``height`` along y
+    """
+    from plotnine.positions.position import X_AESTHETICS, Y_AESTHETICS
+
+    if not len(data) or not (width or height):
+        return data
+    u = noise(data, seed)
+    for amount, offsets, aesthetics in (
+        (width, u[0], X_AESTHETICS),
+        (height, u[1], Y_AESTHETICS),
+    ):
+        if amount:
+            columns = [c for c in data.columns if c in aesthetics]
+            shift = amount * offsets
+            data[columns] = data[columns].add(shift, axis=0)
+    return data
+
+
+class position_jitter_seeded(position_jitter):
+    """
+    position_jitter that is the same on every run
+
+    Parameters
+    ----------
+    width :
+        Amount of horizontal jitter. If `None`, `0.4` of the resolution
+        of the data.
+    height :
+        Amount of vertical jitter. If `None`, `0.4` of the resolution
+        of the data.
+    seed :
+        Seed mixed with the fingerprint of the layer's positions.
+    """
+
+    def __init__(
+        self,
+        width: float | None = None,
+        height: float | None = None,
+        seed: int = SEED,
+    ):
+        super().__init__(width, height)
+        self.params["seed"] = seed
+
+    @classmethod
+    def compute_layer(cls, data, params, layout):
+        return jitter_layer(
+            data, params["width"], params["height"], params["seed"]
+        )
+
+
+@contextmanager
+def install(seed: int = SEED) -> Iterator[None]:
+    """
+    Make the jitter of layers without a ``random_state`` reproducible
+    """
+    compute_layer = vars(position_jitter)["compute_layer"]
+
+    def seeded_compute_layer(cls, data, params, layout):
+        if params["random_state"] is not np.random:
+            return compute_layer.__func__(cls, data, params, layout)
+        return jitter_layer(data, params["width"], params["height"], seed)
+
+    position_jitter.compute_layer = classmethod(seeded_compute_layer)
+    try:
+        yield
+    finally:
+        position_jitter.compute_layer = compute_layer
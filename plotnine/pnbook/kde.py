@@ -0,0 +1,315 @@
+"""
+Binned kernel densities computed with the FFT
+
+plotnine evaluates a Gaussian kernel density by summing the kernel of
+every row at each of the ``n`` points where it is wanted, an
+O(rows x n) computation for every group. Here, all the groups of a panel
+are done together:
+
+1. each group gets a grid with a spacing proportional to its bandwidth,
+   and its rows are linearly binned onto it (one ``numpy.bincount``
+   for all the groups);
+2. the grids are convolved with the kernel sampled at their spacing,
+   by real FFTs of (groups x grid) arrays;
+3. the densities are interpolated linearly from the grids to the
+   points where they are wanted.
+
+The cost is O(rows + groups x grid log grid). The spacing is chosen so
+that the result is within ``relative_error`` of the exact density,
+relative to the peak of the kernel (the largest value a density of that
+bandwidth can take).
+
+Only Gaussian kernels, numeric or ``nrd0`` bandwidths and unbounded
+densities are binned; other layers are left to plotnine.
+"""
+
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+from warnings import warn
+
+import numpy as np
+from plotnine import geom_density as _geom_density
+from plotnine import geom_violin as _geom_violin
+from plotnine.exceptions import PlotnineWarning
+from plotnine.stats import stat_density, stat_ydensity
+from plotnine.stats.stat import stat
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+# Default error of the densities, relative to the peak of the kernel
+RELATIVE_ERROR = 0.001
+
+# Largest number of grid points of a group. Groups with values spread
+# over more than MAX_GRID times the spacing get a coarser grid.
+MAX_GRID = 2**16
+
+
+def densities(
+    x: np.ndarray,
+    group: np.ndarray,
+    bw: np.ndarray,
+    at: np.ndarray,
+    weights: np.ndarray | None = None,
+    relative_error: float = RELATIVE_ERROR,
+) -> np.ndarray:
+    """
+    Gaussian kernel densities of several groups
+
+    Parameters
+    ----------
+    x :
+        Values of all the groups.
+    group :
+        Group of each value, in ``0, 1, ..., ngroups - 1``. Every group
+        should have a value.
+    bw :
+        Bandwidth of each group.
+    at :
+        ``(ngroups, n)`` array of the points where each density is
+        evaluated.
+    weights :
+        Weights of the values. The weights of a group are normalised to
+        add up to 1.
+    relative_error :
+        Error of the densities, relative to the peak of the kernel
+        ``1 / (bw * sqrt(2 * pi))``. A third comes from the binning, a
+        third from the interpolation and a third from truncating the
+        kernel.
+
+    Returns
+    -------
+    numpy.ndarray
+        ``(ngroups, n)`` array of the densities.
+    """
+    x = np.asarray(x, dtype=float)
+    bw = np.asarray(bw, dtype=float)
+    at = np.atleast_2d(np.asarray(at, dtype=float))
+    ngroups = len(bw)
+    w = np.ones(len(x)) if weights is None else np.asarray(weights, float)
+    w = w / np.bincount(group, weights=w, minlength=ngroups)[group]
+
+    lo = np.full(ngroups, np.inf)
+    hi = np.full(ngroups, -np.inf)
+    np.minimum.at(lo, group, x)
+    np.maximum.at(hi, group, x)
+
+    # Linear binning and linear interpolation are both within
+    # spacing**2 / 8 of the curvature of the kernel, at most its
+    # peak / bw**2
+    step = np.sqrt(8 * relative_error / 3)
+    spacing = np.maximum(bw * step, (hi - lo) / (MAX_GRID - 1))
+    size = int(np.ceil(((hi - lo) / spacing).max())) + 2
+    # The kernel is truncated where it falls below a third of the error
+    cut = np.sqrt(2 * np.log(3 / relative_error))
+    taps = int(np.ceil(cut / (spacing / bw).min()))
+    length = 1 << int(np.ceil(np.log2(size + 2 * taps)))
+
+    # 1. Linear binning, the grid of group g starts at lo[g]
+    pos = (x - lo[group]) / spacing[group]
+    left = np.floor(pos).astype(np.int64)
+    frac = pos - left
+    flat = group * length + left
+    grid = np.bincount(flat, w * (1 - frac), minlength=ngroups * length)
+    grid += np.bincount(flat + 1, w * frac, minlength=ngroups * length)
+    grid = grid.reshape(ngroups, length)
+
+    # 2. Circular convolution with the kernel sampled at the spacing of
+    # each grid, the same array unless a grid was capped. Negative
+    # offsets wrap around to the end, where the grids are zero.
+    offsets = np.arange(length)
+    offsets = np.where(offsets < length // 2, offsets, offsets - length)
+    u = offsets * (spacing / bw)[:, None]
+    kernel = np.exp(-0.5 * u**2) / np.sqrt(2 * np.pi)
+    kernel[np.abs(u) > cut] = 0
+    dens = np.fft.irfft(
+        np.fft.rfft(grid, axis=1) * np.fft.rfft(kernel, axis=1),
+        n=length,
+        axis=1,
+    )
+    dens /= bw[:, None]
+
+    # 3. Interpolation, nothing is further than taps from the grid
+    pos = (at - lo[:, None]) / spacing[:, None]
+    outside = (pos < -taps) | (pos > length - taps - 1)
+    pos = np.clip(pos, -taps, length - taps - 1)
+    left = np.floor(pos).astype(np.int64)
+    frac = pos - left
+    rows = np.arange(ngroups)[:, None]
+    res = (1 - frac) * dens[rows, left % length]
+    res += frac * dens[rows, (left + 1) % length]
+    res[outside] = 0
+    return np.maximum(res, 0)
+
+
+def nrd0(x: np.ndarray) -> float:
+    """
+    plotnine's port of R's ``bw.nrd0``, without scipy
+    """
+    n = len(x)
+    std = np.std(x, ddof=1)
+    q1, q3 = np.percentile(x, [25, 75])
+    std_estimate = (q3 - q1) / 1.349
+    low_std = min(std, std_estimate)
+    if low_std == 0:
+        low_std = std_estimate or np.abs(x[0]) or 1
+    return 0.9 * low_std * n**-0.2
+
+
+def _constant_columns(data: pd.DataFrame, groups) -> pd.DataFrame:
+    """
+    Columns that are constant within every group, one row per group
+    """
+    grouped = data.groupby(groups, sort=True, observed=True)
+    constant = grouped.nunique(dropna=False).eq(1).all()
+    return grouped.first()[constant[constant].index]
+
+
+class _BinnedKDE(stat):
+    """
+    Kernel densities of all the groups of a panel at once
+
+    Placed after plotnine's density stat in the bases, so that what
+    plotnine does with the densities of all the groups (e.g. the
+    ``violinwidth`` of stat_ydensity) still happens.
+    """
+
+    # Variable whose density is estimated
+    _var = "x"
+
+    def _binned(self) -> bool:
+        params = self.params
+        bw = params["bw"]
+        return (
+            params["kernel"] == "gau"
+            and (not isinstance(bw, str) or bw == "nrd0")
+            and not np.isfinite(params["bounds"]).any()
+        )
+
+    def compute_panel(self, data: pd.DataFrame, scales) -> pd.DataFrame:
+        import pandas as pd
+
+        if not len(data) or not self._binned():
+            return super().compute_panel(data, scales)
+
+        params = self.params
+        var = self._var
+        data = data[data[var].notna()]
+        n = data.groupby("group")[var].transform("size")
+        if (n < 2).any():
+            if isinstance(params["bw"], str):
+                warn(
+                    "Groups with fewer than 2 data points have been "
+                    "removed.",
+                    PlotnineWarning,
+                )
+                data = data[n >= 2]
+            if not len(data):
+                return pd.DataFrame()
+
+        codes, keys = pd.factorize(data["group"], sort=True)
+        values = data[var].to_numpy(dtype=float)
+        # The values sorted by group, split once into views
+        ordered = values[np.argsort(codes, kind="stable")]
+        counts = np.bincount(codes, minlength=len(keys))
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+        if isinstance(params["bw"], str):
+            by_group = np.split(ordered, starts[1:])
+            bw = np.array([nrd0(v) for v in by_group])
+        else:
+            bw = np.full(len(keys), float(params["bw"]))
+        bw *= params["adjust"]
+
+        lo = np.minimum.reduceat(ordered, starts)
+        hi = np.maximum.reduceat(ordered, starts)
+        if params["trim"]:
+            start, end = lo, hi
+        else:
+            dimension = getattr(scales, var).dimension()
+            start = np.full(len(keys), dimension[0])
+            end = np.full(len(keys), dimension[1])
+        at = np.linspace(start, end, params["n"], axis=1)
+        weights = data["weight"] if "weight" in data else None
+        dens = densities(
+            values, codes, bw, at, weights, params["relative_error"]
+        )
+
+        row = np.repeat(np.arange(len(keys)), params["n"])
+        res = pd.DataFrame(
+            {
+                "x": at.ravel(),
+                "density": dens.ravel(),
+                "scaled": (dens / dens.max(axis=1)[:, None]).ravel(),
+                "count": (dens * counts[:, None]).ravel(),
+                "n": counts[row],
+                "group": keys[row],
+            }
+        )
+        res = self._finish(res, data, keys, row)
+        constant = _constant_columns(data, "group")
+        missing = constant.columns.difference(res.columns)
+        extra = constant.loc[keys[row], missing].reset_index(drop=True)
+        return pd.concat([res, extra], axis=1)
+
+    def _finish(self, res, data, keys, row) -> pd.DataFrame:
+        return res
+
+
+class stat_density_binned(stat_density, _BinnedKDE):
+    """
+    stat_density with binned kernel densities
+
+    Parameters
+    ----------
+    relative_error : float, default=0.001
+        Error of the density, relative to the peak of the kernel.
+    """
+
+    DEFAULT_PARAMS = {
+        **stat_density.DEFAULT_PARAMS,
+        "relative_error": RELATIVE_ERROR,
+    }
+
+
+class stat_ydensity_binned(stat_ydensity, _BinnedKDE):
+    """
+    stat_ydensity with binned kernel densities
+
+    Parameters
+    ----------
+    relative_error : float, default=0.001
+        Error of the density, relative to the peak of the kernel.
+    """
+
+    DEFAULT_PARAMS = {
+        **stat_ydensity.DEFAULT_PARAMS,
+        "relative_error": RELATIVE_ERROR,
+    }
+    _var = "y"
+
+    def _finish(self, res, data, keys, row) -> pd.DataFrame:
+        x = data.groupby("group")["x"].agg(["min", "max"]).loc[keys]
+        res["y"] = res["x"]
+        res["x"] = ((x["min"] + x["max"]) / 2).to_numpy()[row]
+        # Compute width if x has multiple values
+        ptp = (x["max"] - x["min"]).to_numpy()
+        if (ptp > 0).any():
+            res["width"] = np.where(ptp > 0, ptp * 0.9, np.nan)[row]
+        return res
+
+
+def geom_density(*args, **kwargs):
+    """
+    plotnine's geom_density computed with :class:`stat_density_binned`
+    """
+    kwargs.setdefault("stat", stat_density_binned)
+    return _geom_density(*args, **kwargs)
+
+
+def geom_violin(*args, **kwargs):
+    """
+    plotnine's geom_violin computed with :class:`stat_ydensity_binned`
+    """
+    kwargs.setdefault("stat", stat_ydensity_binned)
+    return _geom_violin(*args, **kwargs)
@@ -0,0 +1,530 @@
+"""
+Force-directed layouts of networks
+
+The networks chapter lays graphs out with ggraph; plotnine has no
+layouts, so :func:`layout_graph` computes node positions for a graph
+given as an edge list, as a frame with ``x`` and ``y`` to draw with
+``geom_point``, and :func:`edge_segments` gives the edges as
+``x``, ``y``, ``xend`` and ``yend`` for ``geom_segment``.
+
+The layout is Fruchterman-Reingold: edges pull their ends together,
+all the nodes push each other apart, and a temperature that cools over
+the iterations caps how far a node moves. The repulsion, which is
+quadratic in the number of nodes when computed exactly, comes from a
+Barnes-Hut :class:`QuadTree`:
+
+- the nodes are sorted by their Morton code, so the nodes of each cell,
+  at every depth, are consecutive and the mass and centre of mass of
+  all the cells of a depth are reductions over slices;
+- the tree is walked for all the nodes at once, a depth at a time: a
+  (node, cell) pair is settled with the cell's centre of mass if the
+  cell holds one node, or does not hold the node and is small enough
+  seen from it (``size / distance < theta``), and is otherwise
+  replaced by the pairs of the node and the cell's children.
+
+So an iteration costs O(n log n) numpy work. Random starting positions
+leave large graphs folded over themselves, so the layout starts from
+:func:`pivot_mds`, which gets the global shape right, scaled to the
+size the forces settle at, and the iterations only refine it.
+
+Layouts are kept in memory
+and in the cache directory, keyed by the graph and the parameters, so
+re-rendering a figure does not lay the graph out again. A layout can
+also start from earlier positions (``init``): the nodes it knows start
+where they were, new nodes next to their neighbours, and a few cool
+iterations settle the changes.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import io
+from collections import OrderedDict
+from typing import TYPE_CHECKING
+
+import numpy as np
+
+from .cache import DEFAULT_CACHE_DIR, DiskCache
+from .fingerprint import data_fingerprint
+from .geometry import _ranges
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+# Where layouts are stored
+LAYOUT_DIR = DEFAULT_CACHE_DIR / "layouts"
+
+# Opening criterion of the Barnes-Hut tree
+THETA = 1.0
+
+# Iterations of a layout from pivot MDS, and from earlier positions
+ITERATIONS = 100
+WARM_ITERATIONS = 30
+
+# Largest move of a node in the first iteration; edges end up a few
+# units long
+TEMPERATURE = 1.0
+
+# Number of pivots of the initial layout
+PIVOTS = 50
+
+# Pull of every node towards the centre, so that the components of a
+# disconnected graph stay close
+GRAVITY = 0.1
+
+# Depth of the quadtree
+MAX_DEPTH = 20
+
+# Number of layouts kept in memory
+MAX_ITEMS = 32
+
+_layouts: OrderedDict[str, np.ndarray] = OrderedDict()
+_disk: DiskCache | None = None
+
+
+def _remember(key: str, value: np.ndarray):
+    _layouts[key] = value
+    if len(_layouts) > MAX_ITEMS:
+        _layouts.popitem(last=False)
+
+
+def _morton(ix: np.ndarray, iy: np.ndarray, depth: int) -> np.ndarray:
+    """
+    Interleave the bits of two integer coordinates
+    """
+    code = np.zeros(len(ix), dtype=np.int64)
+    for bit in range(depth):
+        code |= ((ix >> bit) & 1) << (2 * bit)
+        code |= ((iy >> bit) & 1) << (2 * bit + 1)
+    return code
+
+
+class QuadTree:
+    """
+    Barnes-Hut quadtree of weighted points
+
+    Parameters
+    ----------
+    pos :
+        ``(n, 2)`` array of positions.
+    mass :
+        Mass of each point.
+    depth :
+        Maximum depth. Points closer than the size of the root over
+        ``2**depth`` share a leaf.
+    """
+
+    def __init__(
+        self, pos: np.ndarray, mass: np.ndarray, depth: int = MAX_DEPTH
+    ):
+        n = len(pos)
+        lo = pos.min(axis=0)
+        size = float((pos.max(axis=0) - lo).max()) or 1.0
+        cells = 1 << depth
+        q = np.minimum((pos - lo) / size * cells, cells - 1).astype(np.int64)
+        code = _morton(q[:, 0], q[:, 1], depth)
+        order = np.argsort(code, kind="stable")
+        code = code[order]
+        self.order = order
+        weighted = pos[order] * mass[order, None]
+        m = mass[order]
+
+        # From the root down, for each depth: first sorted point, mass
+        # and centre of mass of each cell
+        self.size = size
+        self.starts: list[np.ndarray] = []
+        self.count: list[np.ndarray] = []
+        self.mass: list[np.ndarray] = []
+        self.com: list[np.ndarray] = []
+        for level in range(depth + 1):
+            prefix = code >> (2 * (depth - level))
+            starts = np.flatnonzero(np.diff(prefix, prepend=-1))
+            total = np.add.reduceat(m, starts)
+            self.starts.append(starts)
+            self.count.append(np.diff(starts, append=n))
+            self.mass.append(total)
+            self.com.append(np.add.reduceat(weighted, starts) / total[:, None])
+            # Deeper levels would be the same
+            if len(starts) == n:
+                break
+
+        # Range of the children of each cell in the level below
+        self.children = [
+            np.searchsorted(below, np.append(starts, n))
+            for starts, below in zip(self.starts, self.starts[1:])
+        ]
+
+    @property
+    def depth(self) -> int:
+        return len(self.starts) - 1
+
+    def forces(self, pos: np.ndarray, theta: float = THETA) -> np.ndarray:
+        """
+        Sum over the other points of ``mass * d / |d|**2`` at each point
+
+        ``d`` is the vector from the other point.
+        """
+        # Points are numbered in the sorted order, in which the nodes of
+        # a cell are consecutive and memory access is mostly sequential
+        n = len(pos)
+        x, y = pos[self.order, 0], pos[self.order, 1]
+        fx, fy = np.zeros(n), np.zeros(n)
+        node = np.arange(n)
+        cell = np.zeros(n, dtype=np.intp)
+        for level in range(self.depth + 1):
+            com = self.com[level][cell]
+            dx, dy = x[node] - com[:, 0], y[node] - com[:, 1]
+            dist2 = dx * dx + dy * dy
+            size = self.size / (1 << level)
+            first = self.starts[level][cell]
+            count = self.count[level][cell]
+            inside = (first <= node) & (node < first + count)
+            settled = (
+                (count == 1)
+                | ((size * size < theta * theta * dist2) & ~inside)
+                | (level == self.depth)
+            )
+            use = settled & (dist2 > 0)
+            k = self.mass[level][cell[use]] / dist2[use]
+            fx += np.bincount(node[use], dx[use] * k, minlength=n)
+            fy += np.bincount(node[use], dy[use] * k, minlength=n)
+
+            node, cell = node[~settled], cell[~settled]
+            if not len(node):
+                break
+            bounds = self.children[level]
+            first, last = bounds[cell], bounds[cell + 1]
+            node = np.repeat(node, last - first)
+            cell = _ranges(first, last)
+
+        force = np.empty((n, 2))
+        force[self.order, 0] = fx
+        force[self.order, 1] = fy
+        return force
+
+
+def pivot_mds(
+    src: np.ndarray,
+    dst: np.ndarray,
+    n: int,
+    pivots: int = PIVOTS,
+    seed: int = 0,
+) -> np.ndarray:
+    """
+    Positions that keep the graph distances to a few pivot nodes
+
+    Pivot MDS (Brandes and Pich): the distances from every node to
+    ``pivots`` nodes, found by breadth first search from each and
+    picked far apart, are double centred and projected on their first
+    two singular vectors. Nodes in different components are as far
+    apart as the two farthest nodes of a component, plus one.
+    """
+    from scipy.sparse import coo_matrix
+    from scipy.sparse.csgraph import shortest_path
+
+    rng = np.random.default_rng(seed)
+    jitter = rng.uniform(-0.5, 0.5, size=(n, 2))
+    if n < 3:
+        return jitter
+    graph = coo_matrix((np.ones(len(src)), (src, dst)), shape=(n, n))
+    graph = graph.tocsr()
+    pivot = int(rng.integers(n))
+    nearest = np.full(n, np.inf)
+    columns = []
+    for _ in range(min(pivots, n)):
+        d = shortest_path(
+            graph, directed=False, unweighted=True, indices=pivot
+        )
+        columns.append(d)
+        nearest = np.minimum(nearest, d)
+        # Unreachable nodes first, then the farthest from all pivots
+        pivot = int(np.argmax(np.where(np.isinf(nearest), np.inf, nearest)))
+    d = np.column_stack(columns)
+    finite = np.isfinite(d)
+    d[~finite] = d[finite].max() + 1
+    d2 = d**2
+    c = d2 - d2.mean(axis=0) - d2.mean(axis=1)[:, None] + d2.mean()
+    u, sv, _ = np.linalg.svd(-c / 2, full_matrices=False)
+    # Nodes with the same distances to all the pivots would overlap
+    return u[:, :2] * sv[:2] + jitter
+
+
+def _fit_scale(
+    pos: np.ndarray,
+    src: np.ndarray,
+    dst: np.ndarray,
+    w: np.ndarray,
+    gravity: float,
+) -> np.ndarray:
+    """
+    Scale a layout to the size with the least force layout energy
+
+    The energy is ``sum(w * |d|**3) / 3`` over the edges, minus
+    ``sum(log |d|)`` over the pairs of nodes, plus ``gravity *
+    sum(|x|**2) / 2``; scaling the layout by ``s`` changes it by
+    ``s**3 * a / 3 - pairs * log(s) + s**2 * b / 2``, which is least
+    where ``a * s**3 + b * s**2 = pairs``.
+    """
+    n = len(pos)
+    pos = pos - pos.mean(axis=0)
+    a = (w * np.sqrt(((pos[src] - pos[dst]) ** 2).sum(axis=1)) ** 3).sum()
+    b = gravity * (pos**2).sum()
+    roots = np.roots([a, b, 0, -n * (n - 1) / 2])
+    real = roots[np.isreal(roots) & (roots.real > 0)].real
+    return pos * real[0] if len(real) else pos
+
+
+def force_layout(
+    src: np.ndarray,
+    dst: np.ndarray,
+    n: int,
+    weights: np.ndarray | None = None,
+    iterations: int = ITERATIONS,
+    theta: float = THETA,
+    gravity: float = GRAVITY,
+    pos: np.ndarray | None = None,
+    temperature: float = TEMPERATURE,
+    seed: int = 0,
+) -> np.ndarray:
+    """
+    Fruchterman-Reingold layout with Barnes-Hut repulsion
+
+    Parameters
+    ----------
+    src, dst :
+        Ends of the edges, as node numbers.
+    n :
+        Number of nodes.
+    weights :
+        Strength of each edge.
+    iterations :
+        Number of iterations.
+    theta :
+        Opening criterion of the quadtree; 0 computes the repulsion
+        exactly.
+    gravity :
+        Pull towards the origin.
+    pos :
+        Initial positions, by default :func:`pivot_mds` scaled to the
+        size of the final layout.
+    temperature :
+        Largest move in the first iteration.
+    seed :
+        Seed of the initial positions.
+
+    Returns
+    -------
+    numpy.ndarray
+        ``(n, 2)`` positions.
+    """
+    w = np.ones(len(src)) if weights is None else np.asarray(weights, float)
+    if pos is None:
+        pos = pivot_mds(src, dst, n, seed=seed)
+        pos = _fit_scale(pos, src, dst, w, gravity)
+    else:
+        pos = np.array(pos, dtype=float)
+    mass = np.ones(n)
+
+    for it in range(iterations):
+        disp = QuadTree(pos, mass).forces(pos, theta)
+        # Attraction |d|**2 along the edges
+        d = pos[src] - pos[dst]
+        f = d * (np.sqrt((d**2).sum(axis=1)) * w)[:, None]
+        for axis in range(2):
+            pull = np.bincount(dst, f[:, axis], minlength=n)
+            pull -= np.bincount(src, f[:, axis], minlength=n)
+            disp[:, axis] += pull
+        disp -= gravity * pos
+
+        t = temperature * (1 - it / iterations)
+        length = np.sqrt((disp**2).sum(axis=1))
+        scale = np.minimum(length, t) / np.where(length > 0, length, 1)
+        pos += disp * scale[:, None]
+    return pos
+
+
+def _start(
+    names: pd.Index,
+    src: np.ndarray,
+    dst: np.ndarray,
+    init: pd.DataFrame,
+    name: str,
+    seed: int,
+) -> np.ndarray:
+    """
+    Positions of the nodes in ``init``, and next to them for new nodes
+    """
+    n = len(names)
+    known = init.drop_duplicates(name).set_index(name)
+    xy = known.reindex(names)[["x", "y"]].to_numpy(dtype=float)
+    have = ~np.isnan(xy).any(axis=1)
+    if have.any():
+        centre = xy[have].mean(axis=0)
+        xy[have] -= centre
+    rng = np.random.default_rng(seed)
+    jitter = rng.uniform(-0.5, 0.5, size=(n, 2))
+    # A few rounds, so that chains of new nodes grow from known ones
+    for _ in range(3):
+        if have.all():
+            break
+        a = np.concatenate([src, dst])
+        b = np.concatenate([dst, src])
+        link = have[b] & ~have[a]
+        hits = np.bincount(a[link], minlength=n)
+        found = hits > 0
+        for axis in range(2):
+            total = np.bincount(a[link], xy[b[link], axis], minlength=n)
+            xy[found, axis] = total[found] / hits[found]
+        xy[found] += jitter[found]
+        have |= found
+    side = np.sqrt(max(n, 1))
+    lost = ~have
+    xy[lost] = rng.uniform(-side / 2, side / 2, size=(lost.sum(), 2))
+    return xy
+
+
+def layout_graph(
+    edges: pd.DataFrame,
+    nodes: pd.DataFrame | None = None,
+    source: str = "from",
+    target: str = "to",
+    name: str = "name",
+    weight: str | None = None,
+    iterations: int | None = None,
+    theta: float = THETA,
+    gravity: float = GRAVITY,
+    init: pd.DataFrame | None = None,
+    seed: int = 0,
+) -> pd.DataFrame:
+    """
+    Positions of the nodes of a graph
+
+    Parameters
+    ----------
+    edges :
+        Edge list, with the names of the nodes at the ends of each edge
+        in ``source`` and ``target``.
+    nodes :
+        Nodes, with their names in ``name``; they are returned in this
+        order, with their columns. By default, the nodes are the names
+        in ``edges``, sorted.
+    weight :
+        Column of ``edges`` with the strength of each edge.
+    iterations :
+        Number of iterations, by default ``ITERATIONS``, or
+        ``WARM_ITERATIONS`` with ``init``.
+    theta :
+        Opening criterion of the Barnes-Hut tree; 0 is exact.
+    gravity :
+        Pull of the nodes towards the centre.
+    init :
+        Earlier layout (with ``name``, ``x`` and ``y``), e.g. of the
+        graph before some nodes or edges were added. Its nodes start
+        where they were and the layout only settles the changes.
+    seed :
+        Seed of the initial positions.
+
+    Returns
+    -------
+    pandas.DataFrame
+        The nodes, with ``x`` and ``y``.
+
+    Examples
+    --------
+    >>> pos = layout_graph(highschool)
+    >>> (
+    ...     ggplot()
+    ...     + geom_segment(aes("x", "y", xend="xend", yend="yend"),
+    ...                    edge_segments(highschool, pos))
+    ...     + geom_point(aes("x", "y"), pos)
+    ... )
+    """
+    global _disk
+    import pandas as pd
+
+    if nodes is None:
+        names = pd.Index(
+            pd.unique(pd.concat([edges[source], edges[target]])), name=name
+        ).sort_values()
+        res = pd.DataFrame({name: names})
+    else:
+        names = pd.Index(nodes[name])
+        res = nodes.reset_index(drop=True)
+    if not names.is_unique:
+        raise ValueError(f"The node names in {name!r} are not unique")
+    src = names.get_indexer(edges[source])
+    dst = names.get_indexer(edges[target])
+    if (src < 0).any() or (dst < 0).any():
+        raise ValueError("Some edges end at nodes that are not in nodes")
+    weights = edges[weight].to_numpy(dtype=float) if weight else None
+    if iterations is None:
+        iterations = ITERATIONS if init is None else WARM_ITERATIONS
+
+    h = hashlib.sha256()
+    h.update(data_fingerprint(names.to_series()).encode())
+    h.update(data_fingerprint(pd.DataFrame({"s": src, "d": dst})).encode())
+    if weights is not None:
+        h.update(weights.tobytes())
+    if init is not None:
+        h.update(data_fingerprint(init[[name, "x", "y"]]).encode())
+    h.update(repr((iterations, theta, gravity, seed)).encode())
+    key = h.hexdigest()
+
+    if key in _layouts:
+        _layouts.move_to_end(key)
+        pos = _layouts[key]
+    else:
+        if _disk is None:
+            _disk = DiskCache(LAYOUT_DIR)
+        stored = _disk.read(key, "npy")
+        if stored is not None:
+            pos = np.load(io.BytesIO(stored))
+        else:
+            start = None
+            if init is not None:
+                start = _start(names, src, dst, init, name, seed)
+            pos = force_layout(
+                src,
+                dst,
+                len(names),
+                weights,
+                iterations,
+                theta,
+                gravity,
+                start,
+                seed=seed,
+            )
+            buf = io.BytesIO()
+            np.save(buf, pos)
+            _disk.write(key, "npy", buf.getvalue())
+        _remember(key, pos)
+
+    res = res.copy()
+    res["x"] = pos[:, 0]
+    res["y"] = pos[:, 1]
+    return res
+
+
+def edge_segments(
+    edges: pd.DataFrame,
+    layout: pd.DataFrame,
+    source: str = "from",
+    target: str = "to",
+    name: str = "name",
+) -> pd.DataFrame:
+    """
+    Edges with the positions of their ends
+
+    Returns
+    -------
+    pandas.DataFrame
+        ``edges`` with ``x``, ``y``, ``xend`` and ``yend``.
+    """
+    xy = layout.drop_duplicates(name).set_index(name)[["x", "y"]]
+    start = xy.reindex(edges[source]).to_numpy()
+    end = xy.reindex(edges[target]).to_numpy()
+    res = edges.reset_index(drop=True).copy()
+    res["x"], res["y"] = start[:, 0], start[:, 1]
+    res["xend"], res["yend"] = end[:, 0], end[:, 1]
+    return res
+
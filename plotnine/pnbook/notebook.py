@@ -0,0 +1,370 @@
+"""
+Static view of a marimo notebook as a graph of cells
+
+marimo records everything it needs to schedule a notebook in the source
+itself: each ``@app.cell`` function takes the names it reads as
+parameters and returns the names it defines. This module parses that
+structure with :mod:`ast`, so the cells can be executed outside of the
+marimo runtime (and without importing marimo at all).
+"""
+
+from __future__ import annotations
+
+import ast
+import builtins
+import hashlib
+import textwrap
+from collections import defaultdict
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Iterable
+
+
+@dataclass
+class Cell:
+    """
+    One ``@app.cell`` function of a notebook
+    """
+
+    index: int
+    """Position of the cell in the file (0-based)"""
+
+    lineno: int
+    """Line of the ``def`` statement"""
+
+    refs: tuple[str, ...]
+    """Names read by the cell (the function parameters)"""
+
+    defs: tuple[str, ...]
+    """Names defined by the cell (the returned names)"""
+
+    source: str
+    """Body of the cell, dedented, without the trailing ``return``"""
+
+    hide_code: bool = False
+
+    _body: list[ast.stmt] = field(default_factory=list, repr=False)
+
+    @property
+    def name(self) -> str:
+        return f"cell-{self.index:03d}"
+
+    @property
+    def digest(self) -> str:
+        """
+        Hash of the cell's code and interface
+
+        Two cells with the same digest behave identically given the
+        same inputs.
+        """
+        h = hashlib.sha256()
+        h.update(repr((self.refs, self.defs)).encode())
+        h.update(self.source.encode())
+        return h.hexdigest()[:16]
+
+    @property
+    def is_markdown(self) -> bool:
+        """
+        Whether the cell does nothing but render ``mo.md(...)``
+        """
+        if len(self._body) != 1 or self.defs:
+            return False
+        stmt = self._body[0]
+        return (
+            isinstance(stmt, ast.Expr)
+            and isinstance(stmt.value, ast.Call)
+            and isinstance(stmt.value.func, ast.Attribute)
+            and stmt.value.func.attr == "md"
+        )
+
+    @property
+    def is_empty(self) -> bool:
+        return not self._body
+
+    def run(self, namespace: dict[str, Any]) -> tuple[dict[str, Any], Any]:
+        """
+        Execute the cell
+
+        Parameters
+        ----------
+        namespace :
+            Values for (at least) the names in :attr:`refs`.
+
+        Returns
+        -------
+        defs : dict
+            The values of the names defined by the cell.
+        output : object
+            Value of the last expression in the cell, which is what
+            marimo would display, or None.
+        """
+        scope: dict[str, Any] = {"__builtins__": builtins}
+        scope.update({name: namespace[name] for name in self.refs})
+        body = list(self._body)
+        last = None
+        if body and isinstance(body[-1], ast.Expr):
+            last = ast.Expression(body.pop().value)
+
+        filename = f"<{self.name}>"
+        module = ast.Module(body=body, type_ignores=[])
+        exec(compile(module, filename, "exec"), scope)
+        output = None
+        if last is not None:
+            output = eval(compile(last, filename, "eval"), scope)
+        return {name: scope[name] for name in self.defs}, output
+
+
+class Notebook:
+    """
+    The cells of a marimo notebook and the dependencies between them
+
+    Parameters
+    ----------
+    path :
+        Notebook file, e.g. ``getting-started.py``.
+    """
+
+    def __init__(self, path: str | Path):
+        self.path = Path(path)
+        self.text = self.path.read_text()
+        self.cells = _parse_cells(self.text)
+        self._definer = {
+            name: cell.index for cell in self.cells for name in cell.defs
+        }
+        self._lineage: dict[int, str] = {}
+
+    def __iter__(self):
+        return iter(self.cells)
+
+    def __len__(self) -> int:
+        return len(self.cells)
+
+    def parents(self, cell: Cell) -> list[Cell]:
+        """
+        Cells that define the names read by ``cell``
+        """
+        idx = sorted(
+            {self._definer[name] for name in cell.refs if name in self._definer}
+        )
+        return [self.cells[i] for i in idx]
+
+    def children(self, cell: Cell) -> list[Cell]:
+        """
+        Cells that read any of the names defined by ``cell``
+        """
+        defs = set(cell.defs)
+        return [c for c in self.cells if defs.intersection(c.refs)]
+
+    def ancestors(self, cell: Cell) -> list[Cell]:
+        """
+        All the cells that must run before ``cell``, in execution order
+        """
+        seen: set[int] = set()
+        stack = list(self.parents(cell))
+        while stack:
+            c = stack.pop()
+            if c.index not in seen:
+                seen.add(c.index)
+                stack.extend(self.parents(c))
+        return [c for c in self.order() if c.index in seen]
+
+    def descendants(self, cells: Iterable[Cell]) -> list[Cell]:
+        """
+        Cells reachable from ``cells`` (including them), in file order
+        """
+        seen: set[int] = set()
+        stack = list(cells)
+        while stack:
+            c = stack.pop()
+            if c.index not in seen:
+                seen.add(c.index)
+                stack.extend(self.children(c))
+        return [c for c in self.cells if c.index in seen]
+
+    def lineage(self, cell: Cell) -> str:
+        """
+        Hash of a cell's code and the code of all its ancestors
+
+        It changes when the cell or anything upstream of it is edited,
+        and survives cells being inserted or moved elsewhere in the file.
+        """
+        if cell.index not in self._lineage:
+            h = hashlib.sha256(cell.digest.encode())
+            for parent in self.parents(cell):
+                h.update(self.lineage(parent).encode())
+            self._lineage[cell.index] = h.hexdigest()[:16]
+        return self._lineage[cell.index]
+
+    def identity(self, cell: Cell) -> str:
+        """
+        Lineage of a cell, told apart from identical cells
+
+        Cells with the same code and ancestors have the same lineage;
+        the second of them gets ``<lineage>-1``, the third
+        ``<lineage>-2``, and so on, in file order.
+        """
+        lineage = self.lineage(cell)
+        n = sum(
+            self.lineage(c) == lineage for c in self.cells[: cell.index]
+        )
+        return f"{lineage}-{n}" if n else lineage
+
+    def order(self) -> list[Cell]:
+        """
+        Cells in a valid execution order
+
+        Ties are broken by position in the file, which is the order in
+        which marimo itself writes the cells.
+        """
+        indegree = {c.index: len(self.parents(c)) for c in self.cells}
+        ready = sorted(i for i, n in indegree.items() if n == 0)
+        result: list[Cell] = []
+        while ready:
+            i = ready.pop(0)
+            result.append(self.cells[i])
+            for child in self.children(self.cells[i]):
+                indegree[child.index] -= 1
+                if indegree[child.index] == 0:
+                    ready.append(child.index)
+                    ready.sort()
+        if len(result) != len(self.cells):
+            raise ValueError(f"{self.path} has cyclic cell dependencies.")
+        return result
+
+    def plot_cells(self) -> list[Cell]:
+        """
+        Cells that may produce a figure
+
+        That is every cell with code in it that reads something from
+        another cell, less the markdown cells. Cells without refs only
+        import modules or load data.
+        """
+        return [
+            c
+            for c in self.cells
+            if c.refs and not (c.is_markdown or c.is_empty)
+        ]
+
+
+class Runner:
+    """
+    Execute notebook cells on demand, running their ancestors first
+
+    Each ancestor runs at most once per runner, so rendering many cells
+    that share the same import/data cells only pays for those once.
+    """
+
+    def __init__(self, notebook: Notebook):
+        self.notebook = notebook
+        self.namespace: dict[str, Any] = {}
+        self._done: set[int] = set()
+
+    def run(self, cell: Cell, overrides: dict[str, Any] | None = None) -> Any:
+        """
+        Run ``cell`` (after its ancestors) and return its output
+
+        ``overrides`` replace names defined by the ancestors, for this
+        run of ``cell`` only; its definitions are then not kept.
+        """
+        self.prepare(cell)
+        if overrides:
+            _, output = cell.run({**self.namespace, **overrides})
+            return output
+        return self._run(cell)
+
+    def prepare(self, cell: Cell):
+        """
+        Run the ancestors of ``cell`` that have not run yet
+        """
+        for parent in self.notebook.ancestors(cell):
+            if parent.index not in self._done:
+                self._run(parent)
+
+    def _run(self, cell: Cell) -> Any:
+        defs, output = cell.run(self.namespace)
+        self.namespace.update(defs)
+        self._done.add(cell.index)
+        return output
+
+
+def _is_app_cell(decorator: ast.expr) -> tuple[bool, bool]:
+    """
+    Return whether a decorator is ``app.cell`` and if it hides the code
+    """
+    call = decorator if isinstance(decorator, ast.Call) else None
+    target = call.func if call else decorator
+    if not (
+        isinstance(target, ast.Attribute)
+        and target.attr == "cell"
+        and isinstance(target.value, ast.Name)
+        and target.value.id == "app"
+    ):
+        return False, False
+    hide = False
+    if call:
+        for kw in call.keywords:
+            if kw.arg == "hide_code" and isinstance(kw.value, ast.Constant):
+                hide = bool(kw.value.value)
+    return True, hide
+
+
+def _returned_names(stmt: ast.stmt) -> tuple[str, ...]:
+    if not isinstance(stmt, ast.Return) or stmt.value is None:
+        return ()
+    value = stmt.value
+    elts = value.elts if isinstance(value, ast.Tuple) else [value]
+    return tuple(e.id for e in elts if isinstance(e, ast.Name))
+
+
+def _parse_cells(text: str) -> list[Cell]:
+    tree = ast.parse(text)
+    lines = text.splitlines()
+    cells: list[Cell] = []
+    for node in tree.body:
+        if not isinstance(node, ast.FunctionDef):
+            continue
+        for dec in node.decorator_list:
+            is_cell, hide = _is_app_cell(dec)
+            if is_cell:
+                break
+        else:
+            continue
+
+        body = list(node.body)
+        defs: tuple[str, ...] = ()
+        if body and isinstance(body[-1], ast.Return):
+            defs = _returned_names(body.pop())
+
+        if body:
+            start, end = body[0].lineno, body[-1].end_lineno or body[0].lineno
+            source = _dedent(lines[start - 1 : end])
+        else:
+            source = ""
+
+        cells.append(
+            Cell(
+                index=len(cells),
+                lineno=node.lineno,
+                refs=tuple(a.arg for a in node.args.args),
+                defs=defs,
+                source=source,
+                hide_code=hide,
+                _body=body,
+            )
+        )
+    _check_unique_defs(cells)
+    return cells
+
+
+def _dedent(lines: list[str]) -> str:
+    return textwrap.dedent("\n".join(lines))
+
+
+def _check_unique_defs(cells: list[Cell]):
+    owners: dict[str, list[int]] = defaultdict(list)
+    for cell in cells:
+        for name in cell.defs:
+            owners[name].append(cell.index)
+    dups = {k: v for k, v in owners.items() if len(v) > 1}
+    if dups:
+        raise ValueError(f"Names defined by more than one cell: {dups}")
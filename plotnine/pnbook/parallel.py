@@ -0,0 +1,365 @@
+"""
+Stat computations spread over a pool of workers
+
+plotnine computes a stat panel by panel and, within a panel, group by
+group, in a loop. While :func:`install` is in effect, the groups of a
+layer (of all its panels, for stats that do not override
+``compute_panel``) are computed by a :class:`GroupPool` instead:
+
+- with threads, each task is a slice of the layer data;
+- with processes, the layer data is sorted by panel and group and its
+  columns are written once to a memory-mapped file in ``/dev/shm``.
+  A task is then just a range of rows, and workers map the columns
+  without copying them. Columns of Python objects are sent with the
+  task.
+
+The results are put together in the order plotnine would have produced
+them, with the columns that are constant within each group added as
+plotnine does, so a plot is the same with or without a pool. Layers with
+few rows or a single group are left to plotnine, since sending them
+costs more than computing them.
+"""
+
+from __future__ import annotations
+
+import os
+import tempfile
+from concurrent.futures import (
+    Executor,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+)
+from contextlib import contextmanager
+from itertools import repeat
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Iterator, Literal, Sequence
+
+import numpy as np
+
+from .warm import context as warm_context
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+# Rows below which a layer is computed in the calling process
+MIN_ROWS = 20_000
+
+# Columns are aligned to this many bytes in the shared file
+_ALIGN = 64
+
+# Where the shared file is written, if it exists
+_SHM = Path("/dev/shm")
+
+
+def _shared_columns(
+    data: pd.DataFrame,
+) -> tuple[str, list[tuple], dict[str, np.ndarray]]:
+    """
+    Write the numeric columns of a frame to a memory-mappable file
+
+    Returns
+    -------
+    tuple
+        The file, a description of each column (name, dtype, offset,
+        categories) and the columns that could not be written.
+    """
+    import pandas as pd
+
+    columns: list[tuple] = []
+    objects: dict[str, np.ndarray] = {}
+    arrays = []
+    offset = 0
+    for name in data.columns:
+        col = data[name]
+        categories = None
+        if isinstance(col.dtype, pd.CategoricalDtype):
+            categories = col.cat.categories, col.cat.ordered
+            values = col.cat.codes.to_numpy()
+        else:
+            values = col.to_numpy()
+        if values.dtype.kind not in "biuf":
+            objects[name] = values
+            continue
+        columns.append((name, values.dtype.str, offset, categories))
+        arrays.append((offset, values))
+        offset += -(-values.nbytes // _ALIGN) * _ALIGN
+
+    directory = _SHM if _SHM.is_dir() else None
+    fd, path = tempfile.mkstemp(prefix="pnbook-", dir=directory)
+    with os.fdopen(fd, "wb") as f:
+        f.truncate(max(offset, 1))
+    if offset:
+        mm = np.memmap(path, dtype=np.uint8, mode="r+", shape=(offset,))
+        for start, values in arrays:
+            mm[start : start + values.nbytes] = values.view(np.uint8)
+        mm.flush()
+        del mm
+    return path, columns, objects
+
+
+def _mapped_frame(
+    path: str,
+    nrows: int,
+    columns: list[tuple],
+    objects: dict[str, np.ndarray],
+    names: Sequence[str],
+    start: int,
+    stop: int,
+) -> pd.DataFrame:
+    """
+    Rows ``start:stop`` of a frame written by :func:`_shared_columns`
+    """
+    import pandas as pd
+
+    data: dict[str, Any] = dict(objects)
+    for name, dtype, offset, categories in columns:
+        # Copy on write, a stat may modify its data in place
+        values = np.memmap(
+            path, dtype=dtype, mode="c", offset=offset, shape=(nrows,)
+        )[start:stop]
+        if categories is not None:
+            values = pd.Categorical.from_codes(
+                values, categories[0], ordered=categories[1]
+            )
+        data[name] = values
+    return pd.DataFrame({name: data[name] for name in names}, copy=False)
+
+
+def _compute_group(
+    stat,
+    path: str,
+    nrows: int,
+    columns: list[tuple],
+    names: Sequence[str],
+    objects: dict[str, np.ndarray],
+    start: int,
+    stop: int,
+    scales,
+) -> pd.DataFrame:
+    """
+    Compute one group in a worker process
+    """
+    data = _mapped_frame(path, nrows, columns, objects, names, start, stop)
+    return stat.compute_group(data, scales)
+
+
+def _thread_group(stat, data: pd.DataFrame, scales) -> pd.DataFrame:
+    return stat.compute_group(data.copy(), scales)
+
+
+class GroupPool:
+    """
+    Workers that compute the groups of a stat
+
+    Parameters
+    ----------
+    workers :
+        Number of workers. Default is the number of CPUs.
+    kind :
+        ``"process"`` for stats that hold the GIL (most do), or
+        ``"thread"``, which avoids sending the data and results.
+    min_rows :
+        Layers with fewer rows are computed in the calling process.
+    """
+
+    def __init__(
+        self,
+        workers: int | None = None,
+        kind: Literal["process", "thread"] = "process",
+        min_rows: int = MIN_ROWS,
+    ):
+        if kind not in ("process", "thread"):
+            raise ValueError(f"Unknown kind of pool {kind!r}")
+        self.workers = workers or os.cpu_count() or 1
+        self.kind = kind
+        self.min_rows = min_rows
+        self._executor: Executor | None = None
+
+    def __enter__(self) -> GroupPool:
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    @property
+    def executor(self) -> Executor:
+        if self._executor is None:
+            if self.kind == "thread":
+                self._executor = ThreadPoolExecutor(self.workers)
+            else:
+                self._executor = ProcessPoolExecutor(
+                    self.workers, mp_context=warm_context()
+                )
+        return self._executor
+
+    def worthwhile(self, data: pd.DataFrame, ngroups: int) -> bool:
+        return (
+            self.workers > 1 and ngroups > 1 and len(data) >= self.min_rows
+        )
+
+    def map(
+        self,
+        stat,
+        data: pd.DataFrame,
+        bounds: Sequence[tuple[int, int]],
+        scales: Sequence[Any],
+    ) -> list[pd.DataFrame]:
+        """
+        ``stat.compute_group`` of row ranges of ``data``, in order
+        """
+        if self.kind == "thread":
+            groups = [data.iloc[start:stop] for start, stop in bounds]
+            return list(
+                self.executor.map(_thread_group, repeat(stat), groups, scales)
+            )
+
+        path, columns, objects = _shared_columns(data)
+        try:
+            names = list(data.columns)
+            starts = [start for start, _ in bounds]
+            stops = [stop for _, stop in bounds]
+            group_objects = [
+                {name: values[start:stop] for name, values in objects.items()}
+                for start, stop in bounds
+            ]
+            return list(
+                self.executor.map(
+                    _compute_group,
+                    repeat(stat),
+                    repeat(path),
+                    repeat(len(data)),
+                    repeat(columns),
+                    repeat(names),
+                    group_objects,
+                    starts,
+                    stops,
+                    scales,
+                )
+            )
+        finally:
+            os.unlink(path)
+
+
+def _sorted_groups(
+    data: pd.DataFrame, by: Sequence[str]
+) -> tuple[pd.DataFrame, list[tuple], list[tuple[int, int]]]:
+    """
+    Sort rows by ``by`` (stable) and find the row range of each group
+
+    The groups come in the order of ``data.groupby(by)``.
+    """
+    import pandas as pd
+
+    codes = []
+    for name in by:
+        c, _ = pd.factorize(data[name], sort=True)
+        codes.append(c)
+    order = np.lexsort(codes[::-1])
+    data = data.iloc[order].reset_index(drop=True)
+    keys = np.column_stack([c[order] for c in codes])
+    change = np.flatnonzero((np.diff(keys, axis=0) != 0).any(axis=1)) + 1
+    starts = np.concatenate([[0], change])
+    stops = np.concatenate([change, [len(data)]])
+    first = data.iloc[starts][list(by)]
+    return (
+        data,
+        list(first.itertuples(index=False, name=None)),
+        list(zip(starts.tolist(), stops.tolist())),
+    )
+
+
+def _assemble(
+    data: pd.DataFrame,
+    bounds: Sequence[tuple[int, int]],
+    results: Sequence[pd.DataFrame],
+) -> pd.DataFrame:
+    """
+    Concatenate group results the way plotnine's compute_panel does
+    """
+    import pandas as pd
+    from plotnine._utils import uniquecols
+
+    stats = []
+    for (start, stop), new in zip(bounds, results):
+        old = data.iloc[start:stop]
+        new = new.reset_index(drop=True)
+        unique = uniquecols(old)
+        missing = unique.columns.difference(new.columns)
+        u = unique.loc[[0] * len(new), missing].reset_index(drop=True)
+        if u.empty and len(u):
+            u = type(data)()
+        stats.append(pd.concat([new, u], axis=1))
+    return pd.concat(stats, axis=0, ignore_index=True)
+
+
+def _overrides_compute_panel(stat) -> bool:
+    from plotnine.stats.stat import stat as base
+
+    return any(
+        "compute_panel" in vars(cls)
+        for cls in type(stat).__mro__
+        if issubclass(cls, base) and cls is not base
+    )
+
+
+@contextmanager
+def install(pool: GroupPool) -> Iterator[GroupPool]:
+    """
+    Compute the groups of every stat with ``pool``
+
+    Stats that do not override ``compute_panel`` have the groups of all
+    their panels computed together. The others have the groups of each
+    panel computed together, when their ``compute_panel`` calls
+    plotnine's.
+    """
+    from plotnine._utils import check_required_aesthetics, remove_missing
+    from plotnine.stats.stat import stat
+
+    compute_layer = stat.compute_layer
+    compute_panel = stat.compute_panel
+
+    def parallel_compute_layer(self, data, layout):
+        if _overrides_compute_panel(self) or len(data) < pool.min_rows:
+            return compute_layer(self, data, layout)
+        check_required_aesthetics(
+            self.REQUIRED_AES,
+            list(data.columns) + list(self.params.keys()),
+            self.__class__.__name__,
+        )
+        data = remove_missing(
+            data,
+            na_rm=self.params.get("na_rm", False),
+            vars=list(self.REQUIRED_AES | self.NON_MISSING_AES),
+            name=self.__class__.__name__,
+            finite=True,
+        )
+        if data.empty:
+            return data.copy()
+        data, keys, bounds = _sorted_groups(data, ["PANEL", "group"])
+        if not pool.worthwhile(data, len(bounds)):
+            return compute_layer(self, data, layout)
+        scales = [layout.get_scales(panel) for panel, _ in keys]
+        results = pool.map(self, data, bounds, scales)
+        return _assemble(data, bounds, results)
+
+    def parallel_compute_panel(self, data, scales):
+        if not len(data) or len(data) < pool.min_rows:
+            return compute_panel(self, data, scales)
+        data, _, bounds = _sorted_groups(data, ["group"])
+        if not pool.worthwhile(data, len(bounds)):
+            return compute_panel(self, data, scales)
+        results = pool.map(self, data, bounds, [scales] * len(bounds))
+        return _assemble(data, bounds, results)
+
+    stat.compute_layer = parallel_compute_layer  # type: ignore[method-assign]
+    stat.compute_panel = parallel_compute_panel  # type: ignore[method-assign]
+    try:
+        yield pool
+    finally:
+        stat.compute_layer = compute_layer  # type: ignore[method-assign]
+        stat.compute_panel = compute_panel  # type: ignore[method-assign]
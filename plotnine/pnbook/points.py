@@ -0,0 +1,279 @@
+"""
+Point layers drawn as one image
+
+Drawing a marker per row makes scatterplots of large data slow to
+draw, and vector output grows with every row. :class:`geom_point_raster`
+instead counts the points falling in each pixel of the panel and draws
+the counts as a single image:
+
+- the opacity of a pixel is that of ``count`` markers stacked on top of
+  each other, ``1 - (1 - alpha)**count``, so dense regions look the way
+  overplotted markers do;
+- the colour of a pixel is the mean colour of its points.
+
+Everything is done with ``numpy.bincount`` over flat pixel indices, and
+the cost of drawing (and the size of an SVG/PDF) does not depend on the
+number of rows. Layers with fewer than ``raster_threshold`` rows are
+drawn as ordinary markers.
+
+plotnine draws the layers before its layout engine has made room for
+the axis labels, titles and legends, so the image is only computed when
+the figure is rendered, at the size the panel ended up with.
+"""
+
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, Callable, Optional
+
+import numpy as np
+from matplotlib.image import AxesImage
+from plotnine import geom_point, position_jitter
+
+if TYPE_CHECKING:
+    import pandas as pd
+    from matplotlib.axes import Axes
+    from matplotlib.backend_bases import RendererBase
+
+# Image of a panel, and its extent, for a shape and resolution
+ImageMaker = Callable[
+    [tuple[int, int], float], Optional[tuple[np.ndarray, tuple]]
+]
+
+
+def _box_sum(a: np.ndarray, r: int) -> np.ndarray:
+    """
+    Sum of ``a`` over a (2r+1) x (2r+1) window, along the first 2 axes
+    """
+    if r <= 0:
+        return a
+    for axis in (0, 1):
+        pad = [(0, 0)] * a.ndim
+        pad[axis] = (r + 1, r)
+        c = np.cumsum(np.pad(a, pad), axis=axis)
+        n = a.shape[axis]
+        hi = np.take(c, np.arange(2 * r + 1, 2 * r + 1 + n), axis=axis)
+        lo = np.take(c, np.arange(n), axis=axis)
+        a = hi - lo
+    return a
+
+
+def aggregate(
+    x: np.ndarray,
+    y: np.ndarray,
+    rgba: np.ndarray,
+    xrange: tuple[float, float],
+    yrange: tuple[float, float],
+    shape: tuple[int, int],
+    spread: int = 0,
+) -> np.ndarray:
+    """
+    Composite points into an RGBA image
+
+    Parameters
+    ----------
+    x, y :
+        Point positions.
+    rgba :
+        Colour of each point, shape ``(n, 4)``.
+    xrange, yrange :
+        Extent of the image.
+    shape :
+        ``(rows, columns)`` of the image.
+    spread :
+        Radius in pixels over which each point is spread.
+
+    Returns
+    -------
+    numpy.ndarray
+        Image of shape ``(rows, columns, 4)`` with the first row at
+        the bottom.
+    """
+    nrow, ncol = shape
+    (x0, x1), (y0, y1) = xrange, yrange
+    col = np.floor((x - x0) * (ncol / ((x1 - x0) or 1))).astype(np.intp)
+    row = np.floor((y - y0) * (nrow / ((y1 - y0) or 1))).astype(np.intp)
+    inside = (col >= 0) & (col < ncol) & (row >= 0) & (row < nrow)
+    flat = row[inside] * ncol + col[inside]
+    rgba = rgba[inside]
+    size = nrow * ncol
+
+    # Per pixel: number of points, sum of colours, and sum of
+    # log(1 - alpha) which turns into the opacity of the stack.
+    alpha = np.clip(rgba[:, 3], 0, 1 - 1e-6)
+    sums = np.empty((nrow, ncol, 5))
+    sums[..., 0] = np.bincount(flat, minlength=size).reshape(shape)
+    for i in range(3):
+        w = np.bincount(flat, rgba[:, i], minlength=size)
+        sums[..., i + 1] = w.reshape(shape)
+    transmit = np.bincount(flat, np.log1p(-alpha), minlength=size)
+    sums[..., 4] = transmit.reshape(shape)
+    sums = _box_sum(sums, spread)
+
+    count = sums[..., 0]
+    img = np.zeros((nrow, ncol, 4))
+    filled = count > 0
+    img[filled, :3] = sums[filled, 1:4] / count[filled, None]
+    img[..., 3] = -np.expm1(sums[..., 4])
+    return img
+
+
+def _largest_shape(ax: Axes, dpi: float | None) -> tuple[int, int]:
+    """
+    ``(rows, columns)`` of pixels a panel has at most
+
+    Layers are drawn before plotnine's layout engine places the panels,
+    and until then an Axes fills its cell of the figure's grid. The
+    layout only takes room away from it, for axis text, titles, legends
+    and fixed aspect ratios, so the panel ends up with at most as many
+    pixels.
+    """
+    fig = ax.figure
+    dpi = dpi or fig.dpi
+    box = ax.get_position()
+    width, height = fig.get_size_inches()
+    return (
+        max(int(height * box.height * dpi), 1),
+        max(int(width * box.width * dpi), 1),
+    )
+
+
+class _PanelImage(AxesImage):
+    """
+    Image made when it is drawn, with a pixel per pixel of the panel
+
+    Parameters
+    ----------
+    ax :
+        Panel.
+    make :
+        Called with the ``(rows, columns)`` of the panel and the
+        resolution, returns the image and its extent, or None if there
+        is nothing to draw. It is called again if the panel is drawn at
+        another size.
+    dpi :
+        Resolution of the image. Default is that of the figure.
+    extent :
+        Extent of the image until it is made.
+    """
+
+    def __init__(
+        self,
+        ax: Axes,
+        make: ImageMaker,
+        dpi: float | None = None,
+        extent: tuple | None = None,
+        **kwargs,
+    ):
+        super().__init__(ax, extent=extent, **kwargs)
+        self._make = make
+        self._dpi = dpi
+        self._shape: tuple[int, int] | None = None
+        self._empty = False
+
+    def draw(self, renderer: RendererBase):
+        fig = self.axes.figure
+        dpi = self._dpi or fig.dpi
+        box = self.axes.get_window_extent(renderer)
+        scale = dpi / fig.dpi
+        shape = (
+            max(int(box.height * scale), 1),
+            max(int(box.width * scale), 1),
+        )
+        if shape != self._shape:
+            self._shape = shape
+            made = self._make(shape, dpi)
+            self._empty = made is None
+            if made is not None:
+                img, extent = made
+                self.set_data(img)
+                # Not set_extent, which would also update the limits
+                self._extent = extent
+        if not self._empty:
+            super().draw(renderer)
+
+
+class geom_point_raster(geom_point):
+    """
+    Scatterplot drawn as a single image
+
+    Accepts the same aesthetics and parameters as ``geom_point``.
+
+    Parameters
+    ----------
+    raster_threshold : int, default=10000
+        Layers with fewer rows are drawn as markers.
+    dpi : float, default=None
+        Resolution of the image. Default is that of the figure.
+    spread : int, default=None
+        Radius in pixels of each point. Default is derived from the
+        ``size`` aesthetic.
+    """
+
+    DEFAULT_PARAMS = {
+        **geom_point.DEFAULT_PARAMS,
+        "raster_threshold": 10_000,
+        "dpi": None,
+        "spread": None,
+    }
+
+    def draw_panel(self, data: pd.DataFrame, panel_params, coord, ax: Axes):
+        params = self.params
+        if len(data) < params["raster_threshold"]:
+            return super().draw_panel(data, panel_params, coord, ax)
+
+        import pandas as pd
+        from matplotlib.colors import to_rgba_array
+        from plotnine._utils import to_rgba
+
+        data = coord.transform(data, panel_params)
+        codes, colours = pd.factorize(data["color"])
+        colours = list(colours)
+        rgba = to_rgba_array(colours)[codes]
+        # As in plotnine, colours with an alpha of their own keep it, and
+        # so do all colours where the alpha is missing
+        own = (
+            to_rgba_array(to_rgba(colours, 0.0))[:, 3]
+            == to_rgba_array(to_rgba(colours, 1.0))[:, 3]
+        )
+        alpha = data["alpha"].to_numpy(dtype=float)
+        given = ~own[codes] & ~np.isnan(alpha)
+        rgba[given, 3] = alpha[given]
+        x = data["x"].to_numpy(dtype=float)
+        y = data["y"].to_numpy(dtype=float)
+        size = float(np.nanmedian(data["size"]))
+        xrange, yrange = panel_params.x.range, panel_params.y.range
+
+        def make(shape: tuple[int, int], dpi: float):
+            spread = params["spread"]
+            if spread is None:
+                # size is a diameter in mm; radius in pixels
+                spread = int(round(size / 2 / 25.4 * dpi))
+            img = aggregate(x, y, rgba, xrange, yrange, shape, spread)
+            return img, (*xrange, *yrange)
+
+        image = _PanelImage(
+            ax,
+            make,
+            params["dpi"],
+            extent=(*xrange, *yrange),
+            origin="lower",
+            interpolation="nearest",
+            zorder=params["zorder"],
+        )
+        image.set_clip_path(ax.patch)
+        ax.add_image(image)
+
+
+def geom_jitter_raster(
+    mapping=None,
+    data=None,
+    width=None,
+    height=None,
+    random_state=None,
+    **kwargs,
+) -> geom_point_raster:
+    """
+    geom_jitter drawn as a single image
+    """
+    kwargs["position"] = position_jitter(width, height, random_state)
+    return geom_point_raster(mapping, data, **kwargs)
@@ -0,0 +1,672 @@
+"""
+GeoTIFF rasters read at the resolution they are drawn at
+
+To draw a raster with plotnine's ``geom_raster`` (or ``geom_tile``), it
+has to be a DataFrame with a row per pixel, all of which are coloured
+and composited even when the figure shows a fraction of them at a
+fraction of their resolution. :class:`Raster` instead memory-maps the
+file and reads it tile by tile:
+
+- the overviews in the file (the reduced-resolution images GDAL writes
+  after the full one) make a pyramid, and coarser levels are made by
+  averaging 2x2 blocks of pixels, as long as the longer side of the
+  new level is at least ``MIN_OVERVIEW`` pixels.
+  Those are saved as ``.npy`` files in the cache directory and
+  memory-mapped on later runs;
+- :meth:`Raster.read` picks the coarsest level with at least as many
+  pixels as the output, and decodes only the tiles that intersect the
+  requested limits. Decoded tiles are kept for the next figure.
+
+:class:`geom_stars` draws a raster this way, from the ranges of the
+panel (so the limits of ``coord_cartesian``/``coord_fixed``) and the
+size of the panel in pixels, once the figure is laid out. A band is coloured by the ``fill`` scale,
+evaluated at 256 levels of the band, and ``band=None`` draws the bands
+as an RGB image.
+
+Tiles or strips may be uncompressed, Deflate (with or without horizontal
+differencing) or JPEG compressed; JPEG is decoded with Pillow.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import os
+import struct
+import tempfile
+import zlib
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+from typing import TYPE_CHECKING, Any
+
+import numpy as np
+from plotnine import aes
+from plotnine.coords import coord_cartesian, coord_flip
+from plotnine.exceptions import PlotnineError
+from plotnine.geoms.geom import geom
+from plotnine.geoms.geom_polygon import geom_polygon
+
+from .cache import DEFAULT_CACHE_DIR
+from .points import _PanelImage
+
+if TYPE_CHECKING:
+    import pandas as pd
+    from matplotlib.axes import Axes
+
+# Where the overviews made from the file are kept
+OVERVIEW_DIR = DEFAULT_CACHE_DIR / "rasters"
+
+# Smallest longer side of a level made by averaging; no level is made
+# that would be smaller
+MIN_OVERVIEW = 256
+
+# Number of decoded tiles kept, for all files
+MAX_TILES = 512
+
+# TIFF field types: struct code and size
+_TYPES = {
+    1: ("B", 1),
+    2: ("s", 1),
+    3: ("H", 2),
+    4: ("I", 4),
+    5: ("I", 4),
+    6: ("b", 1),
+    7: ("B", 1),
+    8: ("h", 2),
+    9: ("i", 4),
+    10: ("i", 4),
+    11: ("f", 4),
+    12: ("d", 8),
+    13: ("I", 4),
+    16: ("Q", 8),
+    17: ("q", 8),
+    18: ("Q", 8),
+}
+
+# SampleFormat tag to numpy kind
+_KINDS = {1: "u", 2: "i", 3: "f"}
+
+# Memory-mapped files, by path and (size, mtime)
+_files: dict[tuple[str, tuple[int, int]], np.memmap] = {}
+
+# Decoded tiles, by file, level and tile
+_tiles: OrderedDict[tuple, np.ndarray] = OrderedDict()
+
+
+def _mapped(path: str, version: tuple[int, int]) -> np.memmap:
+    key = (path, version)
+    if key not in _files:
+        _files[key] = np.memmap(path, dtype=np.uint8, mode="r")
+    return _files[key]
+
+
+def _read_ifds(buf: np.ndarray) -> list[dict[int, Any]]:
+    """
+    The tags of every image of a (Big)TIFF file
+    """
+    order = {b"II": "<", b"MM": ">"}.get(bytes(buf[:2]))
+    if order is None:
+        raise ValueError("Not a TIFF file")
+    (magic,) = struct.unpack(order + "H", buf[2:4])
+    if magic == 42:
+        count_fmt, entry_size, offset_fmt = "H", 12, "I"
+        (offset,) = struct.unpack(order + "I", buf[4:8])
+    elif magic == 43:
+        count_fmt, entry_size, offset_fmt = "Q", 20, "Q"
+        (offset,) = struct.unpack(order + "Q", buf[8:16])
+    else:
+        raise ValueError("Not a TIFF file")
+    count_size = struct.calcsize(count_fmt)
+    offset_size = struct.calcsize(offset_fmt)
+
+    ifds = []
+    while offset:
+        (n,) = struct.unpack(
+            order + count_fmt, buf[offset : offset + count_size]
+        )
+        tags: dict[int, Any] = {}
+        for k in range(n):
+            start = offset + count_size + k * entry_size
+            entry = bytes(buf[start : start + entry_size])
+            tag, typ = struct.unpack(order + "HH", entry[:4])
+            (count,) = struct.unpack(
+                order + offset_fmt, entry[4 : 4 + offset_size]
+            )
+            if typ not in _TYPES:
+                continue
+            code, size = _TYPES[typ]
+            nbytes = count * size * (2 if typ in (5, 10) else 1)
+            value = entry[4 + offset_size :]
+            if nbytes > offset_size:
+                (at,) = struct.unpack(order + offset_fmt, value)
+                value = bytes(buf[at : at + nbytes])
+            value = value[:nbytes]
+            if typ == 2:
+                tags[tag] = value.rstrip(b"\0").decode("latin-1")
+            elif typ == 7:
+                tags[tag] = value
+            else:
+                values = np.frombuffer(value, dtype=order + code)
+                if typ in (5, 10):
+                    values = values[::2] / values[1::2]
+                tags[tag] = values
+        ifds.append(tags)
+        end = offset + count_size + n * entry_size
+        (offset,) = struct.unpack(
+            order + offset_fmt, buf[end : end + offset_size]
+        )
+    return ifds
+
+
+def _first(tags: dict[int, Any], tag: int, default: Any = None) -> Any:
+    value = tags.get(tag)
+    return default if value is None else value[0].item()
+
+
+@dataclass
+class _TiffLevel:
+    """
+    One image of a TIFF file, read tile by tile
+    """
+
+    height: int
+    width: int
+    samples: int
+    dtype: str
+    tile_height: int
+    tile_width: int
+    offsets: np.ndarray
+    counts: np.ndarray
+    compression: int
+    predictor: int
+    planar: int
+    jpeg_tables: bytes | None
+
+    @classmethod
+    def from_tags(cls, tags: dict[int, Any], order: str) -> _TiffLevel:
+        height, width = _first(tags, 257), _first(tags, 256)
+        bits = _first(tags, 258, 1)
+        kind = _KINDS.get(_first(tags, 339, 1))
+        if kind is None or bits % 8:
+            raise ValueError(f"Unsupported TIFF sample format ({bits} bits)")
+        if 322 in tags:
+            tile_height, tile_width = _first(tags, 323), _first(tags, 322)
+            offsets, counts = tags[324], tags[325]
+        else:
+            # Strips are tiles as wide as the image
+            tile_height = min(_first(tags, 278, height), height)
+            tile_width = width
+            offsets, counts = tags[273], tags[279]
+        return cls(
+            height=height,
+            width=width,
+            samples=_first(tags, 277, 1),
+            dtype=f"{order}{kind}{bits // 8}",
+            tile_height=tile_height,
+            tile_width=tile_width,
+            offsets=np.asarray(offsets, dtype=np.int64),
+            counts=np.asarray(counts, dtype=np.int64),
+            compression=_first(tags, 259, 1),
+            predictor=_first(tags, 317, 1),
+            planar=_first(tags, 284, 1),
+            jpeg_tables=tags.get(347),
+        )
+
+    def decode(self, buf: np.ndarray, index: int) -> np.ndarray:
+        """
+        Tile ``index`` as a ``(tile_height, tile_width, samples)`` array
+
+        With separate planes, the tile of one sample, with 1 sample.
+        """
+        start, count = self.offsets[index], self.counts[index]
+        raw = buf[start : start + count]
+        samples = self.samples if self.planar == 1 else 1
+        shape = (self.tile_height, self.tile_width, samples)
+        if self.compression == 7:
+            return self._decode_jpeg(raw, shape)
+        if self.compression == 1:
+            data = raw
+        elif self.compression in (8, 32946):
+            data = np.frombuffer(zlib.decompress(raw), np.uint8)
+        else:
+            raise ValueError(
+                f"Unsupported TIFF compression {self.compression}"
+            )
+        # The last strip may be short
+        tile = np.zeros(int(np.prod(shape)), self.dtype)
+        values = np.frombuffer(data, self.dtype)[: len(tile)]
+        tile[: len(values)] = values
+        tile = tile.reshape(shape)
+        if self.predictor == 2:
+            tile = np.cumsum(tile, axis=1, dtype=tile.dtype)
+        elif self.predictor != 1:
+            # e.g. 3, the floating point predictor GDAL writes
+            raise ValueError(f"Unsupported TIFF predictor {self.predictor}")
+        return tile
+
+    def _decode_jpeg(self, raw: np.ndarray, shape: tuple) -> np.ndarray:
+        from io import BytesIO
+
+        from PIL import Image
+
+        data = bytes(raw)
+        if self.jpeg_tables is not None:
+            # Tables without their end marker, tile without its start
+            data = self.jpeg_tables[:-2] + data[2:]
+        with Image.open(BytesIO(data)) as im:
+            tile = np.asarray(im)
+        return tile.reshape(tile.shape[0], tile.shape[1], -1)[
+            : shape[0], : shape[1]
+        ]
+
+    def read(
+        self, key: tuple, buf: np.ndarray, rows: slice, cols: slice
+    ) -> np.ndarray:
+        """
+        Pixels ``rows``, ``cols`` decoded from the tiles that hold them
+        """
+        th, tw = self.tile_height, self.tile_width
+        across = -(-self.width // tw)
+        down = -(-self.height // th)
+        out = np.empty(
+            (rows.stop - rows.start, cols.stop - cols.start, self.samples),
+            dtype=self.dtype,
+        )
+        planes = range(self.samples) if self.planar == 2 else [None]
+        for tr in range(rows.start // th, -(-rows.stop // th)):
+            r0, r1 = max(rows.start, tr * th), min(rows.stop, (tr + 1) * th)
+            for tc in range(cols.start // tw, -(-cols.stop // tw)):
+                c0 = max(cols.start, tc * tw)
+                c1 = min(cols.stop, (tc + 1) * tw)
+                for plane in planes:
+                    index = tr * across + tc
+                    if plane is not None:
+                        index += plane * across * down
+                    tile = _tile(key + (index,), self, buf)
+                    part = tile[
+                        r0 - tr * th : r1 - tr * th,
+                        c0 - tc * tw : c1 - tc * tw,
+                    ]
+                    target = (
+                        slice(r0 - rows.start, r1 - rows.start),
+                        slice(c0 - cols.start, c1 - cols.start),
+                    )
+                    if plane is None:
+                        out[target] = part
+                    else:
+                        out[target + (plane,)] = part[..., 0]
+        return out
+
+
+def _tile(key: tuple, level: _TiffLevel, buf: np.ndarray) -> np.ndarray:
+    if key in _tiles:
+        _tiles.move_to_end(key)
+        return _tiles[key]
+    tile = level.decode(buf, key[-1])
+    tile.flags.writeable = False
+    _tiles[key] = tile
+    if len(_tiles) > MAX_TILES:
+        _tiles.popitem(last=False)
+    return tile
+
+
+@dataclass
+class _ArrayLevel:
+    """
+    An overview made from the file, in a ``.npy`` file
+    """
+
+    height: int
+    width: int
+    path: str
+
+    def read(
+        self, key: tuple, buf: np.ndarray, rows: slice, cols: slice
+    ) -> np.ndarray:
+        return np.load(self.path, mmap_mode="r")[rows, cols]
+
+
+def _downsample(img: np.ndarray, nodata: float | None) -> np.ndarray:
+    """
+    Average 2x2 blocks of pixels, ignoring ``nodata``
+    """
+    h, w = img.shape[:2]
+    pad = ((0, h % 2), (0, w % 2), (0, 0))
+    values = np.pad(img.astype(float), pad, mode="edge")
+    values = values.reshape(-(-h // 2), 2, -(-w // 2), 2, img.shape[2])
+    if nodata is None:
+        res = values.mean(axis=(1, 3))
+    else:
+        valid = values != nodata
+        n = valid.sum(axis=(1, 3))
+        total = np.where(valid, values, 0).sum(axis=(1, 3))
+        res = np.where(n > 0, total / np.maximum(n, 1), nodata)
+    if img.dtype.kind in "iu":
+        res = np.round(res)
+    return res.astype(img.dtype)
+
+
+class Raster:
+    """
+    A GeoTIFF file, read at the resolution it is drawn at
+
+    Parameters
+    ----------
+    path :
+        GeoTIFF file.
+    overview_dir :
+        Where overviews made from the file are kept.
+    """
+
+    def __init__(
+        self, path: str | Path, overview_dir: str | Path = OVERVIEW_DIR
+    ):
+        self.path = str(Path(path).resolve())
+        stat = os.stat(self.path)
+        self.version = (stat.st_size, stat.st_mtime_ns)
+        buf = self._buffer()
+        order = "<" if bytes(buf[:2]) == b"II" else ">"
+        ifds = _read_ifds(buf)
+        main = ifds[0]
+        self.samples = _first(main, 277, 1)
+        self.nodata = float(main[42113]) if 42113 in main else None
+        self.transform = _geo_transform(main)
+
+        levels: list[_TiffLevel | _ArrayLevel] = [
+            _TiffLevel.from_tags(tags, order)
+            for tags in ifds
+            # The full image and its reduced versions, not masks
+            if tags is main
+            or (
+                _first(tags, 254, 0) & 5 == 1
+                and _first(tags, 277, 1) == self.samples
+            )
+        ]
+        levels.sort(key=lambda level: -level.width)
+        self.levels = levels
+        self._add_overviews(Path(overview_dir))
+
+    def _buffer(self) -> np.memmap:
+        return _mapped(self.path, self.version)
+
+    def _add_overviews(self, directory: Path):
+        level = self.levels[-1]
+        h = hashlib.sha256(repr((self.path, self.version)).encode())
+        name = f"{Path(self.path).stem}-{h.hexdigest()[:16]}"
+        while True:
+            height, width = -(-level.height // 2), -(-level.width // 2)
+            if max(height, width) < MIN_OVERVIEW:
+                break
+            path = directory / f"{name}-{width}x{height}.npy"
+            if not path.exists():
+                img = self._read_level(
+                    len(self.levels) - 1,
+                    slice(0, level.height),
+                    slice(0, level.width),
+                )
+                directory.mkdir(parents=True, exist_ok=True)
+                fd, tmp = tempfile.mkstemp(dir=directory, suffix=".tmp")
+                try:
+                    with os.fdopen(fd, "wb") as f:
+                        np.save(f, _downsample(img, self.nodata))
+                    os.replace(tmp, path)
+                except BaseException:
+                    Path(tmp).unlink(missing_ok=True)
+                    raise
+            level = _ArrayLevel(height, width, str(path))
+            self.levels.append(level)
+
+    def _read_level(self, k: int, rows: slice, cols: slice) -> np.ndarray:
+        key = (self.path, self.version, k)
+        return self.levels[k].read(key, self._buffer(), rows, cols)
+
+    @property
+    def shape(self) -> tuple[int, int, int]:
+        """
+        Rows, columns and bands of the full image
+        """
+        level = self.levels[0]
+        return level.height, level.width, self.samples
+
+    @property
+    def extent(self) -> tuple[float, float, float, float]:
+        """
+        xmin, xmax, ymin, ymax of the full image
+        """
+        x0, dx, y0, dy = self.transform
+        h, w, _ = self.shape
+        xs, ys = (x0, x0 + w * dx), (y0, y0 + h * dy)
+        return min(xs), max(xs), min(ys), max(ys)
+
+    def read(
+        self,
+        xlim: tuple[float, float] | None = None,
+        ylim: tuple[float, float] | None = None,
+        shape: tuple[int, int] | None = None,
+        band: int | None = None,
+    ) -> tuple[np.ndarray, tuple[float, float, float, float]] | None:
+        """
+        The pixels within some limits, at the resolution of an output
+
+        Parameters
+        ----------
+        xlim, ylim :
+            Limits in the coordinates of the raster. Default is the
+            extent of the raster.
+        shape :
+            ``(rows, columns)`` of the output that ``xlim`` and ``ylim``
+            fill. The pixels come from the coarsest level with at least
+            that resolution. Default is the full resolution.
+        band :
+            Band to read. Default is all of them.
+
+        Returns
+        -------
+        tuple | None
+            The pixels, with the first row at the top, and their extent
+            (xmin, xmax, ymin, ymax). None if nothing is within the
+            limits.
+        """
+        xmin, xmax, ymin, ymax = self.extent
+        xlim = xlim or (xmin, xmax)
+        ylim = ylim or (ymin, ymax)
+        x0, dx, y0, dy = self.transform
+        height, width, _ = self.shape
+
+        k = 0
+        if shape is not None:
+            # Full resolution pixels per output pixel
+            per_pixel = min(
+                abs(xlim[1] - xlim[0]) / abs(dx) / max(shape[1], 1),
+                abs(ylim[1] - ylim[0]) / abs(dy) / max(shape[0], 1),
+            )
+            for i, level in enumerate(self.levels):
+                if width / level.width <= per_pixel:
+                    k = i
+
+        level = self.levels[k]
+        ldx = dx * width / level.width
+        ldy = dy * height / level.height
+        cols = sorted((np.asarray(xlim, float) - x0) / ldx)
+        rows = sorted((np.asarray(ylim, float) - y0) / ldy)
+        c0, c1 = max(int(np.floor(cols[0])), 0), min(
+            int(np.ceil(cols[1])), level.width
+        )
+        r0, r1 = max(int(np.floor(rows[0])), 0), min(
+            int(np.ceil(rows[1])), level.height
+        )
+        if c0 >= c1 or r0 >= r1:
+            return None
+
+        img = self._read_level(k, slice(r0, r1), slice(c0, c1))
+        if band is not None:
+            img = img[..., band]
+        xs = (x0 + c0 * ldx, x0 + c1 * ldx)
+        ys = (y0 + r0 * ldy, y0 + r1 * ldy)
+        if dx < 0:
+            img = img[:, ::-1]
+        if dy > 0:
+            img = img[::-1]
+        return img, (min(xs), max(xs), min(ys), max(ys))
+
+    def levels_of_fill(self, band: int, n: int = 256) -> np.ndarray:
+        """
+        Values of a band at which the fill scale is evaluated
+        """
+        if np.dtype(self.levels[0].dtype) == np.uint8:
+            return np.arange(256, dtype=float)
+        img = self._read_level(
+            len(self.levels) - 1,
+            slice(0, self.levels[-1].height),
+            slice(0, self.levels[-1].width),
+        )[..., band].astype(float)
+        if self.nodata is not None:
+            img = img[img != self.nodata]
+        img = img[np.isfinite(img)]
+        lo, hi = (img.min(), img.max()) if len(img) else (0, 1)
+        return np.linspace(lo, hi, n)
+
+
+def _geo_transform(
+    tags: dict[int, Any],
+) -> tuple[float, float, float, float]:
+    """
+    x of the left edge, pixel width, y of the top edge, pixel height
+    """
+    if 34264 in tags:
+        m = tags[34264]
+        return float(m[3]), float(m[0]), float(m[7]), float(m[5])
+    if 33550 in tags and 33922 in tags:
+        sx, sy = tags[33550][:2]
+        i, j, _, x, y, _ = tags[33922][:6]
+        return float(x - i * sx), float(sx), float(y + j * sy), -float(sy)
+    # No georeferencing, pixel coordinates
+    return 0.0, 1.0, float(_first(tags, 257)), -1.0
+
+
+class geom_stars(geom):
+    """
+    A raster file drawn at the resolution of the panel
+
+    Only the tiles within the panel are read, from the coarsest level of
+    the raster's pyramid that has as many pixels as the panel.
+
+    Parameters
+    ----------
+    source :
+        The raster.
+    band : int | None, default=0
+        Band mapped to the ``fill`` scale. If `None`, the first three
+        bands are drawn as an RGB image, without a scale.
+    dpi : float, default=None
+        Resolution of the image. Default is that of the figure.
+    interpolation : str, default="nearest"
+        How matplotlib resamples the pixels read to the screen.
+    """
+
+    DEFAULT_AES = {"alpha": 1, "fill": "#333333"}
+    REQUIRED_AES = {"x", "y"}
+    DEFAULT_PARAMS = {
+        "stat": "identity",
+        "position": "identity",
+        "na_rm": False,
+        "source": None,
+        "band": 0,
+        "dpi": None,
+        "interpolation": "nearest",
+    }
+    draw_legend = staticmethod(geom_polygon.draw_legend)
+
+    def __init__(self, source: Raster, band: int | None = 0, **kwargs: Any):
+        import pandas as pd
+
+        # A row for each level of the band, spread over the extent so
+        # the position scales are trained on the extent of the raster
+        xmin, xmax, ymin, ymax = source.extent
+        mapping = aes("x", "y")
+        if band is None:
+            n = 2
+            data = pd.DataFrame({})
+        else:
+            values = source.levels_of_fill(band)
+            n = len(values)
+            data = pd.DataFrame({"value": values})
+            mapping = aes("x", "y", fill="value")
+        data["x"] = np.linspace(xmin, xmax, n)
+        data["y"] = np.linspace(ymin, ymax, n)
+        kwargs.setdefault("show_legend", band is not None)
+        super().__init__(mapping, data, source=source, band=band, **kwargs)
+
+    def draw_panel(
+        self,
+        data: pd.DataFrame,
+        panel_params,
+        coord,
+        ax: Axes,
+    ):
+        from matplotlib.colors import to_rgba_array
+
+        if not isinstance(coord, coord_cartesian) or isinstance(
+            coord, coord_flip
+        ):
+            raise PlotnineError(
+                "geom_stars only works with cartesian coordinates"
+            )
+
+        params = self.params
+        source: Raster = params["source"]
+        band = params["band"]
+        xrange, yrange = panel_params.x.range, panel_params.y.range
+        alpha = float(data["alpha"].iloc[0])
+        if band is not None:
+            # The fill scale evaluated at the levels of the band
+            levels = source.levels_of_fill(band)
+            if len(data) != len(levels):
+                raise PlotnineError(
+                    "geom_stars needs every level of the band; set limits"
+                    " with coord_cartesian rather than the position scales"
+                )
+            colours = to_rgba_array(list(data["fill"]))
+            colours[:, 3] *= data["alpha"].to_numpy(dtype=float)
+
+        def make(shape: tuple[int, int], dpi: float):
+            res = source.read(xrange, yrange, shape, band)
+            if res is None:
+                return None
+            img, extent = res
+
+            if band is None:
+                rgba = np.ones(img.shape[:2] + (4,))
+                kind = img.dtype.kind
+                scale = np.iinfo(img.dtype).max if kind in "iu" else 1
+                rgba[..., :3] = img[..., :3] / scale
+                rgba[..., 3] = alpha
+                missing = None
+                if source.nodata is not None:
+                    missing = (img[..., :3] == source.nodata).all(axis=-1)
+            else:
+                values = img.astype(float)
+                step = (levels[-1] - levels[0]) / max(len(levels) - 1, 1)
+                index = np.round((values - levels[0]) / (step or 1))
+                index = np.clip(np.nan_to_num(index), 0, len(levels) - 1)
+                rgba = colours[index.astype(np.intp)]
+                missing = ~np.isfinite(values)
+                if source.nodata is not None:
+                    missing |= values == source.nodata
+            if missing is not None:
+                rgba[missing, 3] = 0
+            return rgba, extent
+
+        # Read when the figure is rendered, at the final size of the
+        # panel
+        image = _PanelImage(
+            ax,
+            make,
+            params["dpi"],
+            extent=(*xrange, *yrange),
+            origin="upper",
+            interpolation=params["interpolation"],
+            zorder=params["zorder"],
+        )
+        image.set_clip_path(ax.patch)
+        ax.add_image(image)
@@ -0,0 +1,487 @@
+"""
+Headless rendering of every figure in a notebook
+
+The cells are executed outside of marimo. While a cell runs, calls to
+``ggplot.show()`` and ``patchworklib.load_ggplot()`` are intercepted so
+that the plot objects are collected instead of being displayed. The
+collected plots are then drawn to files. Cells are independent once
+their ancestors (imports and datasets) have run, so they are spread
+over a pool of worker processes, which run those ancestors as they
+start (see :mod:`pnbook.warm`).
+
+With a :class:`~pnbook.cache.FigureCache`, a figure whose fingerprint
+has been drawn before is copied from the cache instead of drawn. With a
+:class:`~pnbook.statcache.StatCache`, the figures that are drawn reuse
+stat results computed by other cells.
+"""
+
+from __future__ import annotations
+
+import atexit
+import itertools
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import contextmanager, suppress
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Iterator, Sequence
+
+from . import data
+from .cache import FigureCache
+from .fingerprint import plot_fingerprint
+from .notebook import Cell, Notebook, Runner
+from .statcache import StatCache
+from .statcache import install as install_stat_cache
+from .warm import context as warm_context
+
+if TYPE_CHECKING:
+    from plotnine import ggplot
+
+FORMATS = ("png", "svg", "pdf")
+
+
+class Composition:
+    """
+    Deferred patchworklib layout
+
+    Stands in for the ``Brick`` returned by ``pw.load_ggplot`` and
+    records how the plots are combined with ``|`` and ``/``, without
+    drawing anything. When saved, the plots are drawn onto one figure
+    (see :mod:`pnbook.compose`).
+    """
+
+    def __init__(self, op: str, parts: Sequence[Any], figsize=None):
+        self.op = op
+        self.parts = list(parts)
+        self.figsize = figsize
+
+    @classmethod
+    def leaf(cls, plot: ggplot, figsize=None) -> Composition:
+        return cls("leaf", [plot], figsize)
+
+    def __or__(self, other: Composition) -> Composition:
+        return Composition("|", [self, other])
+
+    def __truediv__(self, other: Composition) -> Composition:
+        return Composition("/", [self, other])
+
+    def plots(self) -> list[ggplot]:
+        """
+        The ggplots in this layout, left to right and top to bottom
+        """
+        if self.op == "leaf":
+            return [self.parts[0]]
+        return [p for part in self.parts for p in part.plots()]
+
+    def to_patchwork(self):
+        """
+        Draw the layout with patchworklib
+        """
+        import patchworklib as pw
+
+        if self.op == "leaf":
+            load = getattr(pw, "_pnbook_load_ggplot", pw.load_ggplot)
+            if self.figsize is None:
+                return load(self.parts[0])
+            return load(self.parts[0], figsize=self.figsize)
+        left, right = (part.to_patchwork() for part in self.parts)
+        return (left | right) if self.op == "|" else (left / right)
+
+    def save(self, filename: str | Path):
+        from .compose import save
+
+        save(self, filename)
+
+
+@dataclass
+class CellResult:
+    """
+    What happened when a cell was rendered
+    """
+
+    cell: int
+    lineno: int
+    files: list[str] = field(default_factory=list)
+    hits: int = 0
+    stat_hits: int = 0
+    exec_time: float = 0
+    draw_time: float = 0
+    pid: int = 0
+    error: str | None = None
+
+    @property
+    def total_time(self) -> float:
+        return self.exec_time + self.draw_time
+
+
+@contextmanager
+def capture() -> Iterator[list[Any]]:
+    """
+    Collect plots instead of showing them
+
+    Within the context, ``ggplot.show()`` appends the plot to the
+    yielded list and ``pw.load_ggplot()`` returns a
+    :class:`Composition`.
+    """
+    from plotnine import ggplot
+
+    sink: list[Any] = []
+    show = ggplot.show
+
+    def _show(self, *args, **kwargs):
+        sink.append(self)
+
+    ggplot.show = _show  # type: ignore[method-assign]
+    pw = _patch_patchworklib()
+    try:
+        yield sink
+    finally:
+        ggplot.show = show  # type: ignore[method-assign]
+        if pw is not None:
+            pw.load_ggplot = pw._pnbook_load_ggplot
+            del pw._pnbook_load_ggplot
+
+
+def _patch_patchworklib():
+    try:
+        import patchworklib as pw
+    except ImportError:
+        return None
+    pw._pnbook_load_ggplot = pw.load_ggplot
+    pw.load_ggplot = Composition.leaf
+    return pw
+
+
+def is_figure(obj: Any) -> bool:
+    from plotnine import ggplot
+
+    return isinstance(obj, (ggplot, Composition))
+
+
+@contextmanager
+def reproducible() -> Iterator[None]:
+    """
+    Make the files drawn within the context the same on every run
+
+    Jitter is seeded (see :mod:`pnbook.jitter`), the ids in SVG files
+    use a fixed salt, and SVG and PDF files get a fixed date, unless
+    ``SOURCE_DATE_EPOCH`` is set.
+    """
+    import matplotlib as mpl
+
+    from . import jitter
+
+    epoch = os.environ.get("SOURCE_DATE_EPOCH")
+    os.environ["SOURCE_DATE_EPOCH"] = epoch or "0"
+    try:
+        with jitter.install(), mpl.rc_context({"svg.hashsalt": "pnbook"}):
+            yield
+    finally:
+        if epoch is None:
+            del os.environ["SOURCE_DATE_EPOCH"]
+
+
+def save_figure(
+    obj: ggplot | Composition, filename: Path, batch_facets: bool = True
+):
+    """
+    Draw a ggplot or a composition to a file, reproducibly
+
+    With ``batch_facets``, the panels of plots that
+    :func:`pnbook.facets.can_batch` accepts are drawn together; without,
+    ggplots are saved by plotnine.
+    """
+    from . import facets
+
+    with reproducible():
+        if isinstance(obj, Composition):
+            obj.save(filename)
+        elif batch_facets and facets.can_batch(obj):
+            facets.save(obj, filename)
+        else:
+            obj.save(filename, verbose=False)
+
+
+def collect(
+    runner: Runner, cell: Cell, overrides: dict[str, Any] | None = None
+) -> list[ggplot | Composition]:
+    """
+    Run a cell and return the figures it would display
+    """
+    with capture() as sink:
+        output = runner.run(cell, overrides)
+    if is_figure(output) and not any(output is obj for obj in sink):
+        sink.append(output)
+    return sink
+
+
+class Renderer:
+    """
+    Render the figures of notebook cells to files
+
+    Parameters
+    ----------
+    notebook :
+        Notebook whose cells to render.
+    outdir :
+        Directory in which to write the figures.
+    formats :
+        File formats, each figure is written once per format.
+    cache :
+        Store of previously drawn figures.
+    stat_cache :
+        Store of stat results.
+    batch_facets :
+        Draw the panels of batchable facets together, see
+        :func:`save_figure`.
+    """
+
+    def __init__(
+        self,
+        notebook: Notebook,
+        outdir: str | Path,
+        formats: Sequence[str] = ("png",),
+        cache: FigureCache | None = None,
+        stat_cache: StatCache | None = None,
+        batch_facets: bool = True,
+    ):
+        self.notebook = notebook
+        self.runner = Runner(notebook)
+        self.outdir = Path(outdir)
+        self.formats = tuple(formats)
+        self.cache = cache
+        self.stat_cache = stat_cache
+        self.batch_facets = batch_facets
+
+    def filenames(self, cell: Cell, k: int) -> list[Path]:
+        return [self.outdir / f"{cell.name}-{k}.{fmt}" for fmt in self.formats]
+
+    def render(self, cell: Cell) -> CellResult:
+        result = CellResult(cell.index, cell.lineno, pid=os.getpid())
+        start = time.perf_counter()
+        try:
+            figures = collect(self.runner, cell)
+            result.exec_time = time.perf_counter() - start
+            start = time.perf_counter()
+            for k, fig in enumerate(figures):
+                key = plot_fingerprint(fig) if self.cache else ""
+                for fmt, filename in zip(self.formats, self.filenames(cell, k)):
+                    if self.cache and self.cache.fetch(key, fmt, filename):
+                        result.hits += 1
+                    else:
+                        self._save(fig, filename, result)
+                        if self.cache:
+                            self.cache.store(key, fmt, filename)
+                    result.files.append(filename.name)
+            result.draw_time = time.perf_counter() - start
+        except Exception as err:
+            result.error = f"{type(err).__name__}: {err}"
+        return result
+
+    def warm(self, cells: Sequence[Cell]):
+        """
+        Run ahead the cells that ``cells`` depend on
+
+        Failures are left for :meth:`render` to report.
+        """
+        for cell in cells:
+            with suppress(Exception):
+                self.runner.prepare(cell)
+
+    def _save(self, fig, filename: Path, result: CellResult):
+        if self.stat_cache is None:
+            save_figure(fig, filename, self.batch_facets)
+            return
+        hits = self.stat_cache.hits
+        with install_stat_cache(self.stat_cache):
+            save_figure(fig, filename, self.batch_facets)
+        result.stat_hits += self.stat_cache.hits - hits
+
+
+# Per-process renderer of the worker pool, and the settings it has
+_renderer: Renderer | None = None
+_settings: int | None = None
+
+# Pool of warm workers, kept between calls for the same notebook file,
+# and the file, its text and the number of workers
+_pool: ProcessPoolExecutor | None = None
+_pool_key: tuple | None = None
+
+# Numbers the settings of each render_notebook call
+_calls = itertools.count()
+
+
+def _init_worker(path: str, indices: Sequence[int] = ()):
+    global _renderer, _settings
+    import matplotlib
+
+    matplotlib.use("Agg")
+    data.install()
+    _renderer = Renderer(Notebook(path), ".")
+    _settings = None
+    _renderer.warm([_renderer.notebook.cells[i] for i in indices])
+
+
+def _render_cell(
+    index: int,
+    call: int,
+    outdir: str,
+    formats: tuple[str, ...],
+    cache: FigureCache | None,
+    stat_cache: StatCache | None,
+    batch_facets: bool,
+) -> CellResult:
+    global _settings
+    assert _renderer is not None
+    # A worker keeps its stat cache for all the cells of a call
+    if _settings != call:
+        _renderer.outdir = Path(outdir)
+        _renderer.formats = formats
+        _renderer.cache = cache
+        _renderer.stat_cache = stat_cache
+        _renderer.batch_facets = batch_facets
+        _settings = call
+    return _renderer.render(_renderer.notebook.cells[index])
+
+
+def _warm_pool(notebook: Notebook, jobs: int, indices: Sequence[int]):
+    """
+    A pool of ``jobs`` workers that have run the notebook's setup cells
+
+    The pool of the previous call is reused if it was for the same
+    notebook file, unchanged, and has enough workers. It is shut down
+    when another pool is needed, by :func:`shutdown` or at exit.
+    """
+    global _pool, _pool_key
+    path = str(notebook.path)
+    if _pool_key is None or _pool_key[:2] != (path, notebook.text) or (
+        _pool_key[2] < jobs
+    ):
+        shutdown()
+        _pool = ProcessPoolExecutor(
+            max_workers=jobs,
+            mp_context=warm_context(),
+            initializer=_init_worker,
+            initargs=(path, indices),
+        )
+        _pool_key = (path, notebook.text, jobs)
+    return _pool
+
+
+def shutdown():
+    """
+    Stop the workers kept by :func:`render_notebook`
+    """
+    global _pool, _pool_key
+    if _pool is not None:
+        _pool.shutdown()
+    _pool = _pool_key = None
+
+
+atexit.register(shutdown)
+
+
+def render_notebook(
+    path: str | Path,
+    outdir: str | Path,
+    formats: Sequence[str] = ("png",),
+    jobs: int | None = None,
+    cells: Sequence[Cell] | None = None,
+    cache: FigureCache | None = None,
+    stat_cache: StatCache | None = None,
+    batch_facets: bool = True,
+) -> list[CellResult]:
+    """
+    Render the figures of a notebook in parallel
+
+    Parameters
+    ----------
+    path :
+        Notebook file.
+    outdir :
+        Directory in which to write the figures.
+    formats :
+        File formats, each figure is written once per format.
+    jobs :
+        Number of worker processes. Default is the number of CPUs.
+        With ``jobs=1`` everything runs in the calling process.
+    cells :
+        Cells to render. Default is all the cells that can make a plot.
+    cache :
+        Store of previously drawn figures. It is trimmed to its size
+        limit after rendering.
+    stat_cache :
+        Store of stat results, likewise trimmed.
+    batch_facets :
+        Draw the panels of batchable facets together, see
+        :func:`save_figure`.
+
+    Returns
+    -------
+    list[CellResult]
+        One result per cell, in cell order.
+    """
+    notebook = Notebook(path)
+    outdir = Path(outdir)
+    outdir.mkdir(parents=True, exist_ok=True)
+    if cells is None:
+        cells = notebook.plot_cells()
+    indices = [c.index for c in cells]
+    jobs = min(jobs or os.cpu_count() or 1, max(len(indices), 1))
+
+    path = str(notebook.path)
+    settings = (
+        next(_calls),
+        str(outdir),
+        tuple(formats),
+        cache,
+        stat_cache,
+        batch_facets,
+    )
+    data.prepare()
+    if jobs == 1:
+        if _renderer is None or _renderer.notebook.text != notebook.text:
+            _init_worker(path)
+        results = [_render_cell(i, *settings) for i in indices]
+    else:
+        pool = _warm_pool(notebook, jobs, indices)
+        futures = [pool.submit(_render_cell, i, *settings) for i in indices]
+        results = [f.result() for f in as_completed(futures)]
+    if cache:
+        cache.evict()
+    if stat_cache and stat_cache.disk:
+        stat_cache.disk.evict()
+    return sorted(results, key=lambda r: r.cell)
+
+
+def summary(results: Sequence[CellResult], wall_time: float) -> str:
+    """
+    Table of the per-cell timings
+    """
+    lines = [
+        f"{'cell':<9} {'line':>5} {'figs':>5} {'hits':>5} {'exec':>8} {'draw':>8}"
+        f" {'total':>8} {'pid':>7}"
+    ]
+    for r in results:
+        nfigs = len(r.files)
+        line = (
+            f"cell-{r.cell:03d} {r.lineno:>5} {nfigs:>5} {r.hits:>5}"
+            f" {r.exec_time:>7.3f}s"
+            f" {r.draw_time:>7.3f}s {r.total_time:>7.3f}s {r.pid:>7}"
+        )
+        if r.error:
+            line += f"  {r.error}"
+        lines.append(line)
+    cpu_time = sum(r.total_time for r in results)
+    nfiles = sum(len(r.files) for r in results)
+    nhits = sum(r.hits for r in results)
+    nstats = sum(r.stat_hits for r in results)
+    nfailed = sum(r.error is not None for r in results)
+    lines.append(
+        f"{len(results)} cells, {nfiles} files ({nhits} cached),"
+        f" {nstats} stats reused, {nfailed} failed;"
+        f" {cpu_time:.2f}s of work in {wall_time:.2f}s"
+        f" (x{cpu_time / wall_time if wall_time else 0:.1f})"
+    )
+    return "\n".join(lines)
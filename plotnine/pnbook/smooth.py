@@ -0,0 +1,387 @@
+"""
+Smoothing for large data
+
+plotnine fits ``loess`` with skmisc, which needs O(n²) memory, and
+``gam`` and ``rlm`` with statsmodels on every row. Above a few thousand
+rows, :class:`stat_smooth_binned` fits these methods on data binned
+along x instead:
+
+- Each bin keeps the number of observations, the mean of x and y, and
+  the within-bin sum of squares of y. These are the sufficient
+  statistics of a weighted least squares fit, so fits on the bins match
+  fits on the rows up to the binning of x. With a ``weight`` aesthetic,
+  ``loess`` and ``gam`` weight the counts, means and sums of squares,
+  while ``lowess`` and ``rlm`` ignore it, as plotnine's do.
+- ``loess`` is a local quadratic fit with tricube weights, evaluated for
+  all the prediction points at once.
+- ``lowess`` is the local linear fit of statsmodels' lowess, without its
+  robustness iterations (as with ``method_args={"it": 0}``), and like
+  plotnine's it has no standard errors.
+- ``gam``, which plotnine does not provide, is a cubic P-spline
+  (B-spline basis with a difference penalty) whose penalty is chosen by
+  generalized cross-validation. It is used for groups of any size;
+  small groups are fitted on their rows.
+- ``rlm`` is a Huber M-estimator fitted by iteratively reweighted least
+  squares, on a seeded subsample when there are too many rows.
+
+Memory use depends on the number of bins and prediction points, not on
+the number of rows. Standard errors are computed for the whole
+prediction grid in one matrix product.
+"""
+
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import TYPE_CHECKING
+
+import numpy as np
+from plotnine import geom_smooth as _geom_smooth
+from plotnine.stats import stat_smooth
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+# Methods fitted on binned data
+BINNED_METHODS = ("loess", "lowess", "gam", "rlm")
+
+
+@dataclass
+class Binned:
+    """
+    Data binned along x
+    """
+
+    x: np.ndarray
+    """Mean of x in each bin"""
+
+    y: np.ndarray
+    """Mean of y in each bin"""
+
+    w: np.ndarray
+    """Number of observations in each bin, or their total weight"""
+
+    ss: np.ndarray
+    """Sum of squares of y about the bin mean"""
+
+    rows: np.ndarray | None = None
+    """Number of observations in each bin, if ``w`` are weights"""
+
+    @property
+    def counts(self) -> np.ndarray:
+        return self.w if self.rows is None else self.rows
+
+    @property
+    def n(self) -> float:
+        return float(self.counts.sum())
+
+
+@dataclass
+class Fit:
+    """
+    Smooth evaluated on a grid
+    """
+
+    y: np.ndarray
+    se: np.ndarray
+    df: float
+    """Residual degrees of freedom"""
+
+
+def bin_xy(
+    x: np.ndarray,
+    y: np.ndarray,
+    bins: int = 512,
+    weights: np.ndarray | None = None,
+) -> Binned:
+    """
+    Bin observations into ``bins`` equal-width intervals of x
+
+    Empty bins are dropped. With ``weights``, the means and sums of
+    squares are weighted, as in weighted least squares.
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    lo, hi = x.min(), x.max()
+    if hi > lo:
+        idx = ((x - lo) * (bins / (hi - lo))).astype(np.intp)
+        np.minimum(idx, bins - 1, out=idx)
+    else:
+        idx = np.zeros(len(x), dtype=np.intp)
+
+    rows = np.bincount(idx, minlength=bins).astype(float)
+    w = 1.0 if weights is None else np.asarray(weights, dtype=float)
+    n = rows if weights is None else np.bincount(idx, w, minlength=bins)
+    sx = np.bincount(idx, w * x, minlength=bins)
+    sy = np.bincount(idx, w * y, minlength=bins)
+    syy = np.bincount(idx, w * y * y, minlength=bins)
+    keep = rows > 0
+    rows, n, sx, sy, syy = rows[keep], n[keep], sx[keep], sy[keep], syy[keep]
+    ym = sy / n
+    ss = np.maximum(syy - n * ym * ym, 0)
+    return Binned(sx / n, ym, n, ss, None if weights is None else rows)
+
+
+def _residual_variance(b: Binned, fitted: np.ndarray, edf: float):
+    rss = b.ss.sum() + (b.w * (b.y - fitted) ** 2).sum()
+    df = max(b.n - edf, 1.0)
+    return rss / df, df
+
+
+def _loess_weights(
+    xb: np.ndarray, wb: np.ndarray, x0: np.ndarray, span: float
+) -> np.ndarray:
+    """
+    Tricube weights of the bins (columns) for each point of x0 (rows)
+
+    As in loess, the neighbourhood of a point holds the fraction
+    ``span`` of all the observations, ``wb`` being their number in each
+    bin.
+    """
+    d = np.abs(xb[None, :] - x0[:, None])
+    if span < 1:
+        order = np.argsort(d, axis=1)
+        dsorted = np.take_along_axis(d, order, axis=1)
+        cumw = np.cumsum(wb[order], axis=1)
+        k = (cumw < span * wb.sum()).sum(axis=1)
+        k = np.minimum(k, d.shape[1] - 1)
+        h = dsorted[np.arange(len(x0)), k]
+    else:
+        h = d.max(axis=1) * span
+    h = np.maximum(h, np.finfo(float).eps)[:, None]
+    u = np.minimum(d / h, 1)
+    return (1 - u**3) ** 3
+
+
+def _local_smoother(
+    b: Binned, x0: np.ndarray, span: float, degree: int
+) -> np.ndarray:
+    """
+    Rows of the linear smoother: fit(x0) = L @ b.y
+    """
+    degree = min(degree, len(b.x) - 1)
+    k = _loess_weights(b.x, b.counts, x0, span) * b.w[None, :]
+    scale = np.ptp(b.x) or 1.0
+    t = (b.x[None, :] - x0[:, None]) / scale
+    # (m, B, p) design of the local polynomial for each point of x0
+    X = t[..., None] ** np.arange(degree + 1)
+    XtW = X.transpose(0, 2, 1) * k[:, None, :]
+    A = XtW @ X
+    ridge = 1e-10 * np.trace(A, axis1=1, axis2=2)[:, None, None]
+    A += ridge * np.eye(degree + 1)
+    # Only the intercept of each local fit is needed
+    e1 = np.zeros((len(x0), degree + 1, 1))
+    e1[:, 0] = 1
+    coef = np.linalg.solve(A, e1)[..., 0]
+    return np.einsum("mp,mpb->mb", coef, XtW)
+
+
+def loess(
+    b: Binned, x0: np.ndarray, span: float = 0.75, degree: int = 2
+) -> Fit:
+    """
+    Local polynomial regression on binned data
+    """
+    L = _local_smoother(b, x0, span, degree)
+    Lb = _local_smoother(b, b.x, span, degree)
+    sigma2, df = _residual_variance(b, Lb @ b.y, np.trace(Lb))
+    se = np.sqrt(sigma2 * (L**2 / b.w[None, :]).sum(axis=1))
+    return Fit(L @ b.y, se, df)
+
+
+def bspline_basis(
+    x: np.ndarray, lo: float, hi: float, nseg: int, degree: int = 3
+) -> np.ndarray:
+    """
+    B-spline basis with equally spaced knots on [lo, hi]
+
+    Returns
+    -------
+    numpy.ndarray
+        Matrix of shape ``(len(x), nseg + degree)``.
+    """
+    hi = hi + 1e-9 * ((hi - lo) or 1.0)
+    dx = (hi - lo) / nseg
+    knots = lo + dx * np.arange(-degree, nseg + degree + 1)
+    x = np.asarray(x, dtype=float)[:, None]
+    B = ((x >= knots[:-1]) & (x < knots[1:])).astype(float)
+    for d in range(1, degree + 1):
+        c = B.shape[1] - 1
+        left = (x - knots[:c]) / (d * dx)
+        right = (knots[d + 1 : d + 1 + c] - x) / (d * dx)
+        B = left * B[:, :-1] + right * B[:, 1:]
+    return B
+
+
+def gam(
+    b: Binned,
+    x0: np.ndarray,
+    nseg: int = 20,
+    lambdas: np.ndarray | None = None,
+) -> Fit:
+    """
+    Penalized cubic regression spline on binned data
+    """
+    if lambdas is None:
+        lambdas = np.logspace(-4, 6, 41)
+    lo, hi = min(b.x.min(), x0.min()), max(b.x.max(), x0.max())
+    X = bspline_basis(b.x, lo, hi, nseg)
+    X0 = bspline_basis(x0, lo, hi, nseg)
+    D = np.diff(np.eye(X.shape[1]), n=2, axis=0)
+    P = D.T @ D
+
+    XtWX = X.T @ (X * b.w[:, None])
+    XtWy = X.T @ (b.w * b.y)
+    # Solve for every candidate penalty at once and pick by GCV
+    H = np.linalg.inv(XtWX[None] + lambdas[:, None, None] * P[None])
+    coef = H @ XtWy
+    edf = np.einsum("lij,ji->l", H, XtWX)
+    fitted = coef @ X.T
+    rss = b.ss.sum() + ((b.y[None] - fitted) ** 2 * b.w[None]).sum(axis=1)
+    gcv = b.n * rss / np.maximum(b.n - edf, 1) ** 2
+    i = int(np.argmin(gcv))
+
+    sigma2, df = _residual_variance(b, fitted[i], edf[i])
+    se = np.sqrt(sigma2 * np.einsum("mi,ij,mj->m", X0, H[i], X0))
+    return Fit(X0 @ coef[i], se, df)
+
+
+def rlm(
+    x: np.ndarray,
+    y: np.ndarray,
+    x0: np.ndarray,
+    max_samples: int = 200_000,
+    c: float = 1.345,
+    maxiter: int = 50,
+    seed: int = 0,
+) -> Fit:
+    """
+    Huber robust straight line fit
+
+    At most ``max_samples`` rows, drawn with a fixed seed, take part.
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    if len(x) > max_samples:
+        rng = np.random.default_rng(seed)
+        idx = rng.choice(len(x), max_samples, replace=False)
+        x, y = x[idx], y[idx]
+
+    X = np.column_stack([np.ones_like(x), x])
+    w = np.ones_like(x)
+    coef = np.zeros(2)
+    for _ in range(maxiter):
+        Xw = X * w[:, None]
+        new = np.linalg.solve(Xw.T @ X, Xw.T @ y)
+        r = y - X @ new
+        scale = np.median(np.abs(r - np.median(r))) / 0.6745 or 1.0
+        u = np.abs(r) / scale
+        w = np.where(u <= c, 1.0, c / np.maximum(u, np.finfo(float).eps))
+        done = np.allclose(new, coef, rtol=1e-8, atol=1e-12)
+        coef = new
+        if done:
+            break
+
+    df = max(len(x) - 2, 1)
+    sigma2 = (w * r**2).sum() / df
+    cov = sigma2 * np.linalg.inv((X * w[:, None]).T @ X)
+    X0 = np.column_stack([np.ones_like(x0), x0])
+    se = np.sqrt(np.einsum("mi,ij,mj->m", X0, cov, X0))
+    return Fit(X0 @ coef, se, df)
+
+
+class stat_smooth_binned(stat_smooth):
+    """
+    stat_smooth that scales to large data
+
+    Groups with more than ``large_n`` rows and a method in
+    ``loess``, ``lowess``, ``gam`` or ``rlm`` are fitted on binned
+    data, and ``gam`` is fitted on the rows of smaller groups;
+    everything else is left to plotnine.
+
+    Parameters
+    ----------
+    bins : int, default=512
+        Number of bins along x.
+    large_n : int, default=5000
+        Number of rows above which a group is binned.
+    max_samples : int, default=200000
+        Maximum number of rows used by ``rlm``.
+    """
+
+    DEFAULT_PARAMS = {
+        **stat_smooth.DEFAULT_PARAMS,
+        "bins": 512,
+        "large_n": 5000,
+        "max_samples": 200_000,
+    }
+
+    def compute_group(self, data: pd.DataFrame, scales) -> pd.DataFrame:
+        from warnings import warn
+
+        import pandas as pd
+        from plotnine.exceptions import PlotnineWarning
+        from scipy import stats
+
+        params = self.params
+        method = params["method"]
+        small = len(data) <= params["large_n"]
+        if method not in BINNED_METHODS or (small and method != "gam"):
+            return super().compute_group(data, scales)
+
+        x = data["x"].to_numpy(dtype=float)
+        y = data["y"].to_numpy(dtype=float)
+        if params["fullrange"] and scales.x:
+            lo, hi = scales.x.dimension()
+        else:
+            lo, hi = x.min(), x.max()
+        x0 = np.linspace(lo, hi, params["n"])
+
+        # Like plotnine, loess (and gam) are weighted, lowess and rlm not
+        weights = None
+        if "weight" in data and method in ("loess", "gam"):
+            weights = data["weight"].to_numpy(dtype=float)
+            if np.any(weights < 0):
+                raise ValueError("All weights must be greater than zero.")
+            # Of mean 1, so that the penalty of gam does not depend on
+            # their scale
+            weights = weights / weights.mean()
+
+        method_args = params["method_args"]
+        if method == "rlm":
+            fit = rlm(x, y, x0, params["max_samples"])
+        else:
+            if small and weights is None:
+                b = Binned(x, y, np.ones_like(x), np.zeros_like(x))
+            elif small:
+                b = Binned(x, y, weights, np.zeros_like(x), np.ones_like(x))
+            else:
+                b = bin_xy(x, y, params["bins"], weights)
+            if method == "gam":
+                fit = gam(b, x0, method_args.get("nseg", 20))
+            elif method == "lowess":
+                fit = loess(b, x0, params["span"], 1)
+            else:
+                degree = method_args.get("degree", 2)
+                fit = loess(b, x0, params["span"], degree)
+
+        res = pd.DataFrame({"x": x0, "y": fit.y})
+        if params["se"] and method == "lowess":
+            warn(
+                "Confidence intervals are not yet implemented"
+                " for lowess smoothings.",
+                PlotnineWarning,
+            )
+        elif params["se"]:
+            q = stats.t.ppf((1 + params["level"]) / 2, fit.df)
+            res["ymin"] = fit.y - q * fit.se
+            res["ymax"] = fit.y + q * fit.se
+            res["se"] = fit.se
+        return res
+
+
+def geom_smooth(*args, **kwargs):
+    """
+    plotnine's geom_smooth computed with :class:`stat_smooth_binned`
+    """
+    kwargs.setdefault("stat", stat_smooth_binned)
+    return _geom_smooth(*args, **kwargs)
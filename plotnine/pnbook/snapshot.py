@@ -0,0 +1,298 @@
+"""
+Snapshot tests of the notebook's figures
+
+``update`` renders every figure of the notebook to PNG in a baseline
+directory, with a manifest that records, for each cell, its lineage
+(see :meth:`Notebook.identity`), a key covering the lineage, the
+versions of the plotting libraries and the source of pnbook, and its
+files. Figures are drawn by plotnine, not by the batched renderer of
+:mod:`pnbook.facets`, so that they check plotnine's drawing. ``check``
+then tells which figures have changed:
+
+- a cell whose key is that of the baseline cannot have changed, and is
+  neither run nor drawn;
+- the other cells with a baseline are rendered (in parallel, see
+  :func:`~pnbook.render.render_notebook`) and their figures compared
+  to the baseline images, also in parallel. Files that are identical
+  byte for byte need no decoding. Otherwise both images are turned into
+  luminance, blurred over 3x3 pixels so that differences in the
+  antialiasing of edges stay below the tolerance, and a pixel has
+  changed if its luminance moved by more than ``tolerance``. A figure
+  has changed if more than ``max_changed`` of its pixels have, or if its
+  size has;
+- cells with no baseline (new or edited cells) are reported as new;
+- cells that fail are reported as failed, unless they failed with the
+  same error when the baseline was made: those are known failures, and
+  pass.
+
+After an upgrade of plotnine or matplotlib, or an edit of pnbook, every
+key changes and every figure is compared; otherwise a check only costs
+parsing the notebook.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Sequence
+
+import numpy as np
+
+from .fingerprint import library_versions, pnbook_version
+from .notebook import Cell, Notebook
+from .render import CellResult, render_notebook
+
+MANIFEST = "snapshots.json"
+
+# Change of luminance (0 to 1) above which a pixel has changed
+TOLERANCE = 0.1
+
+# Fraction of changed pixels above which a figure has changed
+MAX_CHANGED = 0.001
+
+# Statuses of a figure that pass a check
+PASSED = ("unchanged", "same", "close", "known-failure")
+
+
+@dataclass
+class Diff:
+    """
+    Comparison of a figure with its baseline
+    """
+
+    cell: str
+    file: str
+    status: str
+    """unchanged (not rendered), same, close, changed, new, missing,
+    failed, or known-failure (failed with the error of the baseline)"""
+
+    changed: float = 0.0
+    """Fraction of the pixels that changed"""
+
+    rms: float = 0.0
+    """Root mean square of the change of luminance"""
+
+    error: str | None = None
+
+    @property
+    def ok(self) -> bool:
+        return self.status in PASSED
+
+
+def snapshot_key(notebook: Notebook, cell: Cell) -> str:
+    """
+    Key that changes when the figures of a cell may have changed
+    """
+    h = hashlib.sha256(notebook.lineage(cell).encode())
+    h.update(repr(library_versions()).encode())
+    h.update(pnbook_version().encode())
+    return h.hexdigest()[:16]
+
+
+def _read_manifest(baseline: Path) -> dict[str, dict]:
+    try:
+        with open(baseline / MANIFEST) as f:
+            return json.load(f)["cells"]
+    except FileNotFoundError:
+        return {}
+
+
+def update(
+    path: str | Path, baseline: str | Path, jobs: int | None = None
+) -> list[CellResult]:
+    """
+    Render every figure of the notebook as the new baseline
+
+    The files of the previous baseline are removed; a directory that
+    is not empty and has no manifest is left alone.
+    """
+    notebook = Notebook(path)
+    baseline = Path(baseline)
+    if baseline.is_dir() and any(baseline.iterdir()):
+        if not (baseline / MANIFEST).exists():
+            raise ValueError(
+                f"{baseline} is not a snapshot baseline, it has no {MANIFEST}."
+            )
+        for entry in _read_manifest(baseline).values():
+            for file in entry["files"]:
+                (baseline / Path(file).name).unlink(missing_ok=True)
+    results = render_notebook(
+        notebook.path, baseline, ("png",), jobs, batch_facets=False
+    )
+    cells = {}
+    for r in results:
+        cell = notebook.cells[r.cell]
+        cells[notebook.identity(cell)] = {
+            "key": snapshot_key(notebook, cell),
+            "files": r.files,
+            "error": r.error,
+        }
+    data = {
+        "notebook": str(notebook.path),
+        "versions": {**dict(library_versions()), "pnbook": pnbook_version()},
+        "cells": cells,
+    }
+    path = baseline / MANIFEST
+    tmp = path.with_suffix(".tmp")
+    tmp.write_text(json.dumps(data, indent=1, sort_keys=True))
+    os.replace(tmp, path)
+    return results
+
+
+def luminance(path: str | Path) -> np.ndarray:
+    """
+    Luminance of a PNG image, on a white background
+    """
+    from matplotlib.image import imread
+
+    img = imread(path)
+    if img.ndim == 2:
+        return img.astype(float)
+    rgb = img[..., :3].astype(float)
+    if img.shape[-1] == 4:
+        alpha = img[..., 3:4]
+        rgb = rgb * alpha + (1 - alpha)
+    return rgb @ np.array([0.2126, 0.7152, 0.0722])
+
+
+def compare_images(
+    new: str | Path,
+    old: str | Path,
+    tolerance: float = TOLERANCE,
+    max_changed: float = MAX_CHANGED,
+) -> tuple[str, float, float]:
+    """
+    Status, fraction of changed pixels and RMS change of two images
+    """
+    from .points import _box_sum
+
+    if Path(new).read_bytes() == Path(old).read_bytes():
+        return "same", 0.0, 0.0
+    a, b = luminance(new), luminance(old)
+    if a.shape != b.shape:
+        return "changed", 1.0, 1.0
+    diff = np.abs(_box_sum(a, 1) - _box_sum(b, 1)) / 9
+    changed = float((diff > tolerance).mean())
+    rms = float(np.sqrt(np.mean((a - b) ** 2)))
+    status = "close" if changed <= max_changed else "changed"
+    return status, changed, rms
+
+
+def check(
+    path: str | Path,
+    baseline: str | Path,
+    jobs: int | None = None,
+    tolerance: float = TOLERANCE,
+    max_changed: float = MAX_CHANGED,
+    keep: str | Path | None = None,
+) -> list[Diff]:
+    """
+    Compare the figures of the notebook with the baseline
+
+    Parameters
+    ----------
+    path :
+        Notebook file.
+    baseline :
+        Directory written by :func:`update`.
+    jobs :
+        Number of processes rendering, and of threads comparing.
+    tolerance :
+        Change of luminance above which a pixel has changed.
+    max_changed :
+        Fraction of changed pixels above which a figure has changed.
+    keep :
+        Directory where the new renders of the figures that changed are
+        copied.
+    """
+    notebook = Notebook(path)
+    baseline = Path(baseline)
+    manifest = _read_manifest(baseline)
+    diffs: list[Diff] = []
+    todo: dict[int, dict] = {}
+    for cell in notebook.plot_cells():
+        entry = manifest.get(notebook.identity(cell))
+        if entry is None:
+            diffs.append(Diff(cell.name, "", "new"))
+        elif entry["key"] != snapshot_key(notebook, cell):
+            todo[cell.index] = entry
+        elif entry["error"] is not None:
+            diffs.append(
+                Diff(cell.name, "", "known-failure", error=entry["error"])
+            )
+        else:
+            files = entry["files"]
+            diffs.extend(Diff(cell.name, f, "unchanged") for f in files)
+    if not todo:
+        return diffs
+
+    with tempfile.TemporaryDirectory() as outdir:
+        cells = [notebook.cells[i] for i in todo]
+        results = render_notebook(
+            notebook.path, outdir, ("png",), jobs, cells, batch_facets=False
+        )
+        pairs = []
+        for r in results:
+            name = notebook.cells[r.cell].name
+            old_files = todo[r.cell]["files"]
+            if r.error is not None:
+                # Not a regression if the baseline failed the same way
+                known = r.error == todo[r.cell]["error"]
+                status = "known-failure" if known else "failed"
+                diffs.append(Diff(name, "", status, error=r.error))
+                continue
+            for k, old in enumerate(old_files):
+                if k < len(r.files):
+                    pairs.append((name, r.files[k], old))
+                else:
+                    diffs.append(Diff(name, old, "missing"))
+            extra = r.files[len(old_files) :]
+            diffs.extend(Diff(name, f, "new") for f in extra)
+
+        def compare(pair: tuple[str, str, str]) -> Diff:
+            name, new, old = pair
+            status, changed, rms = compare_images(
+                Path(outdir) / new, baseline / old, tolerance, max_changed
+            )
+            return Diff(name, old, status, changed, rms)
+
+        workers = jobs or os.cpu_count() or 1
+        with ThreadPoolExecutor(workers) as pool:
+            compared = list(pool.map(compare, pairs))
+        diffs.extend(compared)
+
+        if keep is not None:
+            keep = Path(keep)
+            keep.mkdir(parents=True, exist_ok=True)
+            for (_, new, _), d in zip(pairs, compared):
+                if d.status == "changed":
+                    shutil.copy(Path(outdir) / new, keep / d.file)
+    order = {c.name: c.index for c in notebook.cells}
+    return sorted(diffs, key=lambda d: (order[d.cell], d.file))
+
+
+def report(diffs: Sequence[Diff]) -> str:
+    """
+    The figures that did not pass, and a count of each status
+    """
+    lines = []
+    for d in diffs:
+        if d.ok:
+            continue
+        line = f"{d.cell:<9} {d.file:<16} {d.status:<8}"
+        if d.status in ("changed", "close"):
+            line += f" {d.changed:>7.2%} of pixels, rms {d.rms:.4f}"
+        if d.error:
+            line += f"  {d.error}"
+        lines.append(line)
+    counts: dict[str, int] = {}
+    for d in diffs:
+        counts[d.status] = counts.get(d.status, 0) + 1
+    lines.append(", ".join(f"{n} {status}" for status, n in counts.items()))
+    return "\n".join(lines)
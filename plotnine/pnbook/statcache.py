@@ -0,0 +1,232 @@
+"""
+Memoized stat computations
+
+Many plots compute the same statistic on the same data: a histogram
+and a frequency polygon of ``hwy`` bin the same column, and a violin,
+boxplot and jitter overlay repeats the densities and quantiles of the
+standalone violin and boxplot. While :func:`install` is in effect,
+every stat's ``compute_layer`` first looks up its result, keyed by
+
+- the fingerprint of the layer data as the stat sees it, i.e. the
+  mapped and transformed columns, ``group`` and ``PANEL``,
+- the stat class and the parameters it computes with, that is all but
+  the geom and position the layer draws with, and the versions of the
+  libraries and of pnbook's source,
+- the panel layout and the limits of the panel scales.
+
+Results are kept in memory, so layers in the same process share them,
+and optionally on disk, so they are shared between processes and runs.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import pickle
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Iterator
+
+from .cache import DiskCache
+from .fingerprint import (
+    canonical,
+    data_fingerprint,
+    library_versions,
+    pnbook_version,
+)
+
+if TYPE_CHECKING:
+    from pathlib import Path
+
+    import pandas as pd
+
+# Stats that are cheaper to run than to look up
+_SKIP = frozenset({"stat_identity"})
+
+# Parameters of a stat that are passed on to the rest of the layer
+_LAYER_PARAMS = frozenset({"geom", "position"})
+
+
+class StatCache:
+    """
+    Results of stat computations, in memory and optionally on disk
+
+    Parameters
+    ----------
+    disk :
+        Persistent store shared between processes. If None, results
+        are only kept in memory.
+    max_items :
+        Number of results kept in memory.
+    """
+
+    def __init__(self, disk: DiskCache | None = None, max_items: int = 128):
+        self.disk = disk
+        self.max_items = max_items
+        self.hits = 0
+        self.misses = 0
+        self._memory: OrderedDict[str, pd.DataFrame] = OrderedDict()
+
+    def get(self, key: str) -> pd.DataFrame | None:
+        if key in self._memory:
+            self._memory.move_to_end(key)
+            return self._memory[key]
+        if self.disk is not None:
+            data = self.disk.read(key, "pkl")
+            if data is not None:
+                result = pickle.loads(data)
+                self._remember(key, result)
+                return result
+        return None
+
+    def put(self, key: str, result: pd.DataFrame):
+        self._remember(key, result)
+        if self.disk is not None:
+            self.disk.write(key, "pkl", pickle.dumps(result, protocol=5))
+
+    def _remember(self, key: str, result: pd.DataFrame):
+        self._memory[key] = result
+        if len(self._memory) > self.max_items:
+            self._memory.popitem(last=False)
+
+
+def _scale_key(scale) -> tuple:
+    if scale is None:
+        return ()
+    return (type(scale).__name__, canonical(scale.limits))
+
+
+def stat_key(stat, data: pd.DataFrame, layout) -> str:
+    """
+    Fingerprint of a stat computation
+    """
+    h = hashlib.sha256()
+    h.update(repr(library_versions()).encode())
+    # pnbook's own stats compute differently as their code changes
+    h.update(pnbook_version().encode())
+    h.update(type(stat).__qualname__.encode())
+    params = {
+        k: v for k, v in stat.params.items() if k not in _LAYER_PARAMS
+    }
+    h.update(repr(canonical(params)).encode())
+    h.update(data_fingerprint(data).encode())
+    h.update(data_fingerprint(layout.layout).encode())
+    for scales in (layout.panel_scales_x, layout.panel_scales_y):
+        h.update(repr([_scale_key(sc) for sc in scales or []]).encode())
+    return h.hexdigest()
+
+
+def _stat_classes():
+    from plotnine.stats.stat import stat
+
+    classes, todo = [], [stat]
+    while todo:
+        cls = todo.pop()
+        classes.append(cls)
+        todo.extend(cls.__subclasses__())
+    return classes
+
+
+@contextmanager
+def install(cache: StatCache) -> Iterator[StatCache]:
+    """
+    Route every stat computation through ``cache``
+
+    Stats that override ``compute_layer`` are wrapped as well. When an
+    override calls the base method, only the outer call is cached.
+    """
+    active = False
+
+    def wrap(compute_layer):
+        def cached_compute_layer(self, data, layout):
+            nonlocal active
+            if active or type(self).__name__ in _SKIP:
+                return compute_layer(self, data, layout)
+            key = stat_key(self, data, layout)
+            result = cache.get(key)
+            if result is None:
+                cache.misses += 1
+                active = True
+                try:
+                    result = compute_layer(self, data, layout)
+                finally:
+                    active = False
+                cache.put(key, result)
+            else:
+                cache.hits += 1
+            # Later stages of the build modify the data in place
+            return result.copy()
+
+        return cached_compute_layer
+
+    originals = {
+        cls: cls.__dict__["compute_layer"]
+        for cls in _stat_classes()
+        if "compute_layer" in cls.__dict__
+    }
+    for cls, compute_layer in originals.items():
+        cls.compute_layer = wrap(compute_layer)
+    try:
+        yield cache
+    finally:
+        for cls, compute_layer in originals.items():
+            cls.compute_layer = compute_layer
+
+
+class _Tracer(StatCache):
+    """
+    In-memory StatCache that records which cell computed each result
+    """
+
+    def __init__(self):
+        super().__init__(max_items=2**31)
+        self.cell = ""
+        self.origin: dict[str, str] = {}
+        self.reused: list[tuple[str, str]] = []
+
+    def get(self, key: str) -> pd.DataFrame | None:
+        result = super().get(key)
+        if result is not None:
+            self.reused.append((self.cell, self.origin[key]))
+        return result
+
+    def put(self, key: str, result: pd.DataFrame):
+        super().put(key, result)
+        self.origin[key] = self.cell
+
+
+def shared(path: str | Path) -> list[tuple[str, str]]:
+    """
+    Stat results that the cells of a notebook reuse from other cells
+
+    The plots of every plotting cell are built in file order, in this
+    process, through one cache. Cells and plots that fail are skipped.
+
+    Returns
+    -------
+    list[tuple[str, str]]
+        The cell that reused a result, and the cell that computed it,
+        once per reused result.
+    """
+    from plotnine import ggplot
+
+    from .notebook import Notebook, Runner
+    from .render import collect
+
+    notebook = Notebook(path)
+    runner = Runner(notebook)
+    tracer = _Tracer()
+    with install(tracer):
+        for cell in notebook.plot_cells():
+            tracer.cell = cell.name
+            try:
+                figures = collect(runner, cell)
+            except Exception:
+                continue
+            for fig in figures:
+                plots = fig.plots() if not isinstance(fig, ggplot) else [fig]
+                for plot in plots:
+                    try:
+                        plot._build()
+                    except Exception:
+                        pass
+    return tracer.reused
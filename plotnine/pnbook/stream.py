@@ -0,0 +1,903 @@
+"""
+Stats of datasets larger than memory
+
+A plot spec written for an in-memory frame, e.g.
+``ggplot(mpg, aes("hwy")) + geom_histogram(binwidth=1)``, can be
+pointed at a Parquet or CSV file with :func:`streamed`. The file is
+read in chunks of ``chunk_rows`` rows, the stats are computed as
+reductions over the chunks, and each layer is replaced by the same geom
+drawing the (small) result with ``stat="identity"``:
+
+- ``stat_bin`` (histograms, frequency polygons): the bin of a value
+  only depends on the bin width and boundary, so the counts of each
+  chunk are added up by bin.
+- ``stat_count`` (bars): counts by category, added up likewise.
+- ``stat_bin_2d`` and :class:`pnbook.bin2d.stat_bin_hex`: a first pass
+  finds the range of x and y, which gives the grid; the counts of the
+  chunks are then added up cell by cell (see :class:`pnbook.bin2d.Bins2D`).
+- ``stat_boxplot``: exact quantiles by radix selection. A first pass
+  counts the values of each group by the top bits of their (sortable)
+  binary representation, which tells in which bucket each quantile
+  lies; each further pass looks at the next bits of the values in those
+  buckets only, until a bucket is small enough to be kept and sorted,
+  or holds a single distinct value.
+  A last pass finds the ends of the whiskers and the outliers.
+  With ``relative_error``, the quartiles come from a mergeable sketch
+  (:class:`pnbook.approx.QuantileSketch`) filled in a single pass
+  instead.
+
+Peak memory depends on the chunk size, the number of groups and bins,
+and the ``budget`` of values kept per quantile, but not on the number
+of rows. The outliers of a boxplot are kept, so a very heavy tailed
+column can still use memory in proportion to its outliers.
+"""
+
+from __future__ import annotations
+
+from copy import deepcopy
+from math import ceil, floor
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Iterator, Sequence
+
+import numpy as np
+
+if TYPE_CHECKING:
+    import pandas as pd
+    from plotnine import ggplot
+
+# Bits of the keys looked at per radix selection pass
+RADIX_BITS = 12
+
+# Values kept per quantile for the final sort
+BUDGET = 1_000_000
+
+# Tolerance of the bin edges, relative to the bin width
+FUZZ = 1e-8
+
+_SIGN = np.uint64(1 << 63)
+
+
+class Source:
+    """
+    A dataset read in chunks
+
+    Parameters
+    ----------
+    data :
+        Parquet file (``.parquet``/``.pq``, read with pyarrow), CSV
+        file, or a dataframe (split into chunks, mostly for testing).
+    chunk_rows :
+        Rows per chunk.
+    """
+
+    def __init__(
+        self, data: str | Path | pd.DataFrame, chunk_rows: int = 1_000_000
+    ):
+        self.data = data if hasattr(data, "iloc") else Path(data)
+        self.chunk_rows = chunk_rows
+
+    def chunks(self, columns: Sequence[str]) -> Iterator[pd.DataFrame]:
+        columns = list(dict.fromkeys(columns))
+        if not isinstance(self.data, Path):
+            for start in range(0, len(self.data), self.chunk_rows):
+                yield self.data.iloc[start : start + self.chunk_rows][columns]
+        elif self.data.suffix in (".parquet", ".pq"):
+            import pyarrow.parquet as pq
+
+            file = pq.ParquetFile(self.data)
+            for batch in file.iter_batches(self.chunk_rows, columns=columns):
+                yield batch.to_pandas()
+        else:
+            import pandas as pd
+
+            yield from pd.read_csv(
+                self.data, usecols=columns, chunksize=self.chunk_rows
+            )
+
+
+def _groups(
+    chunk: pd.DataFrame, keys: Sequence[str]
+) -> Iterator[tuple[tuple, pd.DataFrame]]:
+    if not keys:
+        yield (), chunk
+        return
+    for key, sub in chunk.groupby(
+        list(keys), sort=False, observed=True, dropna=False
+    ):
+        yield (key if isinstance(key, tuple) else (key,)), sub
+
+
+def _merge(total: pd.Series | None, part: pd.Series) -> pd.Series:
+    if total is None:
+        return part
+    return total.add(part, fill_value=0)
+
+
+def _freedman_diaconis_bins(
+    quartiles: np.ndarray, lo: float, hi: float, n: int
+) -> int:
+    """
+    The number of bins stat_bin picks when given neither bins nor width
+
+    As ``plotnine.stats.binning.freedman_diaconis_bins``, from the
+    quartiles, range and number of values (missing ones included).
+    """
+    from warnings import warn
+
+    from plotnine.exceptions import PlotnineWarning
+
+    iqr = quartiles[1] - quartiles[0]
+    h = 2 * iqr / (n ** (1 / 3))
+    bins = int(np.ceil(np.sqrt(n)) if h == 0 else np.ceil((hi - lo) / h))
+    msg = "'stat_bin()' using 'bins = {}'. Pick better value with 'binwidth'."
+    warn(msg.format(bins), PlotnineWarning)
+    return bins
+
+
+def bin_counts(
+    source: Source,
+    x: str,
+    binwidth: float | None = None,
+    bins: int | None = None,
+    boundary: float | None = None,
+    center: float | None = None,
+    keys: Sequence[str] = (),
+    weight: str | None = None,
+    pad: bool = False,
+) -> pd.DataFrame:
+    """
+    stat_bin over a source, in one pass (more without ``binwidth``)
+
+    Bins are closed on the right, as stat_bin's are, and all the groups
+    share the same bins.
+
+    Returns
+    -------
+    pandas.DataFrame
+        Columns ``keys``, ``x`` (named after the x column; the bin
+        centre), ``xmin``, ``xmax``, ``count``, ``density``,
+        ``ncount``, ``ndensity`` and ``width``.
+    """
+    import pandas as pd
+
+    columns = [*keys, x] + ([weight] if weight else [])
+    if binwidth is None:
+        # Like stat_bin: the range of the data gives the bin width, and
+        # without bins, the Freedman-Diaconis rule gives their number
+        lo, hi, n = np.inf, -np.inf, 0
+        quartiles = None if bins else ExactQuantiles((0.25, 0.75))
+        first = True
+        while first or (quartiles is not None and not quartiles.done):
+            for chunk in source.chunks([x]):
+                values = chunk[x].to_numpy(dtype=float)
+                if first and len(values):
+                    n += len(values)
+                    lo = min(lo, np.nanmin(values))
+                    hi = max(hi, np.nanmax(values))
+                if quartiles is not None:
+                    quartiles.update(values)
+            if quartiles is not None:
+                quartiles.end_pass()
+            first = False
+        if quartiles is not None:
+            bins = _freedman_diaconis_bins(quartiles.values(), lo, hi, n)
+        binwidth = (hi - lo) / (bins - 1) if bins > 1 and hi > lo else 1.0
+    if boundary is None:
+        boundary = binwidth / 2 if center is None else center - binwidth / 2
+
+    counts: pd.Series | None = None
+    lo = np.inf
+    for chunk in source.chunks(columns):
+        values = chunk[x].to_numpy(dtype=float)
+        keep = ~np.isnan(values)
+        if not keep.any():
+            continue
+        values = values[keep]
+        lo = min(lo, values.min())
+        # Right-closed bins: a value on a boundary goes in the bin below,
+        # give or take the fuzz stat_bin adds to the breaks
+        index = np.ceil((values - boundary) / binwidth - FUZZ)
+        index = index.astype(np.int64) - 1
+        w = chunk[weight].to_numpy(dtype=float)[keep] if weight else 1.0
+        part = pd.DataFrame(
+            {
+                **{k: chunk[k].to_numpy()[keep] for k in keys},
+                "bin": index,
+                "count": w,
+            }
+        )
+        counts = _merge(
+            counts,
+            part.groupby([*keys, "bin"], sort=False, dropna=False)["count"]
+            .sum(),
+        )
+    if counts is None:
+        raise ValueError(f"No values of {x!r} to bin")
+
+    by = [*keys, "bin"]
+    res = counts.rename("count").reset_index()
+    first, last = int(res["bin"].min()), int(res["bin"].max())
+    # The lowest bin is closed on both sides: when the minimum sits on
+    # the right edge of the bin below it, that bin only holds the
+    # minimum, and its count belongs to the next bin up.
+    if last > first and lo > boundary + (first + 1 - FUZZ) * binwidth:
+        res.loc[res["bin"] == first, "bin"] = first + 1
+        res = res.groupby(by, sort=False, dropna=False)["count"].sum()
+        res = res.reset_index()
+        first += 1
+    if pad:
+        first, last = first - 1, last + 1
+
+    # Every group gets every bin, empty or not
+    full = pd.DataFrame({"bin": np.arange(first, last + 1)})
+    if keys:
+        full = res[list(keys)].drop_duplicates().merge(full, how="cross")
+    res = full.merge(res, on=by, how="left")
+    res["count"] = res["count"].fillna(0)
+
+    res["xmin"] = boundary + res["bin"] * binwidth
+    res["xmax"] = res["xmin"] + binwidth
+    res[x] = (res["xmin"] + res["xmax"]) / 2
+    res["width"] = binwidth
+    if keys:
+        grouped = res.groupby(list(keys), sort=False)["count"]
+        total, top = grouped.transform("sum"), grouped.transform("max")
+    else:
+        total, top = res["count"].sum(), res["count"].max()
+    res["density"] = res["count"] / (total * binwidth)
+    res["ncount"] = res["count"] / top
+    res["ndensity"] = res["ncount"]
+    return res.drop(columns="bin")
+
+
+def category_counts(
+    source: Source,
+    x: str,
+    keys: Sequence[str] = (),
+    weight: str | None = None,
+) -> pd.DataFrame:
+    """
+    stat_count over a source, in one pass
+
+    Returns
+    -------
+    pandas.DataFrame
+        Columns ``keys``, ``x`` (named after the x column), ``count``
+        and ``prop``.
+    """
+    columns = [*keys, x] + ([weight] if weight else [])
+    counts: pd.Series | None = None
+    for chunk in source.chunks(columns):
+        if weight:
+            part = chunk.groupby([*keys, x], sort=False, dropna=False)[
+                weight
+            ].sum()
+        else:
+            part = chunk.groupby([*keys, x], sort=False, dropna=False).size()
+        counts = _merge(counts, part)
+    if counts is None:
+        raise ValueError(f"No values of {x!r} to count")
+    res = counts.rename("count").reset_index()
+    res["prop"] = 1.0
+    return res
+
+
+def bin2d_counts(
+    source: Source,
+    x: str,
+    y: str,
+    hexagonal: bool = False,
+    bins: Any = 30,
+    binwidth: Any = None,
+    breaks: Any = None,
+    drop: bool = True,
+    keys: Sequence[str] = (),
+    weight: str | None = None,
+) -> pd.DataFrame:
+    """
+    stat_bin_2d (or stat_bin_hex) over a source, in two passes
+
+    All the groups share the same grid.
+
+    Returns
+    -------
+    pandas.DataFrame
+        Columns ``keys``, ``count`` and ``density``, and ``xmin``,
+        ``xmax``, ``ymin`` and ``ymax`` for rectangles, or ``x`` and
+        ``y`` (named after the x and y columns; the centres),
+        ``width`` and ``height`` for hexagons.
+    """
+    import pandas as pd
+    from plotnine.scales import scale_x_continuous, scale_y_continuous
+    from plotnine.stats.stat_bin_2d import dual_param
+
+    from .bin2d import Bins2D, hex_grid, rect_grid
+
+    lo, hi = np.full(2, np.inf), np.full(2, -np.inf)
+    for chunk in source.chunks([x, y]):
+        values = chunk[[x, y]].to_numpy(dtype=float)
+        values = values[np.isfinite(values).all(axis=1)]
+        if len(values):
+            lo = np.minimum(lo, values.min(axis=0))
+            hi = np.maximum(hi, values.max(axis=0))
+    if not np.isfinite(lo).all():
+        raise ValueError(f"No values of {x!r} and {y!r} to bin")
+    xscale, yscale = scale_x_continuous(), scale_y_continuous()
+    xscale.train(np.array([lo[0], hi[0]]))
+    yscale.train(np.array([lo[1], hi[1]]))
+    if hexagonal:
+        grid = hex_grid(xscale, yscale, dual_param(bins), dual_param(binwidth))
+    else:
+        grid = rect_grid(
+            xscale,
+            yscale,
+            dual_param(bins),
+            dual_param(breaks),
+            dual_param(binwidth),
+        )
+
+    columns = [*keys, x, y] + ([weight] if weight else [])
+    counts: dict[tuple, Bins2D] = {}
+    for chunk in source.chunks(columns):
+        for key, sub in _groups(chunk, keys):
+            if key not in counts:
+                counts[key] = Bins2D(grid)
+            counts[key].add(
+                sub[x].to_numpy(dtype=float),
+                sub[y].to_numpy(dtype=float),
+                sub[weight].to_numpy(dtype=float) if weight else None,
+            )
+
+    frames = []
+    for key, c in counts.items():
+        res = c.frame(drop)
+        for k, value in zip(keys, key):
+            res[k] = value
+        frames.append(res)
+    res = pd.concat(frames, ignore_index=True)
+    if hexagonal:
+        res = res.rename(columns={"x": x, "y": y})
+    return res
+
+
+def _sort_keys(x: np.ndarray) -> np.ndarray:
+    """
+    Unsigned integers that sort in the same order as the floats ``x``
+    """
+    bits = np.ascontiguousarray(x, dtype=np.float64).view(np.uint64)
+    return np.where(bits >> np.uint64(63), ~bits, bits | _SIGN)
+
+
+def _from_key(key: int) -> float:
+    k = np.uint64(key)
+    bits = k & ~_SIGN if k >> np.uint64(63) else ~k
+    return float(np.array([bits], dtype=np.uint64).view(np.float64)[0])
+
+
+class _Target:
+    """
+    An order statistic being looked for by radix selection
+    """
+
+    def __init__(self, rank: int):
+        self.rank = rank
+        self.depth = 0
+        """Number of leading bits of the key that are known"""
+
+        self.prefix = 0
+        """Value of those bits"""
+
+        self.below = 0
+        """Number of values with a smaller prefix"""
+
+        self.collect = False
+        self.value: float | None = None
+
+    @property
+    def work(self) -> tuple[bool, int, int]:
+        return (self.collect, self.depth, self.prefix)
+
+
+class ExactQuantiles:
+    """
+    Exact quantiles of values seen over several passes
+
+    Feed every chunk of values with :meth:`update`, call
+    :meth:`end_pass` after each pass, and repeat the passes while
+    :attr:`done` is false. Quantiles interpolate linearly between order
+    statistics, as ``numpy.quantile`` does by default.
+
+    Parameters
+    ----------
+    probs :
+        Probabilities of the quantiles.
+    budget :
+        Largest number of values kept in memory for one order
+        statistic.
+    """
+
+    def __init__(self, probs: Sequence[float], budget: int = BUDGET):
+        self.probs = tuple(probs)
+        self.budget = budget
+        self.n = 0
+        self.targets: list[_Target] | None = None
+        self._acc: dict[tuple[bool, int, int], Any] = {}
+
+    @property
+    def done(self) -> bool:
+        return self.targets is not None and all(
+            t.value is not None for t in self.targets
+        )
+
+    def _pending(self) -> list[tuple[bool, int, int]]:
+        if self.targets is None:
+            return [(False, 0, 0)]
+        return list(
+            dict.fromkeys(t.work for t in self.targets if t.value is None)
+        )
+
+    def update(self, x: np.ndarray):
+        x = np.asarray(x, dtype=float)
+        keys = _sort_keys(x[~np.isnan(x)])
+        for work in self._pending():
+            collect, depth, prefix = work
+            if depth:
+                mask = (keys >> np.uint64(64 - depth)) == np.uint64(prefix)
+                sel = keys[mask]
+            else:
+                sel = keys
+            if collect:
+                self._acc.setdefault(work, []).append(sel)
+                continue
+            bits = min(RADIX_BITS, 64 - depth)
+            shift = np.uint64(64 - depth - bits)
+            buckets = (sel >> shift) & np.uint64((1 << bits) - 1)
+            buckets = buckets.astype(np.intp)
+            if work not in self._acc:
+                size = 1 << bits
+                self._acc[work] = (
+                    np.zeros(size, dtype=np.int64),
+                    np.full(size, np.iinfo(np.uint64).max, dtype=np.uint64),
+                    np.zeros(size, dtype=np.uint64),
+                )
+            counts, lo, hi = self._acc[work]
+            counts += np.bincount(buckets, minlength=len(counts))
+            np.minimum.at(lo, buckets, sel)
+            np.maximum.at(hi, buckets, sel)
+
+    def end_pass(self):
+        acc, self._acc = self._acc, {}
+        if self.targets is None:
+            first = acc.get((False, 0, 0))
+            self.n = int(first[0].sum()) if first is not None else 0
+            if not self.n:
+                self.targets = []
+                return
+            ranks = set()
+            for p in self.probs:
+                h = (self.n - 1) * p
+                ranks.update((floor(h), ceil(h)))
+            self.targets = [_Target(r) for r in sorted(ranks)]
+
+        for t in self.targets:
+            if t.value is not None or t.work not in acc:
+                continue
+            if t.collect:
+                keys = np.sort(np.concatenate(acc[t.work]))
+                t.value = _from_key(int(keys[t.rank - t.below]))
+                continue
+            counts, lo, hi = acc[t.work]
+            bits = min(RADIX_BITS, 64 - t.depth)
+            cum = np.cumsum(counts)
+            b = int(np.searchsorted(cum, t.rank - t.below, side="right"))
+            if b:
+                t.below += int(cum[b - 1])
+            t.prefix = (t.prefix << bits) | b
+            t.depth += bits
+            if lo[b] == hi[b]:
+                # All the values in the bucket are the same (e.g. the
+                # data are integers), no need to look further
+                t.value = _from_key(int(lo[b]))
+            elif counts[b] <= self.budget:
+                t.collect = True
+
+    def values(self) -> np.ndarray:
+        """
+        The quantiles, once :attr:`done`
+        """
+        if not self.n:
+            return np.full(len(self.probs), np.nan)
+        found = {t.rank: t.value for t in self.targets or []}
+        res = []
+        for p in self.probs:
+            h = (self.n - 1) * p
+            lo, hi = found[floor(h)], found[ceil(h)]
+            res.append(lo + (h - floor(h)) * (hi - lo))
+        return np.array(res)
+
+
+class _Sketched:
+    """
+    Approximate quantiles, with the interface of :class:`ExactQuantiles`
+
+    The sketch is filled in one pass.
+    """
+
+    def __init__(self, probs: Sequence[float], relative_error: float):
+        from .approx import QuantileSketch
+
+        self.probs = tuple(probs)
+        self.sketch = QuantileSketch(relative_error)
+        self.done = False
+
+    @property
+    def n(self) -> float:
+        return self.sketch.n
+
+    def update(self, x: np.ndarray):
+        self.sketch.add(x)
+
+    def end_pass(self):
+        self.done = True
+
+    def values(self) -> np.ndarray:
+        return self.sketch.quantile(self.probs)
+
+
+class _Box:
+    """
+    Boxplot statistics of one group, over several passes
+    """
+
+    def __init__(
+        self, coef: float, budget: int, relative_error: float | None = None
+    ):
+        probs = (0.25, 0.5, 0.75)
+        self.coef = coef
+        self.quantiles: ExactQuantiles | _Sketched
+        if relative_error is None:
+            self.quantiles = ExactQuantiles(probs, budget)
+        else:
+            self.quantiles = _Sketched(probs, relative_error)
+        self.fences: tuple[float, float] | None = None
+        self.low = np.inf
+        self.high = -np.inf
+        self.outliers: list[np.ndarray] = []
+        self.done = False
+
+    def update(self, y: np.ndarray):
+        if self.fences is None:
+            self.quantiles.update(y)
+            return
+        lo, hi = self.fences
+        y = y[~np.isnan(y)]
+        inside = y[(y >= lo) & (y <= hi)]
+        if len(inside):
+            self.low = min(self.low, inside.min())
+            self.high = max(self.high, inside.max())
+        self.outliers.append(y[(y < lo) | (y > hi)])
+
+    def end_pass(self):
+        if self.fences is not None:
+            self.done = True
+            return
+        self.quantiles.end_pass()
+        if self.quantiles.done:
+            if not self.quantiles.n:
+                self.done = True
+                return
+            q1, _, q3 = self.quantiles.values()
+            iqr = q3 - q1
+            self.fences = (q1 - self.coef * iqr, q3 + self.coef * iqr)
+
+    def stats(self) -> dict[str, Any]:
+        q1, med, q3 = self.quantiles.values()
+        n = self.quantiles.n
+        notch = 1.58 * (q3 - q1) / np.sqrt(n)
+        return {
+            "ymin": self.low,
+            "lower": q1,
+            "middle": med,
+            "upper": q3,
+            "ymax": self.high,
+            "notchlower": med - notch,
+            "notchupper": med + notch,
+            "relvarwidth": np.sqrt(n),
+        }
+
+
+def boxplot_stats(
+    source: Source,
+    x: str | None,
+    y: str,
+    keys: Sequence[str] = (),
+    coef: float = 1.5,
+    budget: int = BUDGET,
+    relative_error: float | None = None,
+) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    stat_boxplot over a source
+
+    The quartiles are exact, or within ``relative_error`` of the exact
+    ones when it is given.
+
+    Returns
+    -------
+    tuple[pandas.DataFrame, pandas.DataFrame]
+        The statistics of each group (columns ``x``, ``keys``, ``ymin``,
+        ``lower``, ``middle``, ``upper``, ``ymax``, ``notchlower``,
+        ``notchupper``, ``relvarwidth``) and the outliers (columns
+        ``x``, ``keys`` and ``y``).
+    """
+    import pandas as pd
+
+    by = ([x] if x else []) + [k for k in keys if k != x]
+    boxes: dict[tuple, _Box] = {}
+    first = True
+    while first or not all(b.done for b in boxes.values()):
+        for chunk in source.chunks([*by, y]):
+            for key, sub in _groups(chunk, by):
+                box = boxes.get(key)
+                if box is None:
+                    if not first:
+                        continue
+                    box = boxes[key] = _Box(coef, budget, relative_error)
+                if not box.done:
+                    box.update(sub[y].to_numpy(dtype=float))
+        for box in boxes.values():
+            if not box.done:
+                box.end_pass()
+        first = False
+
+    rows, outliers = [], []
+    for key, box in boxes.items():
+        if not box.quantiles.n:
+            continue
+        rows.append({**dict(zip(by, key)), **box.stats()})
+        out = np.concatenate(box.outliers) if box.outliers else []
+        if len(out):
+            outliers.append(pd.DataFrame({**dict(zip(by, key)), y: out}))
+    stats = pd.DataFrame(rows)
+    if outliers:
+        out = pd.concat(outliers, ignore_index=True)
+    else:
+        out = pd.DataFrame(columns=[*by, y])
+    return stats, out
+
+
+# Geoms of stat_bin drawn as lines rather than bars
+LINE_GEOMS = ("geom_freqpoly", "geom_line", "geom_path")
+
+# Aesthetics that are positions, not groupings
+_POSITION_AES = {"x", "y", "weight"}
+
+
+def _column(value: Any, what: str) -> str:
+    if isinstance(value, str):
+        return value
+    raise ValueError(f"Only columns can be streamed, not {what}={value!r}")
+
+
+def _like(frame: pd.DataFrame, spec: Any) -> pd.DataFrame:
+    """
+    Give the columns of ``frame`` the categories they have in ``spec``
+
+    A CSV file has no categoricals, the frame the plot was written for
+    may have them; they set the order of the levels.
+    """
+    if not hasattr(spec, "dtypes"):
+        return frame
+    for name in frame.columns:
+        if name in spec and spec[name].dtype == "category":
+            frame[name] = frame[name].astype(spec[name].dtype)
+    return frame
+
+
+def _stat_column(value: Any) -> str | None:
+    """
+    Name of the computed variable of an ``after_stat("...")`` mapping
+    """
+    inner = getattr(value, "after_stat", None)
+    return inner if isinstance(inner, str) else None
+
+
+def streamed(
+    plot: ggplot,
+    data: str | Path | pd.DataFrame | Source,
+    chunk_rows: int = 1_000_000,
+    budget: int = BUDGET,
+    relative_error: float | None = None,
+) -> ggplot:
+    """
+    Point a plot at a dataset read in chunks
+
+    Parameters
+    ----------
+    plot :
+        Plot whose layers are histograms, frequency polygons, bars,
+        boxplots or 2D bins. Its mapping and facets must refer to columns.
+    data :
+        The dataset, see :class:`Source`.
+    chunk_rows :
+        Rows per chunk.
+    budget :
+        Values kept per quantile of a boxplot.
+    relative_error :
+        If given, the quartiles of boxplots are approximated within
+        this relative error, in one pass over the data rather than a
+        few.
+
+    Returns
+    -------
+    ggplot
+        The plot, with the stats already computed and each layer
+        drawing them with ``stat="identity"``.
+
+    Examples
+    --------
+    >>> p = ggplot(mpg, aes("hwy")) + geom_histogram(binwidth=1)
+    >>> streamed(p, "trips.parquet")
+    """
+    from plotnine import (
+        aes,
+        geom_boxplot,
+        geom_col,
+        geom_line,
+        geom_point,
+        labs,
+    )
+    from plotnine.stats import stat_bin, stat_bin_2d, stat_boxplot, stat_count
+
+    from .bin2d import geom_bin_2d, geom_hex, stat_bin_hex
+
+    source = data if isinstance(data, Source) else Source(data, chunk_rows)
+    facet_vars = [v for v in getattr(plot.facet, "vars", ()) if v]
+    new = deepcopy(plot)
+    new.data = None
+    new.mapping = aes()
+    new.layers = type(plot.layers)()
+
+    for layer in plot.layers:
+        mapping = dict(layer.mapping)
+        if layer.inherit_aes:
+            mapping = {**plot.mapping, **mapping}
+        # A constant group, as in aes(group=1), puts everything in one
+        # group
+        groups = {
+            name: _column(value, name)
+            for name, value in mapping.items()
+            if name not in _POSITION_AES
+            and not (name == "group" and not isinstance(value, str))
+            and _stat_column(value) is None
+        }
+        keys = list(dict.fromkeys([*groups.values(), *facet_vars]))
+        weight = mapping.get("weight")
+        weight = _column(weight, "weight") if weight is not None else None
+        params = layer.stat.params
+        spec = layer.geom.data
+        if not hasattr(spec, "dtypes"):
+            spec = plot.data
+        geom_params = {
+            **layer.geom.aes_params,
+            "position": deepcopy(layer.position),
+        }
+
+        if isinstance(layer.stat, stat_bin):
+            x = _column(mapping["x"], "x")
+            y = _stat_column(mapping.get("y")) or "count"
+            freqpoly = type(layer.geom).__name__ in LINE_GEOMS
+            res = bin_counts(
+                source,
+                x,
+                params.get("binwidth"),
+                params.get("bins"),
+                params.get("boundary"),
+                params.get("center"),
+                keys,
+                weight,
+                pad=bool(params.get("pad")),
+            )
+            res = _like(res, spec)
+            m = aes(x=x, y=y, **groups)
+            if freqpoly:
+                new += geom_line(m, data=res, **geom_params)
+            else:
+                width = float(res["width"].iloc[0])
+                new += geom_col(m, data=res, width=width, **geom_params)
+        elif isinstance(layer.stat, stat_count):
+            x = _column(mapping["x"], "x")
+            y = _stat_column(mapping.get("y")) or "count"
+            res = _like(category_counts(source, x, keys, weight), spec)
+            if "group" in mapping:
+                # Otherwise each bar is a group of its own, with prop 1
+                by = list(facet_vars)
+                if "group" in groups:
+                    by.append(groups["group"])
+                if by:
+                    grouped = res.groupby(by, sort=False)["count"]
+                    total = grouped.transform("sum")
+                else:
+                    total = res["count"].sum()
+                res["prop"] = res["count"] / total
+            new += geom_col(aes(x=x, y=y, **groups), data=res, **geom_params)
+        elif isinstance(layer.stat, (stat_bin_2d, stat_bin_hex)):
+            x = _column(mapping["x"], "x")
+            y = _column(mapping["y"], "y")
+            fill = _stat_column(mapping.get("fill")) or "count"
+            hexagonal = isinstance(layer.stat, stat_bin_hex)
+            res = bin2d_counts(
+                source,
+                x,
+                y,
+                hexagonal,
+                params.get("bins", 30),
+                params.get("binwidth"),
+                params.get("breaks"),
+                params.get("drop", True),
+                keys,
+                weight,
+            )
+            res = _like(res, spec)
+            if hexagonal:
+                m = aes(x=x, y=y, width="width", height="height", fill=fill)
+                new += geom_hex(m, data=res, stat="identity", **geom_params)
+            else:
+                m = aes(
+                    xmin="xmin",
+                    xmax="xmax",
+                    ymin="ymin",
+                    ymax="ymax",
+                    fill=fill,
+                )
+                new += geom_bin_2d(m, data=res, stat="identity", **geom_params)
+                # Not xmin and ymin
+                default = {"x": x, "y": y}
+                new += labs(
+                    **{
+                        k: v
+                        for k, v in default.items()
+                        if getattr(new.labels, k) is None
+                    }
+                )
+        elif isinstance(layer.stat, stat_boxplot):
+            x = mapping.get("x")
+            x = _column(x, "x") if x is not None else None
+            y = _column(mapping["y"], "y")
+            stats, outliers = boxplot_stats(
+                source,
+                x,
+                y,
+                keys,
+                params.get("coef", 1.5),
+                budget,
+                relative_error,
+            )
+            stats, outliers = _like(stats, spec), _like(outliers, spec)
+            if x is None:
+                stats["x"] = outliers["x"] = 0
+                x = "x"
+            box = aes(
+                x=x,
+                ymin="ymin",
+                lower="lower",
+                middle="middle",
+                upper="upper",
+                ymax="ymax",
+                **groups,
+            )
+            # stat_boxplot's width on a discrete axis
+            width = params.get("width") or 0.75
+            new += geom_boxplot(
+                box, data=stats, stat="identity", width=width, **geom_params
+            )
+            if len(outliers):
+                point = {
+                    k: v for k, v in groups.items() if k in ("color", "colour")
+                }
+                new += geom_point(aes(x=x, y=y, **point), data=outliers)
+        else:
+            raise ValueError(
+                f"Cannot stream {type(layer.stat).__name__} layers"
+            )
+
+    return new
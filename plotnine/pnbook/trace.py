@@ -0,0 +1,298 @@
+"""
+Per-stage profile of the plotnine build
+
+The Python counterpart of ``internals_ggbuild.R``. That script copies
+ggplot2's ``ggplot_build()`` and records the layer data after each
+stage in ``all_steps``. Rather than copy ``ggplot._build``, the methods
+it calls on the layers and on the layout are wrapped for the duration
+of a trace, and each records:
+
+- the wall time it took,
+- the peak memory allocated while it ran (with ``tracemalloc``),
+- the number of rows of each layer's data after it,
+- optionally, a copy of each layer's data after it, like ``all_steps``.
+
+Drawing is timed after the build in two parts: plotnine creating the
+matplotlib artists, and matplotlib rendering them. Methods that a
+version of plotnine does not have are skipped, and the time between the
+traced steps is reported as ``other``.
+"""
+
+from __future__ import annotations
+
+import time
+import tracemalloc
+from contextlib import contextmanager
+from copy import deepcopy
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Any, Callable, Iterator
+
+if TYPE_CHECKING:
+    import pandas as pd
+    from plotnine import ggplot
+
+    from .notebook import Notebook
+
+# The methods called by ggplot._build, in order, and the name of the
+# stage each completes. Stages that run more than once (the position
+# scales are trained and mapped before and after the stats) get a
+# numbered name the second time.
+STEPS = (
+    ("Layers", "setup", "setup"),
+    ("Layout", "setup", "layout"),
+    ("Layers", "compute_aesthetics", "prepared"),
+    ("Layers", "transform", "transformed"),
+    ("Layout", "train_position", "trained"),
+    ("Layout", "map_position", "positioned"),
+    ("Layers", "compute_statistic", "stat"),
+    ("Layers", "map_statistic", "poststat"),
+    ("Layers", "setup_data", "geom"),
+    ("Layers", "compute_position", "geompos"),
+    ("Layout", "reset_position_scales", "reset"),
+    ("Layers", "train", "scales_trained"),
+    ("Layers", "map", "scales_mapped"),
+    ("Layout", "setup_panel_params", "panel_params"),
+    ("Layers", "use_defaults", "defaults"),
+    ("Layers", "finish_statistics", "finish_statistics"),
+    ("Layout", "finish_data", "built"),
+)
+
+
+@dataclass
+class Step:
+    """
+    One stage of the build
+    """
+
+    name: str
+    method: str
+    seconds: float
+    peak_memory: int | None
+    """Bytes allocated at the peak of the stage, None if not measured"""
+
+    rows: tuple[int, ...]
+    """Rows of the data of each layer after the stage"""
+
+    data: list[pd.DataFrame] | None = None
+    """Copy of the data of each layer after the stage"""
+
+
+@dataclass
+class Trace:
+    """
+    Profile of the build and draw of one plot
+    """
+
+    steps: list[Step] = field(default_factory=list)
+    build: float = 0.0
+    """Wall time of the whole build"""
+
+    draw: float | None = None
+    """Time plotnine took to create the artists, after the build"""
+
+    render: float | None = None
+    """Time matplotlib took to render the figure"""
+
+    @property
+    def other(self) -> float:
+        """
+        Time of the build not spent in a traced step
+        """
+        return self.build - sum(s.seconds for s in self.steps)
+
+    def __getitem__(self, name: str) -> Step:
+        for step in self.steps:
+            if step.name == name:
+                return step
+        raise KeyError(name)
+
+    def table(self) -> str:
+        lines = [f"{'stage':<20} {'time':>9} {'peak mem':>11}  rows"]
+        for s in self.steps:
+            mem = (
+                "-"
+                if s.peak_memory is None
+                else f"{s.peak_memory / 2**20:.1f} MB"
+            )
+            rows = " ".join(map(str, s.rows))
+            lines.append(f"{s.name:<20} {s.seconds:>8.4f}s {mem:>11}  {rows}")
+        lines.append(f"{'other':<20} {self.other:>8.4f}s")
+        lines.append(f"{'build':<20} {self.build:>8.4f}s")
+        if self.draw is not None:
+            lines.append(f"{'draw':<20} {self.draw:>8.4f}s")
+        if self.render is not None:
+            lines.append(f"{'render':<20} {self.render:>8.4f}s")
+        return "\n".join(lines)
+
+
+def _layers(obj: Any, args: tuple) -> list:
+    """
+    The layers a build method works on: itself or one of its arguments
+    """
+    from plotnine.layer import Layers
+
+    for candidate in (obj, *args):
+        if isinstance(candidate, Layers):
+            return candidate
+    return []
+
+
+class _Recorder:
+    def __init__(self, trace: Trace, memory: bool, keep_data: bool):
+        self.trace = trace
+        self.memory = memory
+        self.keep_data = keep_data
+        self.depth = 0
+        self.seen: dict[str, int] = {}
+
+    def wrap(self, cls: type, method: str, name: str) -> Callable:
+        fn = getattr(cls, method)
+        qualname = f"{cls.__name__}.{method}"
+
+        def traced(obj, *args, **kwargs):
+            if self.depth:
+                return fn(obj, *args, **kwargs)
+            self.depth += 1
+            if self.memory:
+                tracemalloc.reset_peak()
+                base = tracemalloc.get_traced_memory()[0]
+            start = time.perf_counter()
+            try:
+                return fn(obj, *args, **kwargs)
+            finally:
+                seconds = time.perf_counter() - start
+                self.depth -= 1
+                peak = None
+                if self.memory:
+                    peak = max(tracemalloc.get_traced_memory()[1] - base, 0)
+                self._record(name, qualname, seconds, peak, obj, args)
+
+        return traced
+
+    def _record(self, name, qualname, seconds, peak, obj, args):
+        n = self.seen[name] = self.seen.get(name, 0) + 1
+        if n > 1:
+            name = f"{name}-{n}"
+        layers = _layers(obj, args)
+        frames = [layer.data for layer in layers]
+        rows = tuple(len(f) if f is not None else 0 for f in frames)
+        data = None
+        if self.keep_data:
+            data = [f.copy() if f is not None else None for f in frames]
+        step = Step(name, qualname, seconds, peak, rows, data)
+        self.trace.steps.append(step)
+
+
+@contextmanager
+def _instrument(recorder: _Recorder) -> Iterator[None]:
+    from plotnine import ggplot
+    from plotnine.facets.layout import Layout
+    from plotnine.layer import Layers
+
+    classes = {"Layers": Layers, "Layout": Layout}
+    originals = []
+    for cls_name, method, name in STEPS:
+        cls = classes[cls_name]
+        if method in vars(cls):
+            originals.append((cls, method, vars(cls)[method]))
+            setattr(cls, method, recorder.wrap(cls, method, name))
+
+    build = ggplot._build
+
+    def _build(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return build(self, *args, **kwargs)
+        finally:
+            recorder.trace.build += time.perf_counter() - start
+
+    originals.append((ggplot, "_build", build))
+    ggplot._build = _build  # type: ignore[method-assign]
+    try:
+        yield
+    finally:
+        for cls, method, fn in originals:
+            setattr(cls, method, fn)
+
+
+def trace(
+    plot: ggplot,
+    draw: bool = True,
+    memory: bool = True,
+    keep_data: bool = False,
+) -> Trace:
+    """
+    Profile the build (and draw) of a plot, stage by stage
+
+    Parameters
+    ----------
+    plot :
+        Plot to profile. It is not modified.
+    draw :
+        Also time the drawing after the build.
+    memory :
+        Measure the peak memory of each stage. ``tracemalloc`` slows
+        down allocations, so the times are a little higher with it.
+    keep_data :
+        Keep a copy of each layer's data after each stage, as the
+        ``all_steps`` of ``internals_ggbuild.R``.
+
+    Examples
+    --------
+    >>> t = trace(ggplot(mpg, aes("drv", "hwy")) + geom_violin())
+    >>> print(t.table())
+    >>> t["stat"].seconds, t.draw
+    """
+    import matplotlib.pyplot as plt
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+    plot = deepcopy(plot)
+    result = Trace()
+    recorder = _Recorder(result, memory, keep_data)
+    started = memory and not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start()
+    try:
+        with _instrument(recorder):
+            if draw:
+                start = time.perf_counter()
+                figure = plot.draw(show=False)
+                result.draw = time.perf_counter() - start - result.build
+                if not isinstance(figure.canvas, FigureCanvasAgg):
+                    FigureCanvasAgg(figure)
+                start = time.perf_counter()
+                figure.canvas.draw()
+                result.render = time.perf_counter() - start
+                plt.close(figure)
+            else:
+                plot._build()
+    finally:
+        if started:
+            tracemalloc.stop()
+    return result
+
+
+def trace_cell(notebook: Notebook, name: str, **kwargs) -> list[Trace]:
+    """
+    Profile every plot a cell displays
+
+    Parameters
+    ----------
+    notebook :
+        Notebook.
+    name :
+        Name of the cell, e.g. ``"cell-042"``.
+    kwargs :
+        Passed on to :func:`trace`.
+    """
+    from .notebook import Runner
+    from .render import Composition, collect
+
+    cell = next((c for c in notebook.cells if c.name == name), None)
+    if cell is None:
+        raise KeyError(f"No cell named {name!r}")
+    traces = []
+    for fig in collect(Runner(notebook), cell):
+        plots = fig.plots() if isinstance(fig, Composition) else [fig]
+        traces.extend(trace(p, **kwargs) for p in plots)
+    return traces
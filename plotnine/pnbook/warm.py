@@ -0,0 +1,169 @@
+"""
+Warm worker processes and the cold start time of the first figure
+
+Every render worker used to start a fresh interpreter and import
+matplotlib, pandas and plotnine on its own before drawing anything.
+Render pools are now started from a fork server that has imported those
+packages once: each worker is a fork of the warm server and starts with
+everything imported. The workers then run the notebook's setup cells
+(imports and datasets) before taking any cell to draw, and the pool is
+kept for the next render of the notebook (see :mod:`pnbook.render`).
+
+:func:`measure_startup` times what a user waits for after typing a
+command, by stage: a new interpreter, the imports of pandas, of
+matplotlib's font cache and pyplot, and of plotnine, the notebook's
+setup cells, the first figure drawn to a file, and the interpreter's
+exit. It also times the
+same figure drawn again by a warm renderer, which is what a pool worker
+pays for it.
+"""
+
+from __future__ import annotations
+
+import json
+import multiprocessing
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+
+# Module imported by the fork server
+PRELOAD = "pnbook._preload"
+
+# Stages of a cold start, and the modules imported by each
+IMPORTS = (
+    ("pandas", "pandas"),
+    ("font cache", "matplotlib.font_manager"),
+    ("pyplot", "matplotlib.pyplot"),
+    ("plotnine", "plotnine"),
+)
+
+
+def context() -> multiprocessing.context.BaseContext:
+    """
+    Multiprocessing context whose processes start with plotnine imported
+
+    Falls back to the default context where there is no fork server.
+    """
+    if "forkserver" not in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context()
+    ctx = multiprocessing.get_context("forkserver")
+    ctx.set_forkserver_preload([PRELOAD])
+    return ctx
+
+
+@dataclass
+class Startup:
+    """
+    Time from starting python to the first figure in a file
+    """
+
+    cell: str
+    first: float
+    """Time from the start of the interpreter to the first figure"""
+
+    stages: dict[str, float] = field(default_factory=dict)
+    """Time of each stage of the cold start, in order"""
+
+    warm: float = 0.0
+    """Time to draw the figure again, with everything imported and the
+    setup cells run"""
+
+    error: str | None = None
+
+
+def _first_figure(path: str, outdir: str, launched: float):
+    """
+    Draw the first figure of a notebook and print the timings as JSON
+
+    Runs in the interpreter started by :func:`measure_startup`, at
+    ``launched`` (seconds since the epoch).
+    """
+    import importlib
+
+    stages = {"interpreter": time.time() - launched}
+    for name, module in IMPORTS:
+        start = time.perf_counter()
+        importlib.import_module(module)
+        stages[name] = time.perf_counter() - start
+
+    from . import data
+    from .notebook import Notebook
+    from .render import Renderer
+
+    data.install()
+    notebook = Notebook(path)
+    renderer = Renderer(notebook, outdir)
+    # The first cell that draws a plot, not the first that reads
+    # something, which may only display a table
+    for cell in notebook.plot_cells():
+        if "ggplot" not in cell.source:
+            continue
+        start = time.perf_counter()
+        renderer.warm([cell])
+        setup = time.perf_counter() - start
+        result = renderer.render(cell)
+        if result.files or result.error:
+            break
+    else:
+        raise RuntimeError(f"{path} has no cell that draws a plot")
+    stages["setup cells"] = setup
+    stages["first figure"] = result.total_time
+    done = time.time() - launched
+    warm = renderer.render(cell)
+    print(
+        json.dumps(
+            {
+                "cell": cell.name,
+                "stages": stages,
+                "done": done,
+                "warm": warm.total_time,
+                "error": result.error,
+            }
+        )
+    )
+
+
+def measure_startup(path: str | Path) -> Startup:
+    """
+    Time a cold start, from a new interpreter to the first figure
+
+    Parameters
+    ----------
+    path :
+        Notebook file.
+    """
+    from . import data
+
+    data.prepare()
+    env = dict(os.environ)
+    env["MPLBACKEND"] = "Agg"
+    code = (
+        "import sys;"
+        "from pnbook.warm import _first_figure;"
+        "_first_figure(sys.argv[1], sys.argv[2], float(sys.argv[3]))"
+    )
+    with tempfile.TemporaryDirectory() as outdir:
+        start = time.perf_counter()
+        launched = str(time.time())
+        args = [str(Path(path).resolve()), outdir, launched]
+        proc = subprocess.run(
+            [sys.executable, "-c", code, *args],
+            cwd=Path(__file__).parent.parent,
+            env=env,
+            capture_output=True,
+            text=True,
+        )
+        first = time.perf_counter() - start
+    if proc.returncode:
+        lines = proc.stderr.strip().splitlines() or ["failed"]
+        return Startup("", first, error=lines[-1])
+    out = json.loads(proc.stdout.strip().splitlines()[-1])
+    # The figure drawn again is not part of the cold start, the exit of
+    # the interpreter is
+    first -= out["warm"]
+    stages = {**out["stages"], "exit": first - out["done"]}
+    return Startup(out["cell"], first, stages, out["warm"], out["error"])